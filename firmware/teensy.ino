@@ -6,10 +6,18 @@
  * https://www.pjrc.com/store/octo28_adaptor.html
  *
  * It listens on the USB UART and waits for the host to
- * send a predefined header ("head"), followed by the 3-byte GRB color values
- * of the individual LEDs. At this point, the Teensy pushes the color values
- * to the LED array. The OctoWS2811 library does the heavy lifting in terms of
- * communication.
+ * send a predefined header, followed by the color values of the LEDs. At this
+ * point, the Teensy pushes the color values to the LED array. The OctoWS2811
+ * library does the heavy lifting in terms of communication.
+ *
+ * Two kinds of frames are understood (see lightoy/serial_protocol.py):
+ *  - "head", followed by the 3-byte GRB color values of all the LEDs.
+ *  - "hear", followed by run-length encoded changes from the previous frame.
+ *    Each run starts with a byte whose top two bits give the kind of run and
+ *    whose bottom six bits give the number of LEDs in the run, minus one:
+ *      0: skip; the LEDs keep their colors.
+ *      1: literal; followed by the GRB values of each LED in the run.
+ *      2: fill; followed by one GRB value that all the LEDs are set to.
  */
  
 #include <OctoWS2811.h>
@@ -27,42 +35,102 @@ void setup() {
   Serial.begin(115200); // USB is always 12 Mbit/sec
 }
 
-// The header that is expected before every frame of input data.
-const String kHeader = "head";
+// The header prefix that is expected before every frame of input data. It's
+// followed by a byte giving the kind of frame.
+const String kHeaderPrefix = "hea";
+const char kFullFrame = 'd';
+const char kDeltaFrame = 'r';
+
+// Kinds of runs in delta frames.
+const int kSkipRun = 0;
+const int kLiteralRun = 1;
+const int kFillRun = 2;
 
-// The number of header
+// The number of header bytes parsed so far.
 unsigned int headerBytesParsed = 0;
 
 // 24-bit GRB value for each pixel.
 char dataBuffer[kNumLeds * 3];
 
+int getColor(const char* grb) {
+  return ((int)(uint8_t)grb[0] << 16) +
+         ((int)(uint8_t)grb[1] << 8) +
+         ((int)(uint8_t)grb[2]);
+}
+
+// Reads the GRB values of all the LEDs.
+void readFullFrame() {
+  unsigned int numBytes = kNumLeds * 3;
+  if (Serial.readBytes(dataBuffer, numBytes) == numBytes) {
+    for (int led = 0; led < kNumLeds; led++) {
+      leds.setPixel(led, getColor(dataBuffer + 3 * led));
+    }
+    leds.show();
+  }
+}
+
+// Reads runs of changes until all the LEDs are covered. The unchanged LEDs
+// keep the values previously set in the drawing memory. The host may send
+// more LEDs than there are: a run that goes past the last LED is applied to
+// the LEDs it covers, and the rest of its bytes are consumed, just like the
+// extra bytes of a full frame.
+void readDeltaFrame() {
+  int led = 0;
+  while (led < kNumLeds) {
+    char op;
+    if (Serial.readBytes(&op, 1) != 1) {
+      return;
+    }
+    int kind = (op >> 6) & 0x3;
+    int count = (op & 0x3f) + 1;
+    int numSet = min(count, kNumLeds - led);
+    if (kind == kLiteralRun) {
+      unsigned int numBytes = count * 3;
+      if (Serial.readBytes(dataBuffer, numBytes) != numBytes) {
+        return;
+      }
+      for (int i = 0; i < numSet; i++) {
+        leds.setPixel(led + i, getColor(dataBuffer + 3 * i));
+      }
+    } else if (kind == kFillRun) {
+      if (Serial.readBytes(dataBuffer, 3) != 3) {
+        return;
+      }
+      int color = getColor(dataBuffer);
+      for (int i = 0; i < numSet; i++) {
+        leds.setPixel(led + i, color);
+      }
+    } else if (kind != kSkipRun) {
+      // Corrupt frame; wait for the next header.
+      return;
+    }
+    led += count;
+  }
+  leds.show();
+}
+
 void loop() {
   if (Serial.available()) {
     // Read bytes one by one until we found that we've read the entire header.
     char input = Serial.read();
-    if (input == kHeader[headerBytesParsed]) {
+    if (headerBytesParsed >= kHeaderPrefix.length()) {
+      // The prefix was parsed; this byte gives the kind of frame.
+      headerBytesParsed = 0;
+      if (input == kFullFrame) {
+        readFullFrame();
+      } else if (input == kDeltaFrame) {
+        readDeltaFrame();
+      } else if (input == kHeaderPrefix[0]) {
+        // Not a known kind of frame, but it may start the next header.
+        headerBytesParsed = 1;
+      }
+    } else if (input == kHeaderPrefix[headerBytesParsed]) {
       // We received the expected header byte.
       headerBytesParsed++;
     } else {
       // The byte did not match the expected header byte, so
       // start over.
-      headerBytesParsed = 0;
-    }
-    if (headerBytesParsed >= kHeader.length()) {
-      // Once we've encountered the proper header, read the LED color values.
-      headerBytesParsed = 0;
-      unsigned int numBytes = kNumLeds * 3;
-      if (Serial.readBytes(dataBuffer, numBytes) == numBytes) {
-        for (int led = 0; led < kNumLeds; led++) {
-          int color =
-              ((int)dataBuffer[3 * led]     << 16) +
-              ((int)dataBuffer[3 * led + 1] << 8) +
-              ((int)dataBuffer[3 * led + 2]);
-          leds.setPixel(led, color);
-        }
-        leds.show();
-      }
+      headerBytesParsed = (input == kHeaderPrefix[0]) ? 1 : 0;
     }
   }
 }
-
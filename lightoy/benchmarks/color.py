@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of the color conversions done for every rendered frame.
+
+Reports the per-frame cost of the vectorized conversions in lightoy.color,
+alongside the per-LED colorsys loop they replaced, for several LED counts.
+"""
+
+import click
+import colorsys
+import numpy
+import timeit
+
+import lightoy.color
+
+
+def time_per_call(fn, repeat):
+    """Returns the best average time (in seconds) of a single call to fn."""
+    n_calls = max(1, repeat // 5)
+    return min(timeit.repeat(fn, number=n_calls, repeat=5)) / n_calls
+
+
+def benchmark(num_leds, repeat, gamma=3.):
+    rgb = numpy.random.rand(3, num_leds)
+    hsv = lightoy.color.rgb_to_hsv(rgb)
+    out = numpy.empty((3, num_leds))
+    results = {
+        'rgb_to_hsv': time_per_call(
+            lambda: lightoy.color.rgb_to_hsv(rgb, out=out), repeat),
+        'hsv_to_rgb': time_per_call(
+            lambda: lightoy.color.hsv_to_rgb(hsv, out=out), repeat),
+        'gamma_correct': time_per_call(
+            lambda: lightoy.color.gamma_correct(rgb, gamma, out=out), repeat),
+    }
+
+    def colorsys_gamma_correct():
+        hsv = lightoy.color.color_convert(rgb, colorsys.rgb_to_hsv)
+        hsv[2, :] **= gamma
+        return lightoy.color.color_convert(hsv, colorsys.hsv_to_rgb)
+
+    # The per-LED loop is slow, so it gets far fewer repetitions.
+    results['colorsys_gamma_correct'] = time_per_call(
+        colorsys_gamma_correct, max(5, repeat * 300 // num_leds // 100))
+    return results
+
+
+@click.command()
+@click.option("--num_leds", type=int, multiple=True,
+              default=[300, 3000, 30000])
+@click.option("--repeat", type=int, default=500,
+              help="Approximate number of timed calls per measurement.")
+def main(num_leds, repeat):
+    print("%8s %22s %12s" % ("leds", "function", "ms/frame"))
+    for n in num_leds:
+        for name, seconds in benchmark(n, repeat).items():
+            print("%8d %22s %12.4f" % (n, name, seconds * 1000.))
+
+
+if __name__ == "__main__":
+    main()
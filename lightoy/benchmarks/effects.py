@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Headless benchmark of every registered effect.
+
+For each effect and LED count, frames are rendered through the same render()
+that the server uses (including gamma and brightness correction), while a
+synthetic touch sequence is fed to the session's input processor. Reports the
+mean and 99th percentile frame time, and the memory allocated per frame, as
+JSON so that runs can be compared to catch performance regressions.
+"""
+
+import click
+import contextlib
+import json
+import numpy
+import sys
+import time
+import tracemalloc
+
+from lightoy.location_model import Spiral
+from lightoy.server.lightoy_server import render
+from lightoy.session import Session
+
+
+def synthetic_touches(frame, n_frames):
+    """Returns the touches (as sent by the touchpad) for the given frame:
+    a finger is dragged around a circle during the first half of the run and
+    released for the second half, so both the touch and momentum paths of the
+    input processor are exercised."""
+    if frame >= n_frames // 2:
+        return []
+    angle = 2. * numpy.pi * frame / max(1, n_frames // 2)
+    return [{'x': 0.5 + 0.4 * numpy.cos(angle),
+             'y': 0.5 + 0.4 * numpy.sin(angle)}]
+
+
+def feed_input(session, frame, n_frames):
+    input_processor = session.input_processor
+    t = session.get_time()
+    touches = synthetic_touches(frame, n_frames)
+    was_touching = bool(input_processor.get_touches())
+    if touches and not was_touching:
+        input_processor.on_touch_start(touches, t)
+    elif touches:
+        input_processor.on_touch_move(touches, t)
+    elif was_touching:
+        input_processor.on_touch_end(t)
+
+
+def run_frames(session, location_model, n_frames):
+    """Renders n_frames frames, returning the time taken by each (in
+    seconds)."""
+    frame_times = numpy.zeros(n_frames)
+    for frame in range(n_frames):
+        feed_input(session, frame, n_frames)
+        start = time.perf_counter()
+        render(session, location_model)
+        frame_times[frame] = time.perf_counter() - start
+    return frame_times
+
+
+def measure_allocations(session, location_model, n_frames):
+    """Returns the mean peak memory (in bytes) allocated while rendering a
+    frame. This is done in a separate run, since tracing slows rendering."""
+    peaks = numpy.zeros(n_frames)
+    tracemalloc.start()
+    try:
+        for frame in range(n_frames):
+            feed_input(session, frame, n_frames)
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            render(session, location_model)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[frame] = peak - baseline
+    finally:
+        tracemalloc.stop()
+    return peaks.mean()
+
+
+def benchmark_effect(effect_name, num_leds, n_frames, n_warmup):
+    session = Session(num_leds)
+    session.set_current_effect_name(effect_name, transition_kind=None)
+    location_model = Spiral(num_leds)
+    # The first frames include one-time work, like computing the locations.
+    run_frames(session, location_model, n_warmup)
+    frame_times = run_frames(session, location_model, n_frames) * 1000.
+    return {
+        'effect': effect_name,
+        'num_leds': num_leds,
+        'frames': n_frames,
+        'mean_ms': float(frame_times.mean()),
+        'p99_ms': float(numpy.percentile(frame_times, 99)),
+        'alloc_bytes_per_frame': float(measure_allocations(
+            session, location_model, min(n_frames, 20))),
+    }
+
+
+@click.command()
+@click.option("--num_leds", type=int, multiple=True,
+              default=[300, 3000, 30000])
+@click.option("--frames", type=int, default=200,
+              help="Number of timed frames per effect and LED count.")
+@click.option("--warmup", type=int, default=5,
+              help="Number of untimed frames rendered first.")
+@click.option("--effect", multiple=True,
+              help="Effects to benchmark; all of them by default.")
+@click.option("--output", type=click.File('w'), default='-',
+              help="Where to write the JSON results.")
+def main(num_leds, frames, warmup, effect, output):
+    effect_names = effect or sorted(Session(1).effects.keys())
+    results = []
+    for n in num_leds:
+        for effect_name in effect_names:
+            # Keep the session's log messages out of the JSON output.
+            with contextlib.redirect_stdout(sys.stderr):
+                result = benchmark_effect(effect_name, n, frames, warmup)
+            print("%-20s %8d leds: mean %8.3f ms, p99 %8.3f ms, %10.0f B/frame"
+                  % (effect_name, n, result['mean_ms'], result['p99_ms'],
+                     result['alloc_bytes_per_frame']), file=sys.stderr)
+            results.append(result)
+    json.dump(results, output, indent=2)
+    output.write('\n')
+
+
+if __name__ == "__main__":
+    main()
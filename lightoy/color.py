@@ -2,7 +2,51 @@ import colorsys
 import numpy
 
 
-"""Color utilities. All color inputs are 3-by-n arrays."""
+"""Color utilities. All color inputs are 3-by-n arrays.
+
+The conversions are vectorized and numerically equivalent to applying the
+corresponding colorsys function to every point. Every function takes an
+optional 'out' argument: a 3-by-n float array that receives the result (it may
+be the input array itself). Intermediate values are kept in scratch buffers
+that are reused between calls with the same number of points, so converting a
+frame into an existing buffer doesn't allocate. The scratch buffers are shared,
+so these functions shouldn't be called concurrently from multiple threads.
+"""
+
+
+# (name, shape, dtype) => scratch array
+_scratch_buffers = {}
+
+# For each of the six hue sectors, which of the (v, t, p, q) values end up in
+# the R, G and B channels. Mirrors the branches of colorsys.hsv_to_rgb.
+_HSV_SECTOR_CHANNELS = numpy.array([
+    # 0  1  2  3  4  5
+    [0, 3, 2, 2, 1, 0],  # R
+    [1, 0, 0, 3, 2, 2],  # G
+    [2, 2, 1, 0, 0, 3],  # B
+])
+
+
+def _scratch(name, shape, dtype=numpy.float64):
+    key = (name, shape, numpy.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = numpy.empty(shape, dtype)
+        _scratch_buffers[key] = buf
+    return buf
+
+
+def _index_offsets(n):
+    key = ('offsets', (n,), numpy.dtype(numpy.intp))
+    if key not in _scratch_buffers:
+        _scratch_buffers[key] = numpy.arange(n, dtype=numpy.intp)
+    return _scratch_buffers[key]
+
+
+def _get_out(orig, out):
+    if out is None:
+        return numpy.empty(orig.shape)
+    return out
 
 
 def color_convert(orig, convert_fn):
@@ -19,15 +63,119 @@ def color_convert(orig, convert_fn):
     return new
 
 
-def rgb_to_hsv(rgb):
-    return color_convert(rgb, colorsys.rgb_to_hsv)
+def rgb_to_hsv(rgb, out=None):
+    out = _get_out(rgb, out)
+    n = rgb.shape[1]
+    r, g, b = rgb
+    maxc = _scratch('maxc', (n,))
+    rangec = _scratch('rangec', (n,))
+    hue = _scratch('hue', (n,))
+    tmp = _scratch('tmp', (n,))
+    gray = _scratch('gray', (n,), bool)
+    mask = _scratch('mask', (n,), bool)
 
+    numpy.maximum(r, g, out=maxc)
+    numpy.maximum(maxc, b, out=maxc)
+    numpy.minimum(r, g, out=rangec)
+    numpy.minimum(rangec, b, out=rangec)
+    numpy.subtract(maxc, rangec, out=rangec)
+    numpy.equal(rangec, 0., out=gray)
+    # Grays get hue and saturation 0; make their divisors safe in the meantime.
+    numpy.copyto(rangec, 1., where=gray)
 
-def hsv_to_rgb(hsv):
-    return color_convert(hsv, colorsys.hsv_to_rgb)
+    # Blue is the largest component.
+    numpy.subtract(r, g, out=hue)
+    hue /= rangec
+    hue += 4.
+    # Green is the largest component.
+    numpy.subtract(b, r, out=tmp)
+    tmp /= rangec
+    tmp += 2.
+    numpy.equal(g, maxc, out=mask)
+    numpy.copyto(hue, tmp, where=mask)
+    # Red is the largest component.
+    numpy.subtract(g, b, out=tmp)
+    tmp /= rangec
+    numpy.equal(r, maxc, out=mask)
+    numpy.copyto(hue, tmp, where=mask)
+    hue /= 6.
+    numpy.mod(hue, 1., out=hue)
+    numpy.copyto(hue, 0., where=gray)
 
+    # Saturation; maxc is only zero for grays.
+    numpy.copyto(tmp, maxc)
+    numpy.copyto(tmp, 1., where=gray)
+    numpy.divide(rangec, tmp, out=tmp)
+    numpy.copyto(tmp, 0., where=gray)
+
+    out[0, :] = hue
+    out[1, :] = tmp
+    out[2, :] = maxc
+    return out
+
+
+def hsv_to_rgb(hsv, out=None):
+    out = _get_out(hsv, out)
+    n = hsv.shape[1]
+    h, s, v = hsv
+    # The candidate channel values, in (v, t, p, q) order.
+    values = _scratch('values', (4, n))
+    h6 = _scratch('h6', (n,))
+    sector = _scratch('sector', (n,))
+    f = _scratch('f', (n,))
+    sector_index = _scratch('sector_index', (n,), numpy.intp)
+    channel_index = _scratch('channel_index', (n,), numpy.intp)
+    offsets = _index_offsets(n)
+
+    numpy.multiply(h, 6., out=h6)
+    numpy.trunc(h6, out=sector)
+    numpy.subtract(h6, sector, out=f)
+    numpy.mod(sector, 6., out=sector)
+    numpy.copyto(sector_index, sector, casting='unsafe')
+    # t = v * (1 - s * (1 - f))
+    numpy.subtract(1., f, out=values[1])
+    values[1] *= s
+    numpy.subtract(1., values[1], out=values[1])
+    values[1] *= v
+    # p = v * (1 - s)
+    numpy.subtract(1., s, out=values[2])
+    values[2] *= v
+    # q = v * (1 - s * f)
+    numpy.multiply(s, f, out=values[3])
+    numpy.subtract(1., values[3], out=values[3])
+    values[3] *= v
+    # With s == 0, p, q and t all equal v, just like colorsys' gray case.
+    values[0] = v
+
+    flat_values = values.reshape(-1)
+    for c in range(3):
+        numpy.take(_HSV_SECTOR_CHANNELS[c], sector_index, out=channel_index)
+        channel_index *= n
+        channel_index += offsets
+        numpy.take(flat_values, channel_index, out=out[c])
+    return out
+
+
+def gamma_correct(rgb, gamma, out=None):
+    """Raises the HSV value (brightness) of each color to the power of gamma,
+    keeping hue and saturation intact.
+
+    All the channels of a color are proportional to its value, so this is done
+    directly in RGB by scaling each color by max(r, g, b) ** (gamma - 1),
+    without a round trip through HSV. Colors are assumed to be in [0, 1].
+    """
+    out = _get_out(rgb, out)
+    n = rgb.shape[1]
+    maxc = _scratch('gamma_maxc', (n,))
+    black = _scratch('gamma_black', (n,), bool)
 
-def gamma_correct(rgb, gamma):
-    hsv = rgb_to_hsv(rgb)
-    hsv[2, :] **= gamma
-    return hsv_to_rgb(hsv)
+    numpy.maximum(rgb[0], rgb[1], out=maxc)
+    numpy.maximum(maxc, rgb[2], out=maxc)
+    numpy.equal(maxc, 0., out=black)
+    numpy.copyto(maxc, 1., where=black)
+    numpy.power(maxc, gamma - 1., out=maxc)
+    numpy.multiply(rgb, maxc, out=out)
+    if gamma == 0:
+        # Black has a value of 0, and 0 ** 0 == 1.
+        out[:, black] = 1.
+    return out
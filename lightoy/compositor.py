@@ -0,0 +1,109 @@
+import numpy
+
+
+"""Layering of multiple effects into one frame."""
+
+
+def _blend_add(accumulated, layer, opacity, scratch):
+    numpy.multiply(layer, opacity, out=scratch)
+    accumulated += scratch
+
+
+def _blend_max(accumulated, layer, opacity, scratch):
+    numpy.multiply(layer, opacity, out=scratch)
+    numpy.maximum(accumulated, scratch, out=accumulated)
+
+
+def _blend_multiply(accumulated, layer, opacity, scratch):
+    # Interpolates between leaving the colors as they are (opacity 0) and
+    # multiplying them by the layer's colors (opacity 1).
+    numpy.multiply(layer, opacity, out=scratch)
+    scratch += 1. - opacity
+    accumulated *= scratch
+
+
+def _blend_crossfade(accumulated, layer, opacity, scratch):
+    numpy.multiply(layer, opacity, out=scratch)
+    accumulated *= 1. - opacity
+    accumulated += scratch
+
+
+# Blend mode name => function(accumulated, layer, opacity, scratch) that
+# blends the layer's colors into the accumulated colors, in place. 'scratch' is
+# an array of the same shape that the function can use for temporary values.
+BLEND_MODES = {
+    'add': _blend_add,
+    'max': _blend_max,
+    'multiply': _blend_multiply,
+    'crossfade': _blend_crossfade,
+}
+
+
+class Layer(object):
+    """An effect that's rendered as part of a stack of layers."""
+    def __init__(self, effect_name, opacity=1., blend_mode='add'):
+        assert blend_mode in BLEND_MODES, \
+            "unknown blend mode: %s" % blend_mode
+        self.effect_name = effect_name
+        self.opacity = opacity
+        self.blend_mode = blend_mode
+
+
+class Compositor(object):
+    """
+    Renders a stack of layers into one frame. The layers are blended in order,
+    starting from black, each according to its blend mode and opacity.
+
+    Layers with an opacity of 0 aren't rendered at all (so the state of their
+    effects isn't updated either), which makes idle layers free.
+    """
+    def __init__(self, num_leds):
+        self.num_leds = num_leds
+        # List of Layer instances, from the bottom up.
+        self.layers = []
+        self.accumulated = numpy.zeros((3, num_leds))
+        self.scratch = numpy.zeros((3, num_leds))
+
+    def get_layer(self, effect_name):
+        """Returns the layer of the given effect, or None if there's none."""
+        for layer in self.layers:
+            if layer.effect_name == effect_name:
+                return layer
+        return None
+
+    def set_layer(self, effect_name, opacity=1., blend_mode='add'):
+        """Adds a layer for the effect on top of the stack, or updates the
+        effect's existing layer."""
+        layer = self.get_layer(effect_name)
+        if layer is None:
+            self.layers.append(Layer(effect_name, opacity, blend_mode))
+        else:
+            assert blend_mode in BLEND_MODES, \
+                "unknown blend mode: %s" % blend_mode
+            layer.opacity = opacity
+            layer.blend_mode = blend_mode
+
+    def remove_layer(self, effect_name):
+        self.layers = [layer for layer in self.layers
+                       if layer.effect_name != effect_name]
+
+    def render(self, effects, x, t, t_diff, inputs, coords):
+        """Renders and blends the layers.
+
+        Args:
+            effects: An (effect name => Effect) dict.
+            The rest of the arguments are passed on to Effect.do_render().
+
+        Returns:
+            A 3-by-n array of the blended colors. The array is reused by the
+            next call.
+        """
+        self.accumulated.fill(0.)
+        for layer in self.layers:
+            if layer.opacity <= 0.:
+                continue
+            colors = effects[layer.effect_name].do_render(
+                x, t, t_diff, inputs, coords)
+            BLEND_MODES[layer.blend_mode](self.accumulated, colors,
+                                          layer.opacity, self.scratch)
+        return self.accumulated
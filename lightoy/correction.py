@@ -0,0 +1,142 @@
+import numpy
+
+
+"""Correction of rendered colors before they're output."""
+
+
+# The ways gamma can be applied:
+#   'value': to the HSV value (brightness) of each color, keeping its hue and
+#       saturation, like lightoy.color.gamma_correct().
+#   'channel': to each of the R, G and B channels separately, which is the
+#       usual LED gamma curve and slightly increases saturation.
+GAMMA_MODES = ['value', 'channel']
+
+
+class ColorCorrection(object):
+    """
+    Applies gamma, brightness and white balance to rendered colors.
+
+    Nothing is raised to a power per frame; instead, colors are quantized to
+    TABLE_SIZE levels and the corrections are looked up in tables that are only
+    rebuilt when the parameters change:
+        * In 'value' mode, each color is scaled by
+          brightness * max(r, g, b) ** (gamma - 1), with the scale looked up
+          by max(r, g, b). White balance, if not neutral, is then applied with
+          a second lookup per channel.
+        * In 'channel' mode, gamma, brightness and white balance are combined
+          into one table per channel, and applied with a single gather.
+
+    White balance consists of a gain per channel (e.g. the 'red_balance'
+    global parameter), optionally followed by a per-channel curve: a function
+    that maps an array of [0, 1] values to the corrected values.
+    """
+    # Number of entries in the lookup tables.
+    TABLE_SIZE = 1 << 16
+
+    def __init__(self, mode='value', white_balance_curves=None):
+        assert mode in GAMMA_MODES, "unknown gamma mode: %s" % mode
+        self.mode = mode
+        # Optional list of R, G and B curve functions.
+        self.white_balance_curves = white_balance_curves
+        self.gamma = 3.
+        self.brightness = 1.
+        self.white_balance = (1., 1., 1.)
+        # The parameters the tables were built for.
+        self.table_key = None
+        # Scale factor by max(r, g, b), for 'value' mode.
+        self.scale_table = None
+        # 3-by-TABLE_SIZE per-channel tables, flattened. In 'channel' mode,
+        # these include all of the corrections; in 'value' mode, only the
+        # white balance (or None if it's neutral).
+        self.channel_table = None
+        # (name, shape) => scratch array
+        self.scratch = {}
+
+    def set_params(self, gamma, brightness, white_balance=(1., 1., 1.)):
+        """Sets the gamma, brightness and (R, G, B) white balance gains."""
+        self.gamma = gamma
+        self.brightness = brightness
+        self.white_balance = tuple(white_balance)
+
+    def apply(self, rgb, out=None):
+        """
+        Args:
+            rgb: A 3-by-n array of colors in [0, 1].
+            out: If given, the 3-by-n array the result is written to. It may
+                be rgb itself.
+
+        Returns:
+            A 3-by-n array of the corrected colors.
+        """
+        if out is None:
+            out = numpy.empty(rgb.shape)
+        table_key = (self.mode, self.gamma, self.brightness, self.white_balance)
+        if self.table_key != table_key:
+            self._build_tables()
+            self.table_key = table_key
+
+        if self.mode == 'value':
+            n = rgb.shape[1]
+            maxc = self._get_scratch('maxc', (n,))
+            index = self._get_scratch('index', (n,), numpy.intp)
+            numpy.maximum(rgb[0], rgb[1], out=maxc)
+            numpy.maximum(maxc, rgb[2], out=maxc)
+            self._to_index(maxc, index)
+            numpy.take(self.scale_table, index, out=maxc)
+            numpy.multiply(rgb, maxc, out=out)
+            if self.channel_table is not None:
+                self._apply_channel_table(out, out)
+        else:
+            self._apply_channel_table(rgb, out)
+        return out
+
+    def _build_tables(self):
+        values = numpy.linspace(0., 1., self.TABLE_SIZE)
+        neutral = (self.white_balance == (1., 1., 1.) and
+                   self.white_balance_curves is None)
+        if self.mode == 'value':
+            self.scale_table = numpy.zeros(self.TABLE_SIZE)
+            # Black stays black, whatever the scale.
+            self.scale_table[1:] = (self.brightness
+                                    * values[1:] ** (self.gamma - 1.))
+            if neutral:
+                self.channel_table = None
+                return
+        else:
+            values = self.brightness * values ** self.gamma
+        channel_table = numpy.zeros((3, self.TABLE_SIZE))
+        for c in range(3):
+            channel_table[c] = self.white_balance[c] * values
+            if self.white_balance_curves is not None:
+                channel_table[c] = self.white_balance_curves[c](
+                    channel_table[c])
+        self.channel_table = channel_table.reshape(-1)
+
+    def _apply_channel_table(self, rgb, out):
+        """Looks up every channel of rgb in its channel table, with a single
+        gather into out."""
+        index = self._get_scratch('channel_index', rgb.shape, numpy.intp)
+        self._to_index(rgb, index)
+        index += self._get_channel_offsets()
+        numpy.take(self.channel_table, index, out=out)
+
+    def _get_channel_offsets(self):
+        key = ('channel_offsets', (3, 1))
+        if key not in self.scratch:
+            self.scratch[key] = (numpy.arange(3, dtype=numpy.intp)
+                                 * self.TABLE_SIZE).reshape((3, 1))
+        return self.scratch[key]
+
+    def _to_index(self, values, index):
+        """Writes the table indices of the [0, 1] values into index."""
+        scaled = self._get_scratch('scaled', values.shape)
+        numpy.multiply(values, self.TABLE_SIZE - 1, out=scaled)
+        numpy.clip(scaled, 0., self.TABLE_SIZE - 1, out=scaled)
+        numpy.rint(scaled, out=scaled)
+        numpy.copyto(index, scaled, casting='unsafe')
+
+    def _get_scratch(self, name, shape, dtype=numpy.float64):
+        key = (name, shape)
+        if key not in self.scratch:
+            self.scratch[key] = numpy.empty(shape, dtype)
+        return self.scratch[key]
@@ -12,10 +12,16 @@ from OpenGL.GL import *
 import pygame
 import redis
 
+from lightoy.frame_bus import decode_message
 
-def lamp_coordinates():
+# The Redis channel that the server publishes frames to (see
+# --frame_bus_redis_channel).
+FRAMES_CHANNEL = 'lightoy_frames'
+
+
+def lamp_coordinates(num_leds):
     strips = 9
-    leds_per_strip = 50
+    leds_per_strip = int(math.ceil(num_leds / strips))
     # distance between LEDs (cm)
     pitch = 1
     # radius of lamp ring (cm)
@@ -28,7 +34,7 @@ def lamp_coordinates():
         for led in range(leds_per_strip):
             z = led * pitch
             coords[strip * leds_per_strip + led, :] = [x, y, z]
-    return coords
+    return coords[:num_leds]
 
 
 def init_display(resolution):
@@ -45,9 +51,10 @@ def draw_sphere():
     glEnd()
 
 
-def render(coordinates):
+def render(coordinates, colors):
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    for x, y, z in coordinates:
+    for (x, y, z), color in zip(coordinates, colors.T):
+        glColor3f(*color)
         glTranslatef(x, y, z)
         draw_sphere()
         glTranslatef(-x, -y, -z)
@@ -56,15 +63,23 @@ def render(coordinates):
 
 def main():
     client = redis.Redis("localhost", "6379")
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(FRAMES_CHANNEL)
     init_display((1280, 960))
-    coordinates = lamp_coordinates()
+    # The layout is sized from the number of LEDs of each frame.
+    coordinates = lamp_coordinates(0)
+    colors = numpy.zeros((3, 0))
     while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 quit()
-        render(coordinates)
-        pygame.time.wait(10)  # TODO: remove once pub-subbing
+        message = pubsub.get_message(timeout=0.01)
+        if message is not None:
+            _, _, colors = decode_message(message['data'])
+            if colors.shape[1] != len(coordinates):
+                coordinates = lamp_coordinates(colors.shape[1])
+        render(coordinates, colors)
 
 
 if __name__ == "__main__":
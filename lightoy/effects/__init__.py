@@ -1,4 +1,5 @@
 from lightoy.effects.effect import Effect
+from lightoy.effects.expression import ExpressionEffect
 
 from lightoy.effects.misc import *
 
@@ -7,11 +8,25 @@ from lightoy.effects.wander import Wander
 from lightoy.effects.wavy import Wavy
 
 
+# Base classes of effects, which aren't effects themselves.
+BASE_EFFECT_CLASSES = [ExpressionEffect]
+
+
+def get_effect_classes(base_class=Effect):
+    """Returns all the effect classes derived from base_class (directly or
+    not), except for the base classes of effects."""
+    effect_classes = []
+    for effect_class in base_class.__subclasses__():
+        if effect_class not in BASE_EFFECT_CLASSES:
+            effect_classes.append(effect_class)
+        effect_classes += get_effect_classes(effect_class)
+    return effect_classes
+
+
 def create_effects(num_leds):
     """Returns an {effect name => initialized effect} dict.
     """
-    all_effect_classes = Effect.__subclasses__()
     return {
         effect_class.__name__: effect_class(num_leds)
-        for effect_class in all_effect_classes
+        for effect_class in get_effect_classes()
         }
@@ -1,44 +1,37 @@
-import numpy
+from lightoy.effects.expression import ExpressionEffect
+import lightoy.effects.effect
 
-import lightoy.color
-from lightoy.effects import Effect
-import lightoy.geometry
-import lightoy.params
 
-
-class Cylinder(Effect):
+class Cylinder(ExpressionEffect):
     """
     Does a cool wavy thing on a cylinder.
     """
-    def init_params(self):
-        return {
-            't_shift': lightoy.params.Scalar(0., 100., 2.),
-            'h_shift': lightoy.params.Scalar(0., 100., 1.),
-            't_period': lightoy.params.Scalar(0., 100., 2.),
-            'h_period': lightoy.params.Scalar(0., 100., 4.),
+    scalar_params = {
+        't_shift': (0., 100., 2.),
+        'h_shift': (0., 100., 1.),
+        't_period': (0., 100., 2.),
+        'h_period': (0., 100., 4.),
 
-            'speed': lightoy.params.Scalar(0., 100., 2.)
-        }
+        'speed': (0., 100., 2.),
+    }
+    definitions = [
+        ('around', 't_period * theta'),
+        ('along', 'sin(h_period * h + h_shift * t * speed)'),
+    ]
+    color_space = 'hsv'
+    formulas = [
+        '0.5 + 0.3 * (sin(around + t_shift * t * (speed - 0.5)) + along)',
+        '0.5 + 0.3 * (sin(around + t_shift * t * (speed - 0.3)) + along)',
+        '0.5 + 0.5 * (sin(around + t_shift * t * (speed - 0.1)) + along)',
+    ]
 
     @classmethod
-    def render(cls, xyz, t, t_diff, inputs, param, state):
-        rth = lightoy.geometry.cartesian_to_cylindrical(xyz)
-        theta = rth[1, :]
-        h = rth[2, :]
+    def get_period(cls, param):
         t_shift = param['t_shift'].get_value()
         h_shift = param['h_shift'].get_value()
-        t_period = param['t_period'].get_value()
-        h_period = param['h_period'].get_value()
         speed = param['speed'].get_value()
-
-        hue = 0.5 + 0.3 * (numpy.sin((t_period * theta)
-                                     + t_shift * t * (speed - 0.5))
-                           + numpy.sin((h_period * h) + h_shift * t * speed))
-        sat = 0.5 + 0.3 * (numpy.sin((t_period * theta)
-                                     + t_shift * t * (speed - 0.3))
-                           + numpy.sin((h_period * h) + h_shift * t * speed))
-        val = 0.5 + 0.5 * (numpy.sin((t_period * theta)
-                                     + t_shift * t * (speed - 0.1))
-                           + numpy.sin((h_period * h) + h_shift * t * speed))
-        hsv = numpy.vstack([hue, sat, val])
-        return lightoy.color.hsv_to_rgb(hsv)
+        return lightoy.effects.effect.get_common_period([
+            t_shift * (speed - 0.5),
+            t_shift * (speed - 0.3),
+            t_shift * (speed - 0.1),
+            h_shift * speed])
@@ -1,3 +1,52 @@
+import fractions
+import inspect
+import math
+
+import lightoy.geometry
+
+
+def get_common_period(frequencies, max_denominator=100):
+    """
+    Returns the shortest time (in seconds) after which a sum of periodic
+    functions with the given angular frequencies (in radians per second)
+    repeats, or None if the frequencies aren't (close enough to) rational
+    multiples of each other. Zero frequencies are ignored; if they're all
+    zero, 0 is returned.
+    """
+    numerator_gcd = 0
+    denominator_lcm = 1
+    for frequency in frequencies:
+        frequency = abs(frequency)
+        if frequency == 0:
+            continue
+        fraction = fractions.Fraction(frequency).limit_denominator(
+            max_denominator)
+        if abs(float(fraction) - frequency) > 1e-9 * frequency:
+            return None
+        numerator_gcd = math.gcd(numerator_gcd, fraction.numerator)
+        denominator_lcm = (denominator_lcm * fraction.denominator
+                           // math.gcd(denominator_lcm, fraction.denominator))
+    if numerator_gcd == 0:
+        return 0.
+    return 2. * math.pi * denominator_lcm / numerator_gcd
+
+
+def _takes_coords(hook):
+    """Returns whether an effect's update_state() or render() takes the coords
+    argument, which those written before it was added don't."""
+    parameters = inspect.signature(hook).parameters.values()
+    positional = [parameter for parameter in parameters
+                  if parameter.kind in (parameter.POSITIONAL_ONLY,
+                                        parameter.POSITIONAL_OR_KEYWORD)]
+    return len(positional) >= 7 or any(
+        parameter.kind == parameter.VAR_POSITIONAL
+        for parameter in parameters)
+
+
+# Effect class => whether its (update_state(), render()) take coords.
+_hooks_take_coords = {}
+
+
 class Effect(object):
     """
     An Effect is responsible for what to draw on the LED array, given
@@ -35,23 +84,53 @@ class Effect(object):
         """
         return {}
 
-    def do_render(self, x, t, t_diff, inputs):
+    def do_render(self, x, t, t_diff, inputs, coords=None):
         """Updates the effect's state and renders the lights
-        (see doc on render()) with the effect's stored parameters and state."""
-        self.update_state(x, t, t_diff, inputs, self.params, self.state)
-        return self.render(x, t, t_diff, inputs, self.params, self.state)
+        (see doc on render()) with the effect's stored parameters and state.
+
+        If the precomputed coordinates aren't given, they're computed from x.
+        They're only passed to the hooks that take them.
+        """
+        if coords is None:
+            coords = lightoy.geometry.get_coordinates(x)
+        takes_coords = _hooks_take_coords.get(type(self))
+        if takes_coords is None:
+            takes_coords = _hooks_take_coords[type(self)] = (
+                _takes_coords(self.update_state), _takes_coords(self.render))
+        extra_args = (coords,) if takes_coords[0] else ()
+        self.update_state(x, t, t_diff, inputs, self.params, self.state,
+                          *extra_args)
+        extra_args = (coords,) if takes_coords[1] else ()
+        return self.render(x, t, t_diff, inputs, self.params, self.state,
+                           *extra_args)
+
+    @classmethod
+    def get_period(cls, param):
+        """
+        Returns the period (in seconds) of the effect with the given
+        parameters, if the effect is periodic: if it only depends on the LED
+        locations, the time and its scalar parameters, and repeats itself
+        after that time. 0 means that the effect doesn't change over time.
+        Returns None (the default) if the effect isn't periodic.
+
+        Periodic effects can be baked into a cache of frames (see
+        lightoy.frame_cache).
+        """
+        return None
 
     @classmethod
-    def update_state(cls, x, t, t_diff, inputs, param, state):
-        """Use this to mutate the state dict."""
+    def update_state(cls, x, t, t_diff, inputs, param, state, coords=None):
+        """Use this to mutate the state dict. The arguments are those of
+        render()."""
         pass
 
     @classmethod
-    def render(cls, x, t, t_diff, inputs, param, state):
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
         """
         Determines the brightness and color of an LED at a given point in space
-            and time. Multiple effects can be simultaneously used; in that case,
-            the final color a given LED will be the sum of the effects.
+            and time. Multiple effects can be simultaneously used as layers;
+            in that case, the final color of a given LED is a blend of the
+            effects (see lightoy.compositor).
 
         This method is stateless. do_render() should be called for an
         effect instance to render with the effect's state.
@@ -65,9 +144,17 @@ class Effect(object):
                current input.
             param: A (name => Parameter) dictionary of the per-effect
                 parameters.
+            state: The effect's state dict.
+            coords: A lightoy.geometry.Coordinates namedtuple with the points
+                in several coordinate systems, or None if it isn't given.
+                It's precomputed once per change of the LED locations, so
+                effects may use it when given, rather than converting x
+                themselves. The arrays are read-only. (do_render() always
+                gives it to hooks that take it.)
         Returns:
             An 3-by-n array representing the desired R, G, and B values for an
             LED that is present at a given point in space. These should range
-            from 0 to 1.
+            from 0 to 1. The array may be part of the effect's state, so
+            callers shouldn't modify it.
         """
         raise Exception("Not implemented")
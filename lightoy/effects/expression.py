@@ -0,0 +1,364 @@
+import ast
+import math
+import numpy
+
+import lightoy.color
+from lightoy.effects.effect import Effect
+import lightoy.geometry
+import lightoy.input
+import lightoy.params
+
+
+"""
+Effects defined by formulas, which are compiled into NumPy kernels.
+
+The formulas are Python expressions over these variables:
+    * Per-LED coordinates: x, y, z (locations), r, theta, h (cylindrical),
+      rho, phi (spherical; theta is the same as the cylindrical one),
+      arc_length (position along the strip, from 0 to 1).
+    * Per-frame values: t, t_diff, the scalar fields of
+      lightoy.input.InputState (lightoy.input.SCALAR_INPUT_DIMS, e.g.
+      focus_x), and the effect's parameters.
+    * The names of the effect's definitions.
+They can use numbers, the +, -, *, / and ** operators, and the functions in
+FUNCTIONS.
+
+Each effect's formulas are compiled into one kernel function when the first
+instance of the effect is created:
+    * Identical subexpressions (including across formulas) are computed once.
+    * Subexpressions that don't depend on the LEDs are computed once per frame
+      as Python floats, and those made only of numbers at compile time.
+    * Every per-LED operation writes into a preallocated temporary array,
+      which is reused as soon as its value is no longer needed, so rendering a
+      frame doesn't allocate.
+"""
+
+
+# The variables that have a value per LED => the code that gets their array.
+LED_VARIABLES = {
+    'x': 'coords.xyz[0]',
+    'y': 'coords.xyz[1]',
+    'z': 'coords.xyz[2]',
+    'r': 'coords.cylindrical[0]',
+    'theta': 'coords.cylindrical[1]',
+    'h': 'coords.cylindrical[2]',
+    'rho': 'coords.spherical[0]',
+    'phi': 'coords.spherical[2]',
+    'arc_length': 'coords.arc_length',
+}
+
+# Function name => (NumPy function, the equivalent function for floats).
+FUNCTIONS = {
+    'sin': ('numpy.sin', 'math.sin'),
+    'cos': ('numpy.cos', 'math.cos'),
+    'tan': ('numpy.tan', 'math.tan'),
+    'tanh': ('numpy.tanh', 'math.tanh'),
+    'exp': ('numpy.exp', 'math.exp'),
+    'log': ('numpy.log', 'math.log'),
+    'sqrt': ('numpy.sqrt', 'math.sqrt'),
+    'abs': ('numpy.absolute', 'abs'),
+    'arctan2': ('numpy.arctan2', 'math.atan2'),
+    'minimum': ('numpy.minimum', 'min'),
+    'maximum': ('numpy.maximum', 'max'),
+    'mod': ('numpy.mod', '_mod'),
+    'clip': ('numpy.clip', '_clip'),
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: ('numpy.add', '+'),
+    ast.Sub: ('numpy.subtract', '-'),
+    ast.Mult: ('numpy.multiply', '*'),
+    ast.Div: ('numpy.divide', '/'),
+    ast.Pow: ('numpy.power', '**'),
+}
+
+COLOR_SPACES = ['rgb', 'hsv']
+
+
+def _mod(a, b):
+    # Python's % has the same sign convention as numpy.mod.
+    return a % b
+
+
+def _clip(a, low, high):
+    return min(max(a, low), high)
+
+
+class _Node(object):
+    """A node of the expression graph."""
+    def __init__(self, op, args, per_led, value=None):
+        # One of 'const', 'var', 'call' or a key of _BINARY_OPERATORS
+        # (as ast operator classes), or 'neg'.
+        self.op = op
+        # Child nodes, preceded by the function name for 'call' nodes, or
+        # the variable name for 'var' nodes.
+        self.args = args
+        # Whether the node has a value per LED (or a single float).
+        self.per_led = per_led
+        # The value of 'const' nodes.
+        self.value = value
+
+
+class _Compiler(object):
+    """Compiles formulas into the source of a kernel function."""
+    def __init__(self, scalar_names):
+        self.scalar_names = scalar_names
+        # Node key => node, for common subexpression elimination. Nodes are
+        # appended in dependency order.
+        self.nodes = {}
+        # Definition name => node.
+        self.definitions = {}
+
+    def add_definition(self, name, formula):
+        if name in self.definitions or name in LED_VARIABLES or \
+                name in self.scalar_names:
+            raise Exception("definition %s shadows another name" % name)
+        self.definitions[name] = self.parse(formula)
+
+    def parse(self, formula):
+        try:
+            tree = ast.parse(formula.strip(), mode='eval')
+        except SyntaxError as e:
+            raise Exception("can't parse formula %r: %s" % (formula, e))
+        return self._convert(tree.body, formula)
+
+    def _convert(self, expr, formula):
+        if isinstance(expr, ast.Constant) and \
+                isinstance(expr.value, (int, float)) and \
+                not isinstance(expr.value, bool):
+            return self._const(float(expr.value))
+        if isinstance(expr, ast.Name):
+            name = expr.id
+            if name in self.definitions:
+                return self.definitions[name]
+            if name in LED_VARIABLES:
+                return self._node('var', (name,), True)
+            if name in self.scalar_names:
+                return self._node('var', (name,), False)
+            raise Exception("unknown name %s in formula %r" % (name, formula))
+        if isinstance(expr, ast.UnaryOp) and \
+                isinstance(expr.op, (ast.USub, ast.UAdd)):
+            operand = self._convert(expr.operand, formula)
+            if isinstance(expr.op, ast.UAdd):
+                return operand
+            return self._node('neg', (operand,))
+        if isinstance(expr, ast.BinOp) and \
+                type(expr.op) in _BINARY_OPERATORS:
+            return self._node(type(expr.op), (
+                self._convert(expr.left, formula),
+                self._convert(expr.right, formula)))
+        if isinstance(expr, ast.Call) and isinstance(expr.func, ast.Name) and \
+                expr.func.id in FUNCTIONS and not expr.keywords:
+            args = tuple(self._convert(arg, formula) for arg in expr.args)
+            return self._node('call', (expr.func.id,) + args)
+        raise Exception("unsupported expression in formula %r: %s"
+                        % (formula, ast.dump(expr)))
+
+    def _const(self, value):
+        return self._node('const', (), False, value)
+
+    def _node(self, op, args, per_led=None, value=None):
+        children = [arg for arg in args if isinstance(arg, _Node)]
+        if per_led is None:
+            per_led = any(child.per_led for child in children)
+        if op not in ('const', 'var') and \
+                all(child.op == 'const' for child in children):
+            # Fold constants at compile time.
+            return self._const(float(eval(
+                self._scalar_code(op, args, [repr(child.value)
+                                             for child in children]),
+                {'math': math, '_mod': _mod, '_clip': _clip})))
+        key = (op, tuple(id(arg) if isinstance(arg, _Node) else arg
+                         for arg in args), value)
+        if key not in self.nodes:
+            self.nodes[key] = _Node(op, args, per_led, value)
+        return self.nodes[key]
+
+    @staticmethod
+    def _scalar_code(op, args, child_code):
+        """Returns the Python code that computes a node from its children's
+        code, for floats."""
+        if op == 'neg':
+            return '(-%s)' % child_code[0]
+        if op == 'call':
+            return '%s(%s)' % (FUNCTIONS[args[0]][1], ', '.join(child_code))
+        return '(%s %s %s)' % (child_code[0], _BINARY_OPERATORS[op][1],
+                               child_code[1])
+
+    def generate(self, outputs):
+        """
+        Returns the source of a kernel(coords, scalars, out, temps) function
+        that computes the output nodes into the rows of 'out', and the number
+        of temporary arrays it uses. 'scalars' is a (name => float) dict, and
+        'temps' a 2D array whose rows are the temporaries.
+        """
+        nodes = list(self.nodes.values())
+        # Which nodes are needed, and the index of the last node using each.
+        needed = set()
+        last_use = {}
+        for node in outputs:
+            needed.add(id(node))
+        for i in reversed(range(len(nodes))):
+            node = nodes[i]
+            if id(node) not in needed:
+                continue
+            for child in node.args:
+                if isinstance(child, _Node):
+                    needed.add(id(child))
+                    last_use.setdefault(id(child), i)
+        for node in outputs:
+            last_use[id(node)] = len(nodes)
+
+        # The nodes that are only computed for one output are written
+        # directly to that output's row.
+        output_rows = {}
+        for c, node in enumerate(outputs):
+            if node.per_led and outputs.count(node) == 1:
+                output_rows[id(node)] = 'out[%d]' % c
+
+        lines = []
+        # Node id => the code for its value.
+        code = {}
+        free_temps = []
+        num_temps = 0
+        for i, node in enumerate(nodes):
+            if id(node) not in needed:
+                continue
+            children = [arg for arg in node.args if isinstance(arg, _Node)]
+            child_code = [code[id(child)] for child in children]
+            if node.op == 'const':
+                code[id(node)] = repr(node.value)
+                continue
+            if node.op == 'var':
+                if node.per_led:
+                    code[id(node)] = LED_VARIABLES[node.args[0]]
+                else:
+                    code[id(node)] = 'scalars[%r]' % node.args[0]
+                continue
+            name = 'v%d' % i
+            if not node.per_led:
+                lines.append('%s = %s' % (
+                    name, self._scalar_code(node.op, node.args, child_code)))
+                code[id(node)] = name
+                continue
+            # Temporaries of children that aren't needed anymore can be
+            # written to by this node.
+            for child in set(children):
+                if last_use.get(id(child)) == i and child.per_led and \
+                        code[id(child)].startswith('temps['):
+                    free_temps.append(code[id(child)])
+            if id(node) in output_rows:
+                temp = output_rows[id(node)]
+            elif free_temps:
+                temp = free_temps.pop()
+            else:
+                temp = 'temps[%d]' % num_temps
+                num_temps += 1
+            if node.op == 'neg':
+                function = 'numpy.negative'
+            elif node.op == 'call':
+                function = FUNCTIONS[node.args[0]][0]
+            else:
+                function = _BINARY_OPERATORS[node.op][0]
+            lines.append('%s(%s, out=%s)' % (function, ', '.join(child_code),
+                                             temp))
+            code[id(node)] = temp
+        for c, node in enumerate(outputs):
+            if code[id(node)] != 'out[%d]' % c:
+                lines.append('out[%d] = %s' % (c, code[id(node)]))
+        source = 'def kernel(coords, scalars, out, temps):\n%s\n' % ''.join(
+            '    %s\n' % line for line in lines)
+        return source, num_temps
+
+
+def compile_formulas(formulas, definitions=(), scalar_names=()):
+    """
+    Compiles formulas into a kernel function.
+
+    Args:
+        formulas: The formulas of the output rows (e.g. three of them for
+            colors).
+        definitions: A sequence of (name, formula) tuples of subexpressions
+            that later definitions and the formulas can refer to by name.
+        scalar_names: The names of the per-frame variables.
+
+    Returns:
+        A (kernel function, kernel source, number of temporary arrays) tuple.
+        The kernel is called as kernel(coords, scalars, out, temps), where
+        coords is a lightoy.geometry.Coordinates bundle, scalars a (name =>
+        float) dict of the per-frame variables, out the array whose rows
+        receive the results, and temps an array with at least the given number
+        of rows of the size of a row of out.
+    """
+    compiler = _Compiler(set(scalar_names))
+    for name, formula in definitions:
+        compiler.add_definition(name, formula)
+    outputs = [compiler.parse(formula) for formula in formulas]
+    source, num_temps = compiler.generate(outputs)
+    namespace = {'numpy': numpy, 'math': math, '_mod': _mod, '_clip': _clip}
+    exec(compile(source, '<compiled formulas>', 'exec'), namespace)
+    return namespace['kernel'], source, num_temps
+
+
+class ExpressionEffect(Effect):
+    """
+    An effect whose colors are given by formulas (see the module docstring),
+    rather than a hand-written render(). Subclasses set:
+        scalar_params: A (name => (min, max, default)) dict of the effect's
+            Scalar parameters, which the formulas can refer to.
+        definitions: An optional list of (name, formula) tuples of named
+            subexpressions.
+        formulas: The formulas of the three color channels.
+        color_space: 'rgb' or 'hsv', the color space of the formulas.
+    """
+    scalar_params = {}
+    definitions = []
+    formulas = None
+    color_space = 'rgb'
+
+    def init_params(self):
+        return {
+            name: lightoy.params.Scalar(*scalar_range)
+            for name, scalar_range in self.scalar_params.items()}
+
+    def init_state(self):
+        _, _, num_temps = self.get_kernel()
+        return {
+            'out': numpy.zeros((3, self.n_leds)),
+            'temps': numpy.zeros((num_temps, self.n_leds)),
+        }
+
+    @classmethod
+    def get_kernel(cls):
+        """Returns the class's (kernel, source, number of temporaries) tuple
+        (see compile_formulas()), compiling the formulas the first time."""
+        if '_kernel' not in cls.__dict__:
+            assert cls.color_space in COLOR_SPACES, \
+                "unknown color space: %s" % cls.color_space
+            scalar_names = (['t', 't_diff']
+                            + list(lightoy.input.SCALAR_INPUT_DIMS)
+                            + list(cls.scalar_params.keys()))
+            cls._kernel = compile_formulas(cls.formulas, cls.definitions,
+                                           scalar_names)
+        return cls._kernel
+
+    @classmethod
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
+        kernel, _, num_temps = cls.get_kernel()
+        if coords is None:
+            coords = lightoy.geometry.get_coordinates(x)
+        n = x.shape[1]
+        out = state['out']
+        if out.shape[1] != n:
+            out = state['out'] = numpy.zeros((3, n))
+            state['temps'] = numpy.zeros((num_temps, n))
+        scalars = {name: getattr(inputs, name)
+                   for name in lightoy.input.SCALAR_INPUT_DIMS}
+        scalars['t'] = t
+        scalars['t_diff'] = t_diff
+        for name, parameter in param.items():
+            scalars[name] = parameter.get_value()
+        kernel(coords, scalars, out, state['temps'])
+        if cls.color_space == 'hsv':
+            lightoy.color.hsv_to_rgb(out, out=out)
+        return out
@@ -5,7 +5,11 @@ from lightoy.effects import Effect
 
 class VerticalWipe(Effect):
     @classmethod
-    def render(cls, x, t, t_diff, inputs, param, state):
+    def get_period(cls, param):
+        return 0.
+
+    @classmethod
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
         brightness = 0.2 * 1. / (1. + numpy.exp(-20 * x[0, :]))
         return numpy.vstack([brightness, brightness, brightness])
 
@@ -14,7 +18,7 @@ class InputFollowingWave(Effect):
     # TODO: add some sliders
 
     @classmethod
-    def render(cls, x, t, t_diff, inputs, param, state):
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
         n = x.shape[1]
         brightness = numpy.sin(
             (20 * inputs.focus_x * x[0, :] - 20 * inputs.focus_y * t))**2
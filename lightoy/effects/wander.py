@@ -21,32 +21,37 @@ class Wander(Effect):
             }
 
     def init_state(self):
-        directions = numpy.zeros((3, self.n_leds))
-        for i in range(self.n_leds):
-            v = numpy.random.rand(3)
-            v = (v / numpy.linalg.norm(v))
-            directions[:, i] = v
+        directions = numpy.random.rand(3, self.n_leds)
+        directions /= numpy.linalg.norm(directions, axis=0)
 
         return {
             'colors': numpy.zeros((3, self.n_leds)),
-            'directions': directions
+            'directions': directions,
+            # Scratch arrays, so that updating doesn't allocate.
+            'step': numpy.zeros((3, self.n_leds)),
+            'below': numpy.zeros((3, self.n_leds), dtype=bool),
+            'above': numpy.zeros((3, self.n_leds), dtype=bool),
         }
 
     @classmethod
-    def update_state(cls, x, t, t_diff, inputs, param, state):
-        n_leds = x.shape[1]
+    def update_state(cls, x, t, t_diff, inputs, param, state, coords=None):
         colors = state['colors']
         directions = state['directions']
-        colors += (directions * t_diff * param['speed'].get_value())
-        for c in range(3):
-            for led in range(n_leds):
-                if colors[c, led] < 0:
-                    colors[c, led] *= -1
-                    directions[c, led] *= -1
-                elif colors[c, led] > 1:
-                    colors[c, led] = 2 - colors[c, led]
-                    directions[c, led] *= -1
+        step = state['step']
+        below = state['below']
+        above = state['above']
+        numpy.multiply(directions, t_diff * param['speed'].get_value(),
+                       out=step)
+        colors += step
+        numpy.less(colors, 0., out=below)
+        numpy.greater(colors, 1., out=above)
+        # Reflect the colors that went past the bounds back in, and reverse
+        # their direction.
+        numpy.negative(colors, out=colors, where=below)
+        numpy.subtract(2., colors, out=colors, where=above)
+        numpy.logical_or(below, above, out=below)
+        numpy.negative(directions, out=directions, where=below)
 
     @classmethod
-    def render(cls, x, t, t_diff, inputs, param, state):
-        return state['colors'].copy()
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
+        return state['colors']
@@ -10,7 +10,7 @@ class Wavy(Effect):
         return {'periods': lightoy.params.RandomArray(self.n_leds)}
 
     @classmethod
-    def render(cls, x, t, t_diff, inputs, param, state):
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
         # TODO: break out more things into params
         n = x.shape[1]
         # Default: just make everything red, with a bit of a wavy effect.
@@ -30,4 +30,4 @@ class Wavy(Effect):
         v = ((0.25 + 0.75 * inputs.fade) *
              numpy.multiply(brightness, pos_mask))
         hsv = numpy.vstack([h, s, v])
-        return lightoy.color.hsv_to_rgb(hsv)
+        return lightoy.color.hsv_to_rgb(hsv, out=hsv)
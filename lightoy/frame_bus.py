@@ -0,0 +1,262 @@
+import mmap
+import numpy
+import struct
+import threading
+import time
+
+import lightoy.output
+
+
+"""
+A bus that publishes rendered frames to other processes (visualizers,
+recorders, analyzers, ...), without affecting the timing of the render thread.
+
+Frames are published to a memory-mapped file (ideally on a tmpfs such as
+/dev/shm) holding a ring of the last few frames, which readers map and read
+in place (see FrameBusReader). The file starts with a header (see
+HEADER_FORMAT) followed by the slots of the ring, each of which is:
+    * The sequence number of the frame in the slot (counting from 1), as a
+      little-endian uint64. It's 0 while the slot is being written.
+    * The time of the frame (seconds since the start of the session), as a
+      little-endian double.
+    * The colors, as a 3-by-n array of little-endian float32s in [0, 1].
+Frame number s goes in slot (s - 1) % capacity, and the header's sequence
+number is updated once the frame is complete. Readers check the slot's
+sequence number after reading a frame, so that frames overwritten while they
+were being read are discarded.
+
+Frames can also be published to a Redis channel (see RedisPublisher), as
+messages in the format of encode_message().
+"""
+
+
+MAGIC = b'LTBUS'
+VERSION = 1
+# Magic, version, number of LEDs, capacity (in frames), and the sequence
+# number of the latest frame (0 if there's none).
+HEADER_FORMAT = '<5sBIIQ'
+HEADER_SIZE = 64
+SLOT_HEADER_FORMAT = '<Qd'
+SLOT_HEADER_SIZE = 16
+# The offset of the sequence number in the header.
+SEQUENCE_OFFSET = struct.calcsize('<5sBII')
+
+# The header of Redis messages: the sequence number, time and number of LEDs
+# of the frame, which is followed by the colors as in the slots.
+MESSAGE_HEADER_FORMAT = '<QdI'
+
+
+def _slot_size(num_leds):
+    return SLOT_HEADER_SIZE + 3 * num_leds * 4
+
+
+def _frame_views(buf, num_leds, capacity):
+    """Returns 3-by-n float32 arrays viewing the frames of the slots."""
+    slot_size = _slot_size(num_leds)
+    return [numpy.frombuffer(buf, dtype='<f4', count=3 * num_leds,
+                             offset=(HEADER_SIZE + i * slot_size
+                                     + SLOT_HEADER_SIZE)).reshape((3, -1))
+            for i in range(capacity)]
+
+
+class FrameBus(object):
+    """Publishes every Nth frame to a ring of frames in a memory-mapped file,
+    replacing any existing file."""
+    def __init__(self, filename, num_leds, capacity=4, every=1):
+        """
+        Args:
+            filename: The file of the ring, e.g. '/dev/shm/lightoy_frames'.
+            num_leds: The number of LEDs in each frame.
+            capacity: The number of frames kept; older frames are overwritten.
+            every: Only every Nth frame passed to publish() is published.
+        """
+        self.filename = filename
+        self.num_leds = num_leds
+        self.capacity = capacity
+        self.every = every
+        self.slot_size = _slot_size(num_leds)
+        self.num_frames = 0
+        self.sequence = 0
+        # Set whenever a frame is published.
+        self.published = threading.Event()
+        self.file = open(filename, 'w+b')
+        self.file.truncate(HEADER_SIZE + capacity * self.slot_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.frames = _frame_views(self.map, num_leds, capacity)
+        struct.pack_into(HEADER_FORMAT, self.map, 0, MAGIC, VERSION,
+                         num_leds, capacity, 0)
+
+    def publish(self, colors, t):
+        """Publishes a 3-by-n array of colors rendered at time t, if it's the
+        Nth frame since the last one published."""
+        self.num_frames += 1
+        if self.num_frames % self.every:
+            return
+        sequence = self.sequence + 1
+        slot = (sequence - 1) % self.capacity
+        offset = HEADER_SIZE + slot * self.slot_size
+        struct.pack_into('<Q', self.map, offset, 0)
+        numpy.copyto(self.frames[slot], colors, casting='unsafe')
+        struct.pack_into(SLOT_HEADER_FORMAT, self.map, offset, sequence, t)
+        struct.pack_into('<Q', self.map, SEQUENCE_OFFSET, sequence)
+        self.sequence = sequence
+        self.published.set()
+
+    def close(self):
+        del self.frames
+        self.map.close()
+        self.file.close()
+
+
+class FrameBusReader(object):
+    """Reads the frames of a FrameBus, possibly from another process."""
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_leds, self.capacity, _ = struct.unpack_from(
+            HEADER_FORMAT, self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("%s isn't a frame bus of version %d"
+                            % (filename, VERSION))
+        self.slot_size = _slot_size(self.num_leds)
+        self.frames = _frame_views(self.map, self.num_leds, self.capacity)
+
+    def get_sequence(self):
+        """Returns the sequence number of the latest frame, or 0 if there's
+        none yet."""
+        return struct.unpack_from('<Q', self.map, SEQUENCE_OFFSET)[0]
+
+    def get_frame(self, sequence):
+        """
+        Returns the (time, frame) of the given frame without copying it, or
+        None if it's no longer (or not yet) in the ring. The frame is a
+        read-only 3-by-n array, which is only valid while is_valid() is true:
+        check it after using the frame.
+        """
+        if not self.is_valid(sequence):
+            return None
+        slot = (sequence - 1) % self.capacity
+        _, t = struct.unpack_from(SLOT_HEADER_FORMAT, self.map,
+                                  HEADER_SIZE + slot * self.slot_size)
+        return t, self.frames[slot]
+
+    def is_valid(self, sequence):
+        """Returns whether the given frame is in the ring."""
+        if sequence <= 0:
+            return False
+        slot = (sequence - 1) % self.capacity
+        return struct.unpack_from(
+            '<Q', self.map, HEADER_SIZE + slot * self.slot_size)[0] == sequence
+
+    def read_frame(self, sequence, out=None):
+        """Returns the (time, frame) of the given frame as a copy, filling in
+        the 3-by-n array 'out' if given, or None if it isn't in the ring or
+        was overwritten while being copied."""
+        frame = self.get_frame(sequence)
+        if frame is None:
+            return None
+        t, frame = frame
+        if out is None:
+            out = numpy.empty(frame.shape, dtype=numpy.float32)
+        numpy.copyto(out, frame)
+        if not self.is_valid(sequence):
+            return None
+        return t, out
+
+    def wait_for_frame(self, last_sequence, timeout=None,
+                       poll_interval=0.001):
+        """Waits for a frame newer than last_sequence, and returns the
+        sequence number of the latest frame, or None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sequence = self.get_sequence()
+            if sequence > last_sequence:
+                return sequence
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        del self.frames
+        self.map.close()
+        self.file.close()
+
+
+def encode_message(sequence, t, colors):
+    """Encodes a frame as a message for RedisPublisher."""
+    return (struct.pack(MESSAGE_HEADER_FORMAT, sequence, t, colors.shape[1])
+            + numpy.ascontiguousarray(colors, dtype='<f4').tobytes())
+
+
+def decode_message(data):
+    """Decodes a message from encode_message() into a (sequence, time,
+    3-by-n float32 array) tuple."""
+    sequence, t, num_leds = struct.unpack_from(MESSAGE_HEADER_FORMAT, data)
+    colors = numpy.frombuffer(data, dtype='<f4', count=3 * num_leds,
+                              offset=struct.calcsize(MESSAGE_HEADER_FORMAT))
+    return sequence, t, colors.reshape((3, -1))
+
+
+class RedisPublisher(object):
+    """
+    Publishes the frames of a FrameBus to a Redis channel, from a thread of
+    its own. The thread reads the latest frame from the bus whenever one is
+    published, so frames are skipped rather than queued if Redis can't keep
+    up, and the render thread never waits for Redis.
+    """
+    def __init__(self, bus, channel, host='localhost', port=6379):
+        # Only needed if frames are published to Redis.
+        import redis
+        self.bus = bus
+        self.channel = channel
+        self.client = redis.Redis(host, port)
+        self.reader = FrameBusReader(bus.filename)
+        self.frames_published = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._publish_loop,
+                                       daemon=True)
+        self.thread.start()
+
+    def _publish_loop(self):
+        out = numpy.empty((3, self.reader.num_leds), dtype=numpy.float32)
+        last_sequence = 0
+        while True:
+            self.bus.published.wait()
+            self.bus.published.clear()
+            if self.stopped:
+                break
+            sequence = self.reader.get_sequence()
+            if sequence == last_sequence:
+                continue
+            frame = self.reader.read_frame(sequence, out)
+            if frame is None:
+                continue
+            last_sequence = sequence
+            try:
+                self.client.publish(self.channel,
+                                    encode_message(sequence, *frame))
+                self.frames_published += 1
+            except Exception as e:
+                # TODO: logging
+                print("Couldn't publish frame to Redis:", e)
+
+    def close(self):
+        """Stops publishing frames; call it before closing the bus."""
+        self.stopped = True
+        self.bus.published.set()
+        self.thread.join()
+        self.reader.close()
+
+
+class FrameBusOutput(lightoy.output.Output):
+    """Wraps another Output, and publishes the frames passed to it to a
+    FrameBus."""
+    def __init__(self, output, bus, session):
+        self.wrapped = output
+        self.bus = bus
+        self.session = session
+
+    def output(self, colors):
+        # last_t is the time of the frame that was just rendered.
+        self.bus.publish(colors, self.session.last_t or 0.)
+        self.wrapped.output(colors)
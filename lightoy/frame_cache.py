@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import numpy
+import os
+
+import lightoy.params
+
+
+"""Baking of periodic effects into caches of pre-rendered frames."""
+
+
+class BakedEffect(object):
+    """The frames of one period of an effect, with one set of parameters."""
+    def __init__(self, period, frames):
+        """
+        Args:
+            period: The period of the effect, in seconds.
+            frames: A num_frames-by-3-by-n float32 array for the frames.
+        """
+        self.period = period
+        self.frames = frames
+        # Which of the frames have been rendered.
+        self.baked = numpy.zeros(len(frames), dtype=bool)
+        self.num_baked = 0
+
+    def is_complete(self):
+        return self.num_baked == len(self.frames)
+
+    def get_nbytes(self):
+        return self.frames.nbytes
+
+
+class FrameCache(object):
+    """
+    Renders periodic effects (see Effect.get_period()) from caches of frames,
+    so that looping content costs next to nothing once it's been rendered.
+
+    One period of the effect is split into frames at bake_fps, and each frame
+    is shown for the times closest to it. Frames are baked in the render
+    thread as they're first needed, plus up to bake_per_frame frames that
+    haven't been needed yet, so that the cache fills up within about a period
+    without a long pause.
+
+    The frames are cached by effect, scalar parameter values and LED locations,
+    so changing a parameter switches to another cache, while changing it back
+    reuses the first one. The least recently used caches are evicted when
+    their total size exceeds max_bytes; if spill_dir is given, complete caches
+    are saved to it when they're evicted, and loaded back when they're needed
+    again (including by later sessions).
+    """
+    def __init__(self, num_leds, max_bytes=64 << 20, spill_dir=None,
+                 bake_fps=100., bake_per_frame=2, max_period=60.):
+        self.num_leds = num_leds
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.bake_fps = bake_fps
+        self.bake_per_frame = bake_per_frame
+        self.max_period = max_period
+        # Cache key => BakedEffect, least recently used first.
+        self.baked_effects = collections.OrderedDict()
+        self.num_bytes = 0
+        # (effect name, parameter values) => the effect's period. Periods
+        # that are None (or too long) aren't kept, so that non-periodic
+        # effects are asked every time.
+        self.periods = {}
+        # The digest of the last coordinates seen.
+        self.last_coords = None
+        self.coords_digest = None
+        self.frame = numpy.zeros((3, num_leds))
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def render(self, effect_name, effect, x, t, t_diff, inputs, coords):
+        """
+        Renders a frame of the effect from its cache, baking the frame first
+        if needed. The arguments are those of Effect.do_render().
+
+        Returns:
+            A 3-by-n array of the colors, which is reused by the next call, or
+            None if the effect can't be baked.
+        """
+        key = self._get_key(effect_name, effect, coords)
+        if key is None:
+            return None
+        period = self.periods.get(key[:2])
+        if period is None:
+            period = effect.get_period(effect.params)
+            if period is None or period > self.max_period:
+                return None
+            self.periods[key[:2]] = period
+        num_frames = max(1, int(round(period * self.bake_fps)))
+        if num_frames * 3 * self.num_leds * 4 > self.max_bytes:
+            return None
+        baked = self._get_baked_effect(key, period, num_frames)
+
+        index = 0
+        if period > 0:
+            index = int(round(t % period / period * num_frames)) % num_frames
+        if not baked.baked[index]:
+            self._bake(baked, index, effect, x, inputs, coords)
+        if not baked.is_complete():
+            # Bake ahead of where the effect is shown, so the frames needed
+            # next are likely to be ready.
+            for missing in numpy.flatnonzero(
+                    ~numpy.roll(baked.baked, -index))[:self.bake_per_frame]:
+                self._bake(baked, (index + missing) % num_frames, effect, x,
+                           inputs, coords)
+        numpy.copyto(self.frame, baked.frames[index])
+        return self.frame
+
+    def _bake(self, baked, index, effect, x, inputs, coords):
+        t = index * baked.period / len(baked.frames)
+        baked.frames[index] = effect.do_render(x, t, 0., inputs, coords)
+        baked.baked[index] = True
+        baked.num_baked += 1
+
+    def _get_key(self, effect_name, effect, coords):
+        """Returns the cache key of the effect, or None if it has parameters
+        that aren't scalars."""
+        if not all(isinstance(param, lightoy.params.Scalar)
+                   for param in effect.params.values()):
+            return None
+        if coords is not self.last_coords:
+            self.coords_digest = hashlib.sha1(
+                numpy.ascontiguousarray(coords.xyz).tobytes()).hexdigest()
+            self.last_coords = coords
+        param_values = tuple(
+            (name, float(param.get_value()))
+            for name, param in sorted(effect.params.items()))
+        return (effect_name, param_values, self.coords_digest,
+                self.bake_fps)
+
+    def _get_baked_effect(self, key, period, num_frames):
+        baked = self.baked_effects.get(key)
+        if baked is not None:
+            self.baked_effects.move_to_end(key)
+            return baked
+        baked = self._load(key, period, num_frames)
+        if baked is None:
+            baked = BakedEffect(period, numpy.zeros(
+                (num_frames, 3, self.num_leds), dtype=numpy.float32))
+        self._evict(self.max_bytes - baked.get_nbytes())
+        self.baked_effects[key] = baked
+        self.num_bytes += baked.get_nbytes()
+        return baked
+
+    def _evict(self, max_bytes):
+        """Evicts the least recently used caches until they take up at most
+        max_bytes."""
+        while self.baked_effects and self.num_bytes > max_bytes:
+            key, baked = self.baked_effects.popitem(last=False)
+            self.num_bytes -= baked.get_nbytes()
+            if self.spill_dir is not None and baked.is_complete():
+                numpy.save(self._get_spill_filename(key), baked.frames)
+
+    def _load(self, key, period, num_frames):
+        if self.spill_dir is None:
+            return None
+        filename = self._get_spill_filename(key)
+        if not os.path.exists(filename):
+            return None
+        frames = numpy.load(filename)
+        if frames.shape != (num_frames, 3, self.num_leds):
+            return None
+        baked = BakedEffect(period, frames)
+        baked.baked[:] = True
+        baked.num_baked = num_frames
+        return baked
+
+    def _get_spill_filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, '%s.npy' % digest)
@@ -1,18 +1,143 @@
+import collections
 import numpy
 
 
+"""Geometry utilities. All point inputs are 3-by-n arrays of x,y,z coordinates,
+ordered the same way as the LEDs on the strip."""
+
+
+# Precomputed coordinates of the LEDs in several coordinate systems. These only
+# depend on the LED locations, so they're computed once per location change
+# (see LocationModel.get_coordinates()) rather than on every frame.
+COORDINATE_FIELDS = [
+    'xyz',                # 3-by-n x,y,z coordinates
+    'cylindrical',        # 3-by-n r,theta,h coordinates
+    'spherical',          # 3-by-n rho,theta,phi coordinates
+    'polar',              # 2-by-n x,y coordinates of the polar projection
+    'arc_length',         # n-array, position along the strip, from 0 to 1
+]
+
+
+class Coordinates(collections.namedtuple('Coordinates', COORDINATE_FIELDS)):
+    """
+    The coordinates of the LEDs (see COORDINATE_FIELDS), plus
+    neighbor_distance: an n-array of the distance from each LED to the closest
+    other LED. That takes O(n^2) time to compute, so it's only computed the
+    first time it's used, and then kept.
+
+    If the coordinates are those of only some of the LEDs (as in the workers
+    of lightoy.render_farm), 'neighborhood' is a tuple of the 3-by-N x,y,z
+    coordinates of all the LEDs and the indices (or slice) of these LEDs
+    among them, so that their neighbors are looked for among all the LEDs.
+    """
+    def __new__(cls, *args, **kwargs):
+        neighborhood = kwargs.pop('neighborhood', None)
+        self = super(Coordinates, cls).__new__(cls, *args, **kwargs)
+        self.neighborhood = neighborhood
+        self._neighbor_distance = None
+        return self
+
+    @property
+    def neighbor_distance(self):
+        if self._neighbor_distance is None:
+            if self.neighborhood is None:
+                distances = neighbor_distance(self.xyz)
+            else:
+                all_xyz, leds = self.neighborhood
+                distances = neighbor_distance(all_xyz)[leds]
+            distances.flags.writeable = False
+            self._neighbor_distance = distances
+        return self._neighbor_distance
+
+# The maximum number of pairwise distances held in memory at once when looking
+# for nearest neighbors.
+_MAX_DISTANCE_BLOCK = 1 << 22
+
+
 def cartesian_to_cylindrical(xyz):
     """Args:
         xyz: A 3-by-n array representing the x,y,z coordinates.
 
     Returns: A 3-by-n array tuple representing the r,theta,h coordinates.
     """
-    n = xyz.shape[1]
-    rth = numpy.zeros((3, n))
-    for i in range(n):
-        x, y, z = xyz[:, i]
-        r = numpy.sqrt(x**2 + y**2)
-        theta = numpy.arctan2(y, x)
-        h = z
-        rth[:, i] = [r, theta, h]
+    x, y, z = xyz
+    rth = numpy.empty(xyz.shape)
+    numpy.hypot(x, y, out=rth[0])
+    numpy.arctan2(y, x, out=rth[1])
+    rth[2] = z
     return rth
+
+
+def cartesian_to_spherical(xyz):
+    """Args:
+        xyz: A 3-by-n array representing the x,y,z coordinates.
+
+    Returns: A 3-by-n array representing the rho,theta,phi coordinates, where
+        theta is the azimuth in the x-y plane and phi is the angle from the
+        positive z axis (0 for points at the origin).
+    """
+    x, y, z = xyz
+    rtp = numpy.empty(xyz.shape)
+    numpy.sqrt(x**2 + y**2 + z**2, out=rtp[0])
+    numpy.arctan2(y, x, out=rtp[1])
+    numpy.arctan2(numpy.hypot(x, y), z, out=rtp[2])
+    return rtp
+
+
+def polar_projection(xyz):
+    """Projects the points onto a disc, as if looking down the z axis with the
+    distance from the center given by the height: points at z=-1 map to the
+    center, and points at z=1 map to the unit circle.
+
+    Returns: A 2-by-n array representing the x,y coordinates on the disc.
+    """
+    x, y, z = xyz
+    theta = numpy.arctan2(y, x)
+    radius = (z + 1.) / 2.
+    return numpy.vstack([radius * numpy.cos(theta),
+                         radius * numpy.sin(theta)])
+
+
+def arc_length(xyz):
+    """Returns: An n-array with the distance travelled along the strip to reach
+    each point, normalized so the first point is at 0 and the last at 1.
+    """
+    lengths = numpy.zeros(xyz.shape[1])
+    if xyz.shape[1] < 2:
+        return lengths
+    steps = numpy.linalg.norm(numpy.diff(xyz, axis=1), axis=0)
+    numpy.cumsum(steps, out=lengths[1:])
+    if lengths[-1] > 0:
+        lengths /= lengths[-1]
+    return lengths
+
+
+def neighbor_distance(xyz):
+    """Returns: An n-array with the distance from each point to the closest
+    other point (infinity if there are no other points).
+    """
+    n = xyz.shape[1]
+    points = xyz.T
+    squared_norms = numpy.sum(points**2, axis=1)
+    distances = numpy.empty(n)
+    block_size = max(1, _MAX_DISTANCE_BLOCK // max(n, 1))
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b
+        block = points[start:stop] @ points.T
+        block *= -2.
+        block += squared_norms[start:stop, numpy.newaxis]
+        block += squared_norms
+        block[numpy.arange(stop - start), numpy.arange(start, stop)] = numpy.inf
+        distances[start:stop] = block.min(axis=1)
+    numpy.maximum(distances, 0., out=distances)
+    return numpy.sqrt(distances, out=distances)
+
+
+def get_coordinates(xyz):
+    """Returns: A Coordinates namedtuple for the given x,y,z coordinates."""
+    return Coordinates(xyz=xyz,
+                       cylindrical=cartesian_to_cylindrical(xyz),
+                       spherical=cartesian_to_spherical(xyz),
+                       polar=polar_projection(xyz),
+                       arc_length=arc_length(xyz))
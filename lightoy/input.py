@@ -7,32 +7,113 @@ import numpy
 INPUT_DIMS = [
     'focus_x',  # float
     'focus_y',  # float
-    'fade'      # float, from 0 to 1
+    'fade',     # float, from 0 to 1
+    'touches',  # tuple of the (x, y) of every current touch, of all clients
+    'clients',  # tuple of the (focus_x, focus_y, fade) of each client
 ]
+# The dimensions that are single floats.
+SCALAR_INPUT_DIMS = ['focus_x', 'focus_y', 'fade']
 
 TOUCH_HIST_LENGTH = 15
+# How far back in the touch history the velocity of a released touch is
+# measured from. Too-recent history is too noisy.
+VELOCITY_HIST_LENGTH = 10
+
+# The client that input comes from when none is given.
+DEFAULT_CLIENT = 0
 
 InputState = collections.namedtuple('InputState', INPUT_DIMS)
 
+# An immutable snapshot of the touch input of one client, as published to the
+# render thread:
+#   touching: Whether there's an active touch.
+#   x, y: The location of the primary touch (the first of the touches, which
+#       is followed until it's lifted), or of the last one.
+#   generation: Identifies the touch; unique across clients.
+#   sequence: The order of the last event of the touch, across clients.
+#   num_samples: The number of events in the history of the touch.
+#   dx, dy, dt: The change of the location and time across the recent
+#       history of the touch, for its velocity when released.
+#   touches: A tuple of the (x, y) of every current touch of the client.
+TouchSnapshot = collections.namedtuple(
+    'TouchSnapshot',
+    ['touching', 'x', 'y', 'generation', 'sequence', 'num_samples', 'dx',
+     'dy', 'dt', 'touches'])
 
-class InputProcessor:
-    """
-    Keeps track of input state and calculates functions based on input.
+NO_TOUCH = TouchSnapshot(False, 0., 0., 0, 0, 0, 0., 0., 0., ())
 
-    Note on thread-safety: All of the "on..." methods are called from one
-    thread, while the "get_state" method is called from another thread.
 
-    Every 't' argument is the time in seconds since the server was started.
+class TouchHistory(object):
+    """
+    The touch history of one client, kept by the thread that handles the
+    input events. The (x,y,t) locations of the previous touch locations are
+    kept in a preallocated ring buffer, and after every event an immutable
+    TouchSnapshot of the touch is published by replacing 'snapshot'.
+
+    The touch is that of the primary touch: the first of the touches when it
+    started, which is followed by its 'id' (if the client sends IDs) for as
+    long as it lasts.
     """
     def __init__(self):
-        # List of current touches, each a dict with 'x' and 'y' fields.
-        self.cur_touches = []
-        # Represents the (x,y,t) locations of the previous touch locations.
-        self.touch_history = numpy.zeros((3, TOUCH_HIST_LENGTH))
-        # The number of previous consecutive state updates in which there was
-        # an active touch.
-        self.n_last_touched = 0
+        self.history = numpy.zeros((3, TOUCH_HIST_LENGTH))
+        # The index of the latest location in the history.
+        self.head = 0
+        self.snapshot = NO_TOUCH
+        # The ID of the primary touch.
+        self.primary_id = None
 
+    def get_primary(self, touches):
+        """Returns the primary touch among touches, or None if it was
+        lifted."""
+        for touch in touches:
+            if touch.get('id') == self.primary_id:
+                return touch
+        return None
+
+    def start(self, touches, t, generation, sequence):
+        self.primary_id = touches[0].get('id')
+        self._update(touches[0], touches, t, generation, sequence, 1)
+
+    def move(self, touches, t, sequence):
+        """Moves the primary touch, which must be among touches."""
+        self._update(self.get_primary(touches), touches, t,
+                     self.snapshot.generation, sequence,
+                     self.snapshot.num_samples + 1)
+
+    def end(self, sequence):
+        self.snapshot = self.snapshot._replace(touching=False,
+                                               sequence=sequence, touches=())
+
+    def _update(self, touch, touches, t, generation, sequence, num_samples):
+        x = touch['x']
+        y = touch['y']
+        history = self.history
+        head = (self.head + 1) % TOUCH_HIST_LENGTH
+        history[0, head] = x
+        history[1, head] = y
+        history[2, head] = t
+        self.head = head
+        # Measure the velocity from VELOCITY_HIST_LENGTH events back, or from
+        # the first event of the touch if it's more recent.
+        back = min(VELOCITY_HIST_LENGTH, num_samples - 1)
+        old = (head - back) % TOUCH_HIST_LENGTH
+        self.snapshot = TouchSnapshot(
+            True, x, y, generation, sequence, num_samples,
+            x - history[0, old], y - history[1, old], t - history[2, old],
+            tuple((touch['x'], touch['y']) for touch in touches))
+
+
+class Focus(object):
+    """
+    A focus point that's moved around by touches, with momentum, and the fade
+    of the touches. Kept by the render thread, and updated from TouchSnapshots
+    once per frame.
+    """
+    def __init__(self):
+        # The generation of the last touch that was seen touching, and of the
+        # last touch whose release was handled.
+        self.touched_generation = 0
+        self.released_generation = 0
         # Fade in/out effect. Increases from 0 to 1 when touch is applied,
         # and then drops to 0 when touch is released.
         self.fade = 0.
@@ -48,6 +129,78 @@ class InputProcessor:
         self.focus_x_offset = 0.
         self.focus_y_offset = 0.
 
+    def update(self, snapshot, dt):
+        """Advances the focus point by dt seconds, given the current touch."""
+        if snapshot.touching:
+            if snapshot.generation != self.touched_generation:
+                # A new touch moves the focus point relative to where it is.
+                self.touched_generation = snapshot.generation
+                self.focus_x_offset = self.focus_x - snapshot.x
+                self.focus_y_offset = self.focus_y - snapshot.y
+            self.focus_x = snapshot.x + self.focus_x_offset
+            self.focus_y = snapshot.y + self.focus_y_offset
+            self.fade += 0.02
+        else:
+            self.fade -= 0.005
+            if snapshot.generation != self.released_generation and \
+                    snapshot.num_samples > 1:
+                # Touch was applied in at least two previous events, and was
+                # just released.
+                if snapshot.dt > 0:
+                    # TODO: make this a param
+                    max_velocity = 3.
+                    self.x_velocity = max(-max_velocity, min(
+                        max_velocity, snapshot.dx / snapshot.dt))
+                    self.y_velocity = max(-max_velocity, min(
+                        max_velocity, snapshot.dy / snapshot.dt))
+            else:
+                # friction
+                resistance = 0.5
+                self.x_velocity *= (1. - resistance * dt)
+                self.y_velocity *= (1. - resistance * dt)
+                self.focus_x += self.x_velocity * dt
+                self.focus_y += self.y_velocity * dt
+            self.released_generation = snapshot.generation
+
+        self.fade = min(1., max(0., self.fade))
+
+
+class InputProcessor:
+    """
+    Keeps track of input state and calculates functions based on input.
+
+    Input comes from any number of clients (e.g. touchpads), each with any
+    number of simultaneous touches. Each client has its own focus point, which
+    is moved by its primary touch (see TouchHistory). The main focus point
+    follows the most recently started touch of any client, so with a single
+    client it behaves just like that client's focus point.
+
+    Note on thread-safety: All of the "on..." methods are called from one
+    thread (the writer), while the "get_state" method is called from another
+    thread (the reader). They don't share any mutable state: the writer keeps
+    a TouchHistory per client, and publishes the set of clients by replacing
+    the 'client_histories' tuple; each TouchHistory publishes immutable
+    snapshots of its touch the same way. Both replacements are atomic, so the
+    reader always sees consistent touches, without locking. The focus points
+    are owned by the reader.
+
+    Every 't' argument is the time in seconds since the server was started.
+    """
+    def __init__(self):
+        # Writer state.
+        # Client ID => TouchHistory.
+        self.histories = {}
+        # The published (client ID, TouchHistory) tuples, in the order the
+        # clients were added.
+        self.client_histories = ()
+        # Counters of the touches, and of the events.
+        self.generation = 0
+        self.sequence = 0
+
+        # Reader state.
+        self.focus = Focus()
+        # Client ID => Focus.
+        self.client_focus = {}
         self.last_t = None
 
     def get_state(self, t):
@@ -64,86 +217,90 @@ class InputProcessor:
             dt = 0
         self.last_t = t
 
-        # Load the touches so that they're consistent
-        touches = self.cur_touches
+        # Load the touches once, so that they're consistent
+        snapshots = [(client_id, history.snapshot)
+                     for client_id, history in self.client_histories]
 
-        if touches:
-            touch = touches[0]
-            self.focus_x = touch['x'] + self.focus_x_offset
-            self.focus_y = touch['y'] + self.focus_y_offset
-            self.fade += 0.02
+        # The main focus point follows the latest touch, or the touch that
+        # ended last if there's none.
+        touching = [snapshot for _, snapshot in snapshots
+                    if snapshot.touching]
+        if touching:
+            primary = max(touching, key=lambda snapshot: snapshot.generation)
+        elif snapshots:
+            primary = max((snapshot for _, snapshot in snapshots),
+                          key=lambda snapshot: snapshot.sequence)
         else:
-            self.fade -= 0.005
-            #
-            if self.n_last_touched > 1:
-                # TODO: describe how we don't want to use too-recent history
-                if self.n_last_touched > 10:
-                    last_i = 10
-                else:
-                    last_i = self.n_last_touched - 1
-
-                # Touch was applied in at least two previous frames, and was
-                # just released.
-                diffs = self.touch_history[:, 0] - self.touch_history[:, last_i]
-                t_dx, t_dy, t_dt = diffs
-                if t_dt <= 0:
-                    raise Exception("hey, it does happen")
-
-                # TODO: make this a param
-                max_velocity = 3.
-
-                self.x_velocity = t_dx / t_dt
-                if abs(self.x_velocity) > max_velocity:
-                    self.x_velocity = numpy.sign(self.x_velocity) * max_velocity
+            primary = NO_TOUCH
+        self.focus.update(primary, dt)
 
-                self.y_velocity = t_dy / t_dt
-                if abs(self.y_velocity) > max_velocity:
-                    self.y_velocity = numpy.sign(self.y_velocity) * max_velocity
+        if len(self.client_focus) != len(snapshots) or \
+                any(client_id not in self.client_focus
+                    for client_id, _ in snapshots):
+            self.client_focus = {
+                client_id: self.client_focus.get(client_id) or Focus()
+                for client_id, _ in snapshots}
+        touches = ()
+        clients = []
+        for client_id, snapshot in snapshots:
+            focus = self.client_focus[client_id]
+            focus.update(snapshot, dt)
+            touches += snapshot.touches
+            clients.append((focus.focus_x, focus.focus_y, focus.fade))
 
-                print (self.x_velocity, self.y_velocity)
+        return InputState(focus_x=self.focus.focus_x,
+                          focus_y=self.focus.focus_y,
+                          fade=self.focus.fade,
+                          touches=touches,
+                          clients=tuple(clients))
 
-            else:
-                # friction
-                resistance = 0.5
-                self.x_velocity *= (1. - resistance * dt)
-                self.y_velocity *= (1. - resistance * dt)
-                self.focus_x += self.x_velocity * dt
-                self.focus_y += self.y_velocity * dt
-            self.n_last_touched = 0
-
-        self.fade = numpy.clip(self.fade, 0.0, 1.0)
+    def get_touches(self, client_id=DEFAULT_CLIENT):
+        """Returns the (x, y) of the client's current touches. Should only be
+        called from the writer thread."""
+        history = self.histories.get(client_id)
+        return history.snapshot.touches if history is not None else ()
 
-        return InputState(focus_x=self.focus_x,
-                          focus_y=self.focus_y,
-                          fade=self.fade)
-
-    # TODO: The thread reading the input may be different from the one updating
-    # the input, so this could lead to race conditions. Consider returning some
-    # sort of immutable InputState object.
-    def on_touch_start(self, touches, t):
+    def on_touch_start(self, touches, t, client_id=DEFAULT_CLIENT):
         """
         Args:
             touches: a list of dicts with 'x' and 'y' fields, ranging from
-                     0 to 1.
+                     0 to 1, of all the client's current touches, and
+                     optionally an 'id' field identifying each touch.
+            client_id: The client the touches come from.
         """
-        touch = touches[0]
-        self._update_touch_history(touch['x'], touch['y'], t)
-        self.focus_x_offset = self.focus_x - touch['x']
-        self.focus_y_offset = self.focus_y - touch['y']
-        self.cur_touches = touches
-
-    def on_touch_move(self, touches, t):
-        touch = touches[0]
-        self._update_touch_history(touch['x'], touch['y'], t)
-        self.cur_touches = touches
-
-    def on_touch_end(self, t):
-        self.cur_touches = []
-
-    def on_touch_cancel(self, t):
-        return self.on_touch_end(t)
-
-    def _update_touch_history(self, x, y, t):
-        self.touch_history = numpy.roll(self.touch_history, 1, 1)
-        self.touch_history[:, 0] = [x, y, t]
-        self.n_last_touched += 1
+        # Another finger just moves the touch on.
+        self.on_touch_move(touches, t, client_id)
+
+    def on_touch_move(self, touches, t, client_id=DEFAULT_CLIENT):
+        history = self._get_history(client_id)
+        self.sequence += 1
+        if history.snapshot.touching and \
+                history.get_primary(touches) is not None:
+            history.move(touches, t, self.sequence)
+        else:
+            # Once the primary touch is lifted, the remaining touches are a
+            # new touch, so the focus point doesn't jump to them.
+            self.generation += 1
+            history.start(touches, t, self.generation, self.sequence)
+
+    def on_touch_end(self, t, client_id=DEFAULT_CLIENT, touches=()):
+        """touches are the client's remaining touches, if any."""
+        if touches:
+            return self.on_touch_move(touches, t, client_id)
+        self.sequence += 1
+        self._get_history(client_id).end(self.sequence)
+
+    def on_touch_cancel(self, t, client_id=DEFAULT_CLIENT, touches=()):
+        return self.on_touch_end(t, client_id, touches)
+
+    def on_client_disconnect(self, client_id):
+        """Forgets about a client."""
+        if self.histories.pop(client_id, None) is not None:
+            self.client_histories = tuple(self.histories.items())
+
+    def _get_history(self, client_id):
+        history = self.histories.get(client_id)
+        if history is None:
+            history = self.histories[client_id] = TouchHistory()
+            self.client_histories = tuple(self.histories.items())
+        return history
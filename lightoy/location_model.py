@@ -1,5 +1,7 @@
 import numpy
 
+import lightoy.geometry
+
 
 class LocationModel(object):
     """A LocationModel is used to obtain the 3D position of each LED. This
@@ -8,31 +10,87 @@ class LocationModel(object):
 
     Of course, the location of all the LEDs may not be known, but an approximate
     answer might be useful.
+
+    Locations are cached: subclasses implement compute_locations(), and list
+    the global parameters that the locations depend on in 'param_names'. The
+    locations (and anything derived from them via get_derived()) are only
+    recomputed when the value of one of those parameters changes. The returned
+    arrays are read-only, since they're shared between frames.
     """
-    def get_locations(self, session):
+    # Names of the global parameters that the locations depend on.
+    param_names = []
+
+    def __init__(self):
+        self._cache_key = None
+        self._locations = None
+        # (function => read-only result) cache of values derived from the
+        # current locations.
+        self._derived = {}
+
+    def compute_locations(self, session):
         """Returns a 3-by-N array representing locations of the LEDs
         in the x,y,z dimensions. Each dimension should range from -1 to 1.
         """
         raise Exception("Not implemented")
 
+    def get_cache_key(self, session):
+        """Returns the values of the parameters the locations depend on."""
+        return tuple(session.global_params[name].get_value()
+                     for name in self.param_names)
+
+    def get_locations(self, session):
+        """Returns a read-only 3-by-N array representing locations of the LEDs
+        (see compute_locations()), recomputing it only if needed.
+        """
+        cache_key = self.get_cache_key(session)
+        if self._locations is None or cache_key != self._cache_key:
+            self._locations = _read_only(self.compute_locations(session))
+            self._cache_key = cache_key
+            self._derived = {}
+        return self._locations
+
+    def get_derived(self, session, derive_fn):
+        """Returns derive_fn(locations), which should be an array or a tuple of
+        arrays, as read-only arrays. The result is cached until the locations
+        change.
+        """
+        locations = self.get_locations(session)
+        if derive_fn not in self._derived:
+            self._derived[derive_fn] = _read_only(derive_fn(locations))
+        return self._derived[derive_fn]
+
+    def get_coordinates(self, session):
+        """Returns a lightoy.geometry.Coordinates bundle of the locations in
+        several coordinate systems, computed once per change of locations.
+        """
+        return self.get_derived(session, lightoy.geometry.get_coordinates)
+
+    def get_cylindrical(self, session):
+        """Returns the locations in r,theta,h cylindrical coordinates."""
+        return self.get_derived(session,
+                                lightoy.geometry.cartesian_to_cylindrical)
+
 
 class Spiral(LocationModel):
     """Produces locations for a strip of LEDs arranged in a spiral.
     """
+    # How many total twists there are in the spiral. This is a tunable
+    # parameter since I've found it easier to determine this via tweaking
+    # until it looks right.
+    param_names = ['twists']
+
     def __init__(self, num_leds):
+        super(Spiral, self).__init__()
         self.num_leds = num_leds
 
-    def get_locations(self, session):
+    def compute_locations(self, session):
         # orientation of spiral, looking from the top
         # 1 for counterclockwise, -1 for clockwise
         orientation = -1
-        # How many total twists there are in the spiral. This is a tunable
-        # parameter since I've found it easier to determine this via tweaking
-        # until it looks right.
         twists = session.global_params['twists'].get_value()
         # angle in x-y plane swept between two consequent LEDs
         theta_per_led = 2. * numpy.pi * twists / self.num_leds
-        thetas = numpy.array(range(self.num_leds)) * theta_per_led
+        thetas = numpy.arange(self.num_leds) * theta_per_led
         locations = numpy.zeros((3, self.num_leds))
         # X
         locations[0, :] = numpy.cos(thetas * orientation)
@@ -41,3 +99,11 @@ class Spiral(LocationModel):
         # Z
         locations[2, :] = numpy.linspace(-1., 1., self.num_leds)
         return locations
+
+
+def _read_only(value):
+    """Marks an array, or every array in a tuple, as read-only."""
+    arrays = value if isinstance(value, tuple) else (value,)
+    for array in arrays:
+        array.flags.writeable = False
+    return value
@@ -1,4 +1,12 @@
+import collections
+import numpy
 import serial
+import socket
+import struct
+import threading
+import time
+
+import lightoy.serial_protocol
 
 
 class Output(object):
@@ -14,11 +22,28 @@ class Output(object):
         """
         raise Exception("not implemented")
 
+    def output_pixels(self, pixels):
+        """
+        Outputs LED bytes that are already encoded, e.g. from a recording.
+        Outputs that can't send the bytes as they are decode them into colors,
+        which they quantize back to the same bytes.
+
+        Args:
+            pixels: NUM_LEDS x 3 uint8 array of the LED bytes, as encoded by
+                lightoy.serial_protocol.encode_pixels().
+        """
+        colors = numpy.empty((3, pixels.shape[0]))
+        lightoy.serial_protocol.decode_pixels(pixels, colors)
+        self.output(colors)
+
 
 class DummyOutput(object):
     def output(self, colors):
         pass
 
+    def output_pixels(self, pixels):
+        pass
+
 
 class SerialOutput(Output):
     """
@@ -30,12 +55,23 @@ class SerialOutput(Output):
 
     The assumption is that the serial device is a Teensy board with the
     firmware being that compiled from teensy/lightoy_arduino.ino.
+
+    The frame is encoded into a preallocated buffer with array operations, and
+    handed to pyserial without copying.
+
+    If compression is enabled, frames are sent as run-length encoded deltas
+    from the previous frame when that's smaller, with a full frame (keyframe)
+    at least every keyframe_interval frames so that the device recovers from
+    any lost bytes. See lightoy.serial_protocol for the format.
     """
-    OUT_HEADER = bytes("head", 'utf-8')
+    OUT_HEADER = lightoy.serial_protocol.FULL_HEADER
 
-    def __init__(self, serial_device_name, baud=115200):
+    def __init__(self, serial_device_name, baud=115200, compression=False,
+                 keyframe_interval=100):
         self.serial_device_name = serial_device_name
         self.baud = baud
+        self.compression = compression
+        self.keyframe_interval = keyframe_interval
         self.serial = serial.Serial(
             self.serial_device_name,
             self.baud,
@@ -45,18 +81,370 @@ class SerialOutput(Output):
             rtscts=False,
             dsrdtr=False,
             inter_byte_timeout=None)
+        # Wire frame: the header followed by the GRB bytes of each LED.
+        self.out_data = None
+        # The LED bytes of out_data, as a NUM_LEDS x 3 uint8 array.
+        self.out_pixels = None
+        # Scratch array for the quantized colors.
+        self.quantized = None
+        # For compression: the LED bytes of the last frame sent, the delta
+        # frame buffer, and the number of frames since the last keyframe.
+        self.last_pixels = None
+        self.delta_data = bytearray()
+        self.frames_since_keyframe = 0
 
     def output(self, colors):
-        out_data = self._get_out_data(colors)
+        self._write(self._get_out_data(colors))
+
+    def output_pixels(self, pixels):
+        """
+        Outputs LED bytes that are already encoded, e.g. from a recording.
+
+        Args:
+            pixels: NUM_LEDS x 3 uint8 array of the bytes to send, as encoded
+                by lightoy.serial_protocol.encode_pixels().
+        """
+        if self.out_pixels is None or \
+                self.out_pixels.shape[0] != pixels.shape[0]:
+            self._allocate(pixels.shape[0])
+        numpy.copyto(self.out_pixels, pixels)
+        self._write(memoryview(self.out_data))
+
+    def _write(self, out_data):
+        if self.compression:
+            out_data = self._compress(out_data)
         self.serial.write(out_data)
         self.serial.flush()
 
+    def _compress(self, out_data):
+        """Returns the delta frame for the frame in out_data if it's due and
+        smaller, or out_data otherwise."""
+        if self.last_pixels is None or \
+                self.last_pixels.shape != self.out_pixels.shape:
+            self.last_pixels = self.out_pixels.copy()
+            self.frames_since_keyframe = 0
+            return out_data
+        data = out_data
+        if self.frames_since_keyframe + 1 < self.keyframe_interval:
+            del self.delta_data[:]
+            self.delta_data += lightoy.serial_protocol.DELTA_HEADER
+            if lightoy.serial_protocol.encode_delta(
+                    self.out_pixels, self.last_pixels, self.delta_data) and \
+                    len(self.delta_data) < len(out_data):
+                data = self.delta_data
+        if data is out_data:
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+        numpy.copyto(self.last_pixels, self.out_pixels)
+        return data
+
+    def _allocate(self, num_leds):
+        header_length = len(self.OUT_HEADER)
+        self.out_data = bytearray(header_length + 3 * num_leds)
+        self.out_data[:header_length] = self.OUT_HEADER
+        self.out_pixels = numpy.frombuffer(
+            self.out_data, dtype=numpy.uint8,
+            offset=header_length).reshape((num_leds, 3))
+        self.quantized = numpy.empty((3, num_leds))
+
     def _get_out_data(self, colors):
-        out_data = bytearray(self.OUT_HEADER)
+        """Returns a memoryview of the encoded frame. The underlying buffer is
+        reused by the next call."""
         num_leds = colors.shape[1]
-        for led in range(num_leds):
-            r, g, b = colors[:, num_leds - led - 1]
-            out_data.append(int(g * 255))
-            out_data.append(int(r * 255))
-            out_data.append(int(b * 255))
-        return out_data
+        if self.out_pixels is None or self.out_pixels.shape[0] != num_leds:
+            self._allocate(num_leds)
+        lightoy.serial_protocol.encode_pixels(colors, self.out_pixels,
+                                              self.quantized)
+        return memoryview(self.out_data)
+
+
+class DitheredOutput(Output):
+    """
+    Wraps another Output, which quantizes colors to 8 bits, and temporally
+    dithers the frames passed to it.
+
+    The quantization error of each LED's channels is carried over to the next
+    frame, so that over several frames the average output matches the
+    (higher precision) rendered colors. At high refresh rates, this makes dim
+    levels and slow fades much smoother than plain rounding, which collapses
+    them into a few visible steps.
+    """
+    LEVELS = 255
+
+    def __init__(self, output):
+        self.wrapped = output
+        # The accumulated quantization error, in units of a level.
+        self.error = None
+        self.target = None
+        self.dithered = None
+
+    def output(self, colors):
+        if self.error is None or self.error.shape != colors.shape:
+            self.error = numpy.zeros(colors.shape)
+            self.target = numpy.zeros(colors.shape)
+            self.dithered = numpy.zeros(colors.shape)
+        numpy.multiply(colors, self.LEVELS, out=self.target)
+        self.target += self.error
+        numpy.rint(self.target, out=self.dithered)
+        numpy.clip(self.dithered, 0., self.LEVELS, out=self.dithered)
+        numpy.subtract(self.target, self.dithered, out=self.error)
+        # Colors outside of the output range would otherwise accumulate error
+        # indefinitely.
+        numpy.clip(self.error, -0.5, 0.5, out=self.error)
+        # Center each color within its level, so that the wrapped output's
+        # quantization yields exactly that level.
+        self.dithered += 0.5
+        self.dithered /= self.LEVELS
+        self.wrapped.output(self.dithered)
+
+    def output_pixels(self, pixels):
+        # Encoded bytes have already been dithered (or quantized), so
+        # dithering them again would change them.
+        self.wrapped.output_pixels(pixels)
+
+
+class ThreadedOutput(Output):
+    """
+    Wraps another Output so that frames are written from a dedicated writer
+    thread. output() only copies the frame into a buffer and queues it, so
+    rendering the next frame overlaps with the (possibly slow) I/O of the
+    previous one.
+
+    The queue is bounded: if the writer can't keep up, the oldest queued frame
+    is dropped in favor of the newest one, and counted in the metrics.
+
+    If the wrapped output raises an exception (e.g. when a serial device is
+    unplugged), the writer thread stops, and the exception is raised again by
+    the next call to output(), so that the failure isn't hidden.
+    """
+    # Number of recent writes used to calculate the achieved frame rate.
+    FPS_WINDOW = 100
+
+    def __init__(self, output, queue_size=1):
+        if queue_size < 1:
+            raise Exception("queue_size must be at least 1, not %d"
+                            % queue_size)
+        self.wrapped = output
+        self.queue_size = queue_size
+        # (write function, buffer) tuples of the frames waiting to be written,
+        # oldest first.
+        self.pending = collections.deque()
+        # Buffers that can be reused for new frames.
+        self.free = []
+        self.condition = threading.Condition()
+        self.closed = False
+        # The exception raised by the wrapped output, if any.
+        self.failure = None
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.write_times = collections.deque(maxlen=self.FPS_WINDOW)
+        self.writer_thread = threading.Thread(target=self._write_loop,
+                                              daemon=True)
+        self.writer_thread.start()
+
+    def output(self, colors):
+        self._queue(self.wrapped.output, colors)
+
+    def output_pixels(self, pixels):
+        self._queue(self.wrapped.output_pixels, pixels)
+
+    def _queue(self, write, frame):
+        """Queues a copy of the frame, to be passed to write() by the writer
+        thread."""
+        with self.condition:
+            if self.failure is not None:
+                raise self.failure
+            buf = self.free.pop() if self.free else None
+        if buf is None or buf.shape != frame.shape or \
+                buf.dtype != frame.dtype:
+            buf = numpy.empty(frame.shape, dtype=frame.dtype)
+        numpy.copyto(buf, frame)
+        with self.condition:
+            if len(self.pending) >= self.queue_size:
+                self.free.append(self.pending.popleft()[1])
+                self.frames_dropped += 1
+            self.pending.append((write, buf))
+            self.condition.notify()
+
+    def close(self):
+        """Stops the writer thread once the queued frames are written."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer_thread.join()
+
+    def get_metrics(self):
+        """Returns a dict with the achieved frame rate (in Hz) of the writes,
+        the number of queued frames, and the number of frames written and
+        dropped so far."""
+        with self.condition:
+            write_times = list(self.write_times)
+            metrics = {
+                'queue_depth': len(self.pending),
+                'frames_written': self.frames_written,
+                'frames_dropped': self.frames_dropped,
+            }
+        if len(write_times) > 1 and write_times[-1] > write_times[0]:
+            metrics['fps'] = ((len(write_times) - 1)
+                              / (write_times[-1] - write_times[0]))
+        else:
+            metrics['fps'] = 0.
+        return metrics
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                write, buf = self.pending.popleft()
+            try:
+                write(buf)
+            except Exception as e:
+                # TODO: logging
+                print("Output failed:", e)
+                with self.condition:
+                    self.failure = e
+                    self.pending.clear()
+                return
+            with self.condition:
+                self.free.append(buf)
+                self.frames_written += 1
+                self.write_times.append(time.monotonic())
+
+
+class OutputRouter(Output):
+    """
+    Splits each frame into segments of LEDs, and sends each segment to its own
+    Output. This allows driving more LEDs than a single device can handle, e.g.
+    with several Teensy boards on different serial ports.
+
+    Unless threaded is False, each segment's output is wrapped in a
+    ThreadedOutput, so the devices are all written to in parallel.
+    """
+    def __init__(self, segments, threaded=True, queue_size=1):
+        """
+        Args:
+            segments: A list of (Output, LEDs) tuples. The LEDs are either a
+                (start, stop) tuple for a contiguous range of LEDs, or a
+                sequence of LED indices, in the order the output expects them.
+        """
+        self.segments = []
+        for output, leds in segments:
+            if threaded:
+                output = ThreadedOutput(output, queue_size)
+            if isinstance(leds, tuple):
+                leds = slice(*leds)
+                buf = None
+            else:
+                leds = numpy.asarray(leds, dtype=numpy.intp)
+                # Gathered colors of the segment's LEDs.
+                buf = numpy.zeros((3, len(leds)))
+            self.segments.append((output, leds, buf))
+
+    def output(self, colors):
+        for output, leds, buf in self.segments:
+            if buf is None:
+                output.output(colors[:, leds])
+            else:
+                numpy.take(colors, leds, axis=1, out=buf)
+                output.output(buf)
+
+    def output_pixels(self, pixels):
+        # The LED bytes are in reverse order (see
+        # lightoy.serial_protocol.encode_pixels()), both for the whole frame
+        # and for each segment.
+        num_leds = pixels.shape[0]
+        for output, leds, _ in self.segments:
+            if isinstance(leds, slice):
+                start, stop, _ = leds.indices(num_leds)
+                output.output_pixels(pixels[num_leds - stop:num_leds - start])
+            else:
+                output.output_pixels(pixels[num_leds - 1 - leds[::-1]])
+
+    def get_metrics(self):
+        """Returns a list with the metrics of each threaded segment output."""
+        return [output.get_metrics() for output, _, _ in self.segments
+                if isinstance(output, ThreadedOutput)]
+
+    def close(self):
+        for output, _, _ in self.segments:
+            if isinstance(output, ThreadedOutput):
+                output.close()
+
+
+class ArtNetOutput(Output):
+    """
+    Outputs LED colors over the network, using the Art-Net protocol (ArtDmx
+    packets over UDP), as understood by many LED controllers.
+
+    The LEDs are split into consecutive DMX universes of up to
+    leds_per_universe LEDs (3 channels each), starting at start_universe. All
+    the packets of a frame are preallocated, filled in with array operations
+    and sent back to back. If sync is set, an ArtSync packet follows each
+    frame, so that controllers that support it display all the universes at
+    the same time.
+    """
+    PORT = 6454
+    ID = b'Art-Net\x00'
+    OP_DMX = 0x5000
+    OP_SYNC = 0x5200
+    PROTOCOL_VERSION = 14
+    DMX_HEADER_SIZE = 18
+    CHANNELS = {'RGB': (0, 1, 2), 'GRB': (1, 0, 2), 'BGR': (2, 1, 0)}
+
+    def __init__(self, host, num_leds, port=PORT, start_universe=0,
+                 leds_per_universe=170, channel_order='RGB', sync=False):
+        assert channel_order in self.CHANNELS, \
+            "unknown channel order: %s" % channel_order
+        self.address = (host, port)
+        self.num_leds = num_leds
+        self.channels = self.CHANNELS[channel_order]
+        self.sync = sync
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Sequence numbers go from 1 to 255; 0 would disable reordering.
+        self.sequence = 0
+        # Scratch arrays for the quantized colors.
+        self.quantized = numpy.zeros((3, num_leds))
+        self.pixels = numpy.zeros((num_leds, 3), dtype=numpy.uint8)
+        # List of (packet, packet data as a uint8 array, LED range) tuples,
+        # one per universe.
+        self.packets = []
+        for i, start in enumerate(range(0, num_leds, leds_per_universe)):
+            stop = min(num_leds, start + leds_per_universe)
+            # The DMX data length has to be even.
+            length = 3 * (stop - start) + (3 * (stop - start)) % 2
+            packet = bytearray(self.DMX_HEADER_SIZE + length)
+            self._pack_dmx_header(packet, start_universe + i, length)
+            data = numpy.frombuffer(packet, dtype=numpy.uint8,
+                                    offset=self.DMX_HEADER_SIZE)
+            self.packets.append((packet, data, (start, stop)))
+        self.sync_packet = self.ID + struct.pack(
+            '<H', self.OP_SYNC) + struct.pack(
+            '>H', self.PROTOCOL_VERSION) + bytes(2)
+
+    def _pack_dmx_header(self, packet, universe, length):
+        packet[0:8] = self.ID
+        struct.pack_into('<H', packet, 8, self.OP_DMX)
+        struct.pack_into('>H', packet, 10, self.PROTOCOL_VERSION)
+        # Sequence (12) and physical port (13) are left at 0 here.
+        # 15-bit Port-Address: SubUni (low byte), then Net.
+        struct.pack_into('<H', packet, 14, universe & 0x7fff)
+        struct.pack_into('>H', packet, 16, length)
+
+    def output(self, colors):
+        numpy.multiply(colors, 255., out=self.quantized)
+        numpy.clip(self.quantized, 0., 255., out=self.quantized)
+        for i, channel in enumerate(self.channels):
+            numpy.copyto(self.pixels[:, i], self.quantized[channel],
+                         casting='unsafe')
+        self.sequence = self.sequence % 255 + 1
+        for packet, data, (start, stop) in self.packets:
+            data[:3 * (stop - start)] = self.pixels[start:stop].reshape(-1)
+            packet[12] = self.sequence
+            self.socket.sendto(packet, self.address)
+        if self.sync:
+            self.socket.sendto(self.sync_packet, self.address)
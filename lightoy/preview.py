@@ -0,0 +1,98 @@
+import numpy
+import time
+
+import lightoy.output
+
+
+"""Live previews of the rendered frames, for remote monitoring."""
+
+
+class FramePreview(object):
+    """
+    The latest rendered frame, as published by the render thread for preview
+    subscribers (see lightoy.server.handlers.preview).
+
+    The render thread calls publish() at most max_fps times a second, and only
+    while there are subscribers, so previews cost it next to nothing: a copy
+    of the frame, which is published by replacing 'frame'. Subscribers read
+    'frame' (and 'locations') from another thread without locking, and do any
+    downsampling and encoding themselves.
+    """
+    def __init__(self, max_fps=30.):
+        self.max_fps = max_fps
+        self.num_subscribers = 0
+        # The (sequence number, 3-by-n float32 array) of the latest frame.
+        self.frame = (0, None)
+        # The (version, 3-by-n array) of the LED locations; the version
+        # changes whenever the locations do.
+        self.locations = (0, None)
+        self.last_publish_time = None
+
+    def subscribe(self):
+        self.num_subscribers += 1
+
+    def unsubscribe(self):
+        self.num_subscribers -= 1
+
+    def wants_frame(self):
+        """Returns whether the next frame should be published."""
+        if self.num_subscribers <= 0 or self.max_fps <= 0:
+            return False
+        return self.last_publish_time is None or \
+            time.monotonic() - self.last_publish_time >= 1. / self.max_fps
+
+    def publish(self, colors, locations):
+        """Publishes a 3-by-n array of colors, rendered at the given read-only
+        locations (see LocationModel.get_locations())."""
+        self.last_publish_time = time.monotonic()
+        version, last_locations = self.locations
+        if locations is not last_locations:
+            self.locations = (version + 1, locations)
+        self.frame = (self.frame[0] + 1,
+                      numpy.array(colors, dtype=numpy.float32))
+
+
+class PreviewOutput(lightoy.output.Output):
+    """Wraps another Output, and publishes the frames passed to it to a
+    FramePreview."""
+    def __init__(self, output, preview, session, location_model):
+        self.wrapped = output
+        self.preview = preview
+        self.session = session
+        self.location_model = location_model
+
+    def output(self, colors):
+        if self.preview.wants_frame():
+            self.preview.publish(
+                colors, self.location_model.get_locations(self.session))
+        self.wrapped.output(colors)
+
+
+def get_groups(num_leds, max_leds):
+    """Returns the indices of the first LEDs of the groups of consecutive LEDs
+    that num_leds LEDs are downsampled to, so that there are at most
+    max_leds groups."""
+    num_groups = max(1, min(num_leds, max_leds))
+    return numpy.linspace(0, num_leds, num_groups,
+                          endpoint=False).astype(int)
+
+
+def downsample(values, groups):
+    """Averages each group (see get_groups()) of the columns of the 2D array
+    values."""
+    sums = numpy.add.reduceat(values, groups, axis=1)
+    counts = numpy.diff(numpy.append(groups, values.shape[1]))
+    return sums / counts
+
+
+def encode_frame(sequence, colors):
+    """
+    Encodes a frame for previews.
+
+    Returns:
+        bytes holding the sequence number as a little-endian uint32, and the
+        R, G and B of each LED as uint8s.
+    """
+    pixels = numpy.rint(numpy.clip(colors.T * 255., 0., 255.))
+    return (numpy.array([sequence & 0xffffffff], dtype='<u4').tobytes() +
+            pixels.astype(numpy.uint8).tobytes())
@@ -0,0 +1,107 @@
+import numpy
+import time
+
+
+"""Low-overhead timing of the stages of the render loop."""
+
+
+# The stages of a frame, in the order they happen.
+RENDER_STAGES = [
+    'input',       # InputProcessor.get_state()
+    'locations',   # LocationModel.get_locations() and get_coordinates()
+    'effects',     # Effect.update_state() and render(), including layers
+    'correction',  # clipping and color correction
+    'output',      # Output.output(); for threaded outputs, just the queueing
+]
+
+# Upper edges (in milliseconds) of the bins of the stage time histograms. The
+# last bin holds everything above the last edge.
+HISTOGRAM_EDGES_MS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5., 10., 20.,
+                      50.]
+
+
+class RenderProfiler(object):
+    """
+    Records how long each stage of recent frames took.
+
+    The render loop calls start_frame() at the start of each frame, and
+    mark(stage) at the end of each stage, which attributes the time since the
+    previous call to that stage. A frame is committed to a preallocated ring
+    buffer of the last 'window' frames when the next one starts, so recording
+    costs a clock read and an array store per stage.
+
+    get_summary() can be called from another thread. It reads the ring buffer
+    without locking, so a summary may include a frame that's being committed,
+    which is fine for monitoring.
+    """
+    def __init__(self, stages=RENDER_STAGES, window=1000):
+        self.stages = list(stages)
+        self.stage_indices = {stage: i for i, stage in enumerate(stages)}
+        self.window = window
+        # Ring buffers of the stage times (in seconds) and start time of the
+        # committed frames.
+        self.stage_times = numpy.zeros((window, len(stages)))
+        self.start_times = numpy.zeros(window)
+        self.num_frames = 0
+        # The frame in progress.
+        self.frame_start = None
+        self.frame_times = numpy.zeros(len(stages))
+        self.last_mark = None
+
+    def start_frame(self):
+        """Commits the frame in progress, if any, and starts a new one."""
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            row = self.num_frames % self.window
+            self.stage_times[row] = self.frame_times
+            self.start_times[row] = self.frame_start
+            self.num_frames += 1
+        self.frame_times.fill(0.)
+        self.frame_start = now
+        self.last_mark = now
+
+    def mark(self, stage):
+        """Ends the given stage of the frame in progress."""
+        now = time.perf_counter()
+        if self.last_mark is not None:
+            self.frame_times[self.stage_indices[stage]] += now - self.last_mark
+        self.last_mark = now
+
+    def get_summary(self):
+        """
+        Returns a JSON-serializable dict summarizing the recent frames:
+            fps: The frame rate, from the start times of the frames.
+            frames: The total number of frames recorded.
+            histogram_edges_ms: HISTOGRAM_EDGES_MS.
+            stages: A list of dicts for each stage (and 'total', for whole
+                frames) with its name, the mean, median, 90th and 99th
+                percentile and maximum time (in milliseconds), and the number
+                of frames in each bin of the histogram.
+        """
+        count = min(self.num_frames, self.window)
+        stage_times = self.stage_times[:count] * 1000.
+        start_times = numpy.sort(self.start_times[:count])
+        summary = {
+            'fps': 0.,
+            'frames': self.num_frames,
+            'histogram_edges_ms': HISTOGRAM_EDGES_MS,
+            'stages': [],
+        }
+        if count > 1 and start_times[-1] > start_times[0]:
+            summary['fps'] = (count - 1) / (start_times[-1] - start_times[0])
+        bins = [0.] + HISTOGRAM_EDGES_MS + [numpy.inf]
+        columns = [(stage, stage_times[:, i])
+                   for i, stage in enumerate(self.stages)]
+        columns.append(('total', stage_times.sum(axis=1)))
+        for stage, times in columns:
+            stage_summary = {'name': stage}
+            for key, value in [('mean_ms', numpy.mean),
+                               ('p50_ms', numpy.median),
+                               ('p90_ms', lambda a: numpy.percentile(a, 90)),
+                               ('p99_ms', lambda a: numpy.percentile(a, 99)),
+                               ('max_ms', numpy.max)]:
+                stage_summary[key] = float(value(times)) if count else 0.
+            stage_summary['histogram'] = (
+                numpy.histogram(times, bins)[0].tolist())
+            summary['stages'].append(stage_summary)
+        return summary
@@ -0,0 +1,232 @@
+import collections
+import json
+import mmap
+import numpy
+import struct
+import threading
+import time
+
+import lightoy.output
+import lightoy.params
+import lightoy.serial_protocol
+
+
+"""
+Recording of rendered frames to a file, and replaying them without rendering.
+
+A recording is a memory-mapped file holding a fixed number of frames in a ring:
+once it's full, each new frame overwrites the oldest one. The file starts with
+a header (see HEADER_FORMAT) followed by the frame records, each of which is:
+    * The time of the frame (seconds since the start of the session), as a
+      little-endian double.
+    * The name of the current effect, UTF-8 encoded and padded with zeros to
+      EFFECT_NAME_SIZE bytes. Longer names are truncated (between
+      characters).
+    * A JSON snapshot of the scalar parameters, padded with zeros to the
+      recording's params_size bytes.
+    * The LED bytes, exactly as they're sent to the serial device (see
+      lightoy.serial_protocol.encode_pixels()).
+"""
+
+
+MAGIC = b'LTREC'
+VERSION = 1
+# Magic, version, number of LEDs, capacity (in frames), params size, and the
+# total number of frames recorded.
+HEADER_FORMAT = '<5sBIIIQ'
+HEADER_SIZE = 64
+EFFECT_NAME_SIZE = 32
+
+# A frame read from a recording. 'pixels' is an n-by-3 uint8 array of the LED
+# bytes, which is only valid until the frame is overwritten.
+RecordedFrame = collections.namedtuple(
+    'RecordedFrame', ['t', 'effect_name', 'params', 'pixels'])
+
+
+def _record_size(num_leds, params_size):
+    return 8 + EFFECT_NAME_SIZE + params_size + 3 * num_leds
+
+
+class FrameRecorder(object):
+    """Writes frames to a recording file, replacing any existing file."""
+    def __init__(self, filename, num_leds, capacity, params_size=1024):
+        """
+        Args:
+            filename: The recording file.
+            num_leds: The number of LEDs in each frame.
+            capacity: The number of frames kept; older frames are overwritten.
+            params_size: The space (in bytes) reserved for the parameters of
+                each frame.
+        """
+        self.num_leds = num_leds
+        self.capacity = capacity
+        self.params_size = params_size
+        self.record_size = _record_size(num_leds, params_size)
+        self.num_frames = 0
+        self.quantized = numpy.zeros((3, num_leds))
+        self.file = open(filename, 'w+b')
+        self.file.truncate(HEADER_SIZE + capacity * self.record_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self._write_header()
+
+    def record(self, colors, t, effect_name, params):
+        """
+        Appends a frame to the recording.
+
+        Args:
+            colors: A 3-by-n array of the rendered colors, in [0, 1].
+            t: The time of the frame.
+            effect_name: The name of the current effect. Only its first
+                EFFECT_NAME_SIZE bytes (of whole characters) are kept.
+            params: A JSON-serializable dict of parameter values.
+        """
+        params_data = json.dumps(params).encode('utf-8')
+        if len(params_data) > self.params_size:
+            raise Exception("parameters take %d bytes, more than the %d "
+                            "reserved for them"
+                            % (len(params_data), self.params_size))
+        offset = (HEADER_SIZE
+                  + (self.num_frames % self.capacity) * self.record_size)
+        struct.pack_into('<d%ds' % EFFECT_NAME_SIZE, self.map, offset, t,
+                         _truncate_name(effect_name))
+        offset += 8 + EFFECT_NAME_SIZE
+        self.map[offset:offset + self.params_size] = params_data.ljust(
+            self.params_size, b'\x00')
+        offset += self.params_size
+        pixels = numpy.frombuffer(self.map, dtype=numpy.uint8,
+                                  count=3 * self.num_leds,
+                                  offset=offset).reshape((-1, 3))
+        lightoy.serial_protocol.encode_pixels(colors, pixels, self.quantized)
+        del pixels
+        # The frame count is updated last, so that readers don't see a frame
+        # before it's written. Once the ring is full, though, the oldest frame
+        # is overwritten in place, so a reader of that frame may see it
+        # partially overwritten.
+        self.num_frames += 1
+        self._write_header()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def _write_header(self):
+        struct.pack_into(HEADER_FORMAT, self.map, 0, MAGIC, VERSION,
+                         self.num_leds, self.capacity, self.params_size,
+                         self.num_frames)
+
+
+def _truncate_name(effect_name):
+    """Returns the UTF-8 encoding of the name, truncated to EFFECT_NAME_SIZE
+    bytes without splitting a character."""
+    return effect_name.encode('utf-8')[:EFFECT_NAME_SIZE].decode(
+        'utf-8', 'ignore').encode('utf-8')
+
+
+class RecordingOutput(lightoy.output.Output):
+    """
+    Wraps another Output, and records every frame passed to it, along with
+    the session's current effect and scalar parameters.
+    """
+    def __init__(self, output, recorder, session):
+        self.wrapped = output
+        self.recorder = recorder
+        self.session = session
+
+    def output(self, colors):
+        session = self.session
+        effect_name = session.get_current_effect_name()
+        params = {
+            'global': _get_scalar_values(session.global_params),
+            'effect': _get_scalar_values(
+                session.effects[effect_name].params),
+        }
+        # last_t is the time of the frame that was just rendered.
+        self.recorder.record(colors, session.last_t or 0., effect_name,
+                             params)
+        self.wrapped.output(colors)
+
+
+def _get_scalar_values(params):
+    return {name: float(param.get_value()) for name, param in params.items()
+            if isinstance(param, lightoy.params.Scalar)}
+
+
+class Recording(object):
+    """Reads the frames of a recording file, oldest first."""
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_leds, self.capacity, self.params_size, _ = \
+            struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("%s isn't a version %d recording"
+                            % (filename, VERSION))
+        self.record_size = _record_size(self.num_leds, self.params_size)
+
+    def __len__(self):
+        return min(self._get_num_frames(), self.capacity)
+
+    def get_frame(self, i):
+        """Returns the i-th oldest frame as a RecordedFrame."""
+        num_frames = self._get_num_frames()
+        if not 0 <= i < min(num_frames, self.capacity):
+            raise IndexError("frame %d not in recording" % i)
+        first = max(0, num_frames - self.capacity)
+        offset = (HEADER_SIZE
+                  + ((first + i) % self.capacity) * self.record_size)
+        t, effect_name = struct.unpack_from('<d%ds' % EFFECT_NAME_SIZE,
+                                            self.map, offset)
+        offset += 8 + EFFECT_NAME_SIZE
+        params = json.loads(self.map[offset:offset + self.params_size]
+                            .rstrip(b'\x00').decode('utf-8'))
+        offset += self.params_size
+        pixels = numpy.frombuffer(self.map, dtype=numpy.uint8,
+                                  count=3 * self.num_leds,
+                                  offset=offset).reshape((-1, 3))
+        return RecordedFrame(t, effect_name.rstrip(b'\x00').decode('utf-8'),
+                             params, pixels)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_frame(i)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _get_num_frames(self):
+        return struct.unpack_from(HEADER_FORMAT, self.map, 0)[-1]
+
+
+class RecordingPlayer(object):
+    """
+    Plays a recording back to an Output, at the pace it was recorded at
+    (scaled by 'speed'). No effects are rendered: the recorded LED bytes are
+    passed to Output.output_pixels(), so serial devices get exactly the bytes
+    that were recorded.
+    """
+    def __init__(self, recording, output, speed=1., loop=False):
+        self.recording = recording
+        self.output = output
+        self.speed = speed
+        self.loop = loop
+        self.stop_event = threading.Event()
+
+    def play(self):
+        """Plays the recording (forever, if loop is set) until stop() is
+        called."""
+        while not self.stop_event.is_set():
+            start_time = None
+            for frame in self.recording:
+                if start_time is None:
+                    start_time = time.monotonic() - frame.t / self.speed
+                delay = start_time + frame.t / self.speed - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    return
+                self.output.output_pixels(frame.pixels)
+            if not self.loop or not len(self.recording):
+                return
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,295 @@
+import multiprocessing
+import numpy
+import traceback
+
+import lightoy.effects
+import lightoy.geometry
+import lightoy.params
+
+
+"""Rendering of effects in multiple processes, for large LED arrays."""
+
+
+# The rows taken by each field of lightoy.geometry.Coordinates in the shared
+# geometry buffer.
+GEOMETRY_ROWS = {
+    'xyz': 3,
+    'cylindrical': 3,
+    'spherical': 3,
+    'polar': 2,
+    'arc_length': 1,
+}
+
+
+def _geometry_slices():
+    """Returns a (field name => slice of rows) dict for the geometry buffer,
+    and the total number of rows."""
+    slices = {}
+    row = 0
+    for field in lightoy.geometry.COORDINATE_FIELDS:
+        slices[field] = slice(row, row + GEOMETRY_ROWS[field])
+        row += GEOMETRY_ROWS[field]
+    return slices, row
+
+
+def _shared_array(raw_array, shape):
+    return numpy.frombuffer(raw_array, dtype=numpy.float64).reshape(shape)
+
+
+def _slice_leds(value, num_leds, start, stop):
+    """Returns the part of a per-LED array (one whose last dimension is the
+    number of LEDs) that belongs to a shard. Other values are returned as-is.
+    """
+    if isinstance(value, numpy.ndarray) and value.ndim > 0 and \
+            value.shape[-1] == num_leds:
+        return value[..., start:stop].copy()
+    return value
+
+
+def _merge_states(states, shards):
+    """Merges the states of an effect from each shard's worker. Per-LED arrays
+    are concatenated, and other values are taken from the first worker."""
+    merged = {}
+    for name, value in states[0].items():
+        if all(isinstance(state[name], numpy.ndarray) and
+               state[name].ndim > 0 and state[name].shape[-1] == stop - start
+               for state, (start, stop) in zip(states, shards)):
+            merged[name] = numpy.concatenate(
+                [state[name] for state in states], axis=-1)
+        else:
+            merged[name] = value
+    return merged
+
+
+class RenderFarm(object):
+    """
+    Renders effects in a pool of worker processes.
+
+    The LEDs are partitioned into contiguous shards, one per worker. Each worker
+    has its own instance of every effect, covering only its shard's LEDs. The
+    LED coordinates are passed to the workers, and the rendered colors are
+    collected from them, through shared memory; only the frame's inputs and the
+    scalar parameters are sent with every frame.
+
+    Per-LED parameters and state (arrays whose last dimension is the number of
+    LEDs) are split between the workers when the farm is started, and the
+    parameters are re-sent whenever they're replaced (e.g. reset). From then
+    on, each effect's state lives in the workers, which update it for their
+    own LEDs exactly as a single process would. This means the results don't
+    depend on the number of workers, as long as effects treat each LED
+    independently.
+
+    Before the main process renders effects itself (e.g. for transitions or
+    layers), fetch_states() copies their state back from the workers; the
+    state is sent to the workers again the next time the farm renders them.
+    """
+    def __init__(self, num_leds, num_workers, effects):
+        """
+        Args:
+            num_leds: The total number of LEDs.
+            num_workers: The number of worker processes.
+            effects: The (effect name => Effect) dict whose parameters and
+                state the workers start with.
+        """
+        self.num_leds = num_leds
+        self.geometry_slices, geometry_rows = _geometry_slices()
+        # Workers are spawned rather than forked, since the server process
+        # has other threads running.
+        context = multiprocessing.get_context('spawn')
+        self.geometry_raw = context.RawArray('d', geometry_rows * num_leds)
+        self.output_raw = context.RawArray('d', 3 * num_leds)
+        self.geometry = _shared_array(self.geometry_raw,
+                                      (geometry_rows, num_leds))
+        self.output = _shared_array(self.output_raw, (3, num_leds))
+        self.shards = [
+            (int(shard[0]), int(shard[-1]) + 1)
+            for shard in numpy.array_split(numpy.arange(num_leds), num_workers)
+            if len(shard)]
+        self.connections = []
+        self.workers = []
+        for start, stop in self.shards:
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(
+                target=_worker_main,
+                args=(worker_connection, self.geometry_raw, self.output_raw,
+                      num_leds, start, stop),
+                daemon=True)
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+        # The coordinates that were last copied into the geometry buffer.
+        self.last_coords = None
+        # (effect name, param name) => the last value sent to the workers.
+        self.sent_values = {}
+        # Names of the effects whose state in the workers is newer than the
+        # main process's, and of those whose state in the workers is older.
+        self.remote_effects = set()
+        self.stale_effects = set()
+        for effect_name, effect in effects.items():
+            self._sync_effect(effect_name, effect, include_state=True)
+
+    def render(self, effect_name, effect, t, t_diff, inputs, coords):
+        """Renders a frame of the effect.
+
+        Args:
+            effect_name: The name of the effect to render.
+            effect: The Effect instance whose parameters are used.
+            The rest of the arguments are those of Effect.do_render().
+
+        Returns:
+            A 3-by-n array of the rendered colors. The array is reused by the
+            next call.
+        """
+        geometry_changed = coords is not self.last_coords
+        if geometry_changed:
+            for field, rows in self.geometry_slices.items():
+                self.geometry[rows] = getattr(coords, field)
+            self.last_coords = coords
+        self._sync_effect(effect_name, effect,
+                          include_state=effect_name in self.stale_effects)
+        self.stale_effects.discard(effect_name)
+        scalars = {
+            name: param.get_value()
+            for name, param in effect.params.items()
+            if isinstance(param, lightoy.params.Scalar)}
+        for connection in self.connections:
+            connection.send(('render', effect_name, t, t_diff, inputs,
+                             scalars, geometry_changed))
+        self._wait_for_workers()
+        self.remote_effects.add(effect_name)
+        return self.output
+
+    def fetch_states(self, effects):
+        """Copies the state of the effects that the workers rendered since
+        their state was last fetched back into the (effect name => Effect)
+        dict."""
+        for effect_name in self.remote_effects:
+            for connection in self.connections:
+                connection.send(('get_state', effect_name))
+            effects[effect_name].state = _merge_states(
+                self._wait_for_workers(), self.shards)
+            self.stale_effects.add(effect_name)
+        self.remote_effects.clear()
+
+    # How long (in seconds) close() waits for each worker to stop.
+    CLOSE_TIMEOUT = 5.
+
+    def close(self):
+        """Stops the workers, and releases the pipes and shared buffers."""
+        for connection in self.connections:
+            try:
+                connection.send(('stop',))
+            except (BrokenPipeError, OSError):
+                # The worker is already gone.
+                pass
+        for worker in self.workers:
+            worker.join(self.CLOSE_TIMEOUT)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.workers = []
+        self.geometry = self.output = None
+        self.geometry_raw = self.output_raw = None
+
+    def terminate(self):
+        """Stops the workers without waiting for them, e.g. after a failure.
+        """
+        for worker in self.workers:
+            worker.terminate()
+
+    def _sync_effect(self, effect_name, effect, include_state=False):
+        """Sends the effect's non-scalar parameters that changed since they
+        were last sent (and, if include_state is set, its state) to the
+        workers."""
+        params = {
+            name: param.get_value()
+            for name, param in effect.params.items()
+            if not isinstance(param, lightoy.params.Scalar) and
+            self.sent_values.get((effect_name, name)) is not param.get_value()}
+        if not params and not include_state:
+            return
+        for name, value in params.items():
+            self.sent_values[(effect_name, name)] = value
+        for connection, (start, stop) in zip(self.connections, self.shards):
+            shard_params = {
+                name: _slice_leds(value, self.num_leds, start, stop)
+                for name, value in params.items()}
+            shard_state = None
+            if include_state:
+                shard_state = {
+                    name: _slice_leds(value, self.num_leds, start, stop)
+                    for name, value in effect.state.items()}
+            connection.send(('sync', effect_name, shard_params, shard_state))
+        self._wait_for_workers()
+
+    def _wait_for_workers(self):
+        """Returns the results of the workers' replies, raising an exception
+        if any of them failed."""
+        replies = [connection.recv() for connection in self.connections]
+        errors = [error for error, _ in replies if error is not None]
+        if errors:
+            raise Exception("render worker failed:\n%s" % errors[0])
+        return [result for _, result in replies]
+
+
+def _shard_coordinates(geometry, slices, start, stop):
+    """Returns the Coordinates of the [start, stop) LEDs, viewing the shared
+    geometry buffer."""
+    # The neighbors of the shard's LEDs are looked for among all the LEDs.
+    coords = lightoy.geometry.Coordinates(
+        neighborhood=(geometry[slices['xyz']], slice(start, stop)),
+        **{field: geometry[rows, start:stop].squeeze(axis=0)
+           if rows.stop - rows.start == 1 else geometry[rows, start:stop]
+           for field, rows in slices.items()})
+    for array in coords:
+        array.flags.writeable = False
+    return coords
+
+
+def _worker_main(connection, geometry_raw, output_raw, num_leds, start, stop):
+    """Runs a render worker, which renders the [start, stop) LEDs of the
+    requested effects. Replies to every message with an (error, result) tuple:
+    the error is None, or the traceback of an exception."""
+    slices, geometry_rows = _geometry_slices()
+    geometry = _shared_array(geometry_raw, (geometry_rows, num_leds))
+    output = _shared_array(output_raw, (3, num_leds))
+    coords = None
+    effects = lightoy.effects.create_effects(stop - start)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # The main process is gone.
+            return
+        if message[0] == 'stop':
+            return
+        result = None
+        try:
+            if message[0] == 'sync':
+                _, effect_name, params, state = message
+                effect = effects[effect_name]
+                for name, value in params.items():
+                    effect.params[name].set_value(value)
+                if state is not None:
+                    effect.state = state
+            elif message[0] == 'render':
+                _, effect_name, t, t_diff, inputs, scalars, \
+                    geometry_changed = message
+                if coords is None or geometry_changed:
+                    # New coordinates, so that values derived from them
+                    # (e.g. neighbor_distance) aren't reused.
+                    coords = _shard_coordinates(geometry, slices, start, stop)
+                effect = effects[effect_name]
+                for name, value in scalars.items():
+                    effect.params[name].set_value(value)
+                output[:, start:stop] = effect.do_render(
+                    coords.xyz, t, t_diff, inputs, coords)
+            elif message[0] == 'get_state':
+                result = effects[message[1]].state
+            connection.send((None, result))
+        except Exception:
+            connection.send((traceback.format_exc(), None))
@@ -0,0 +1,98 @@
+import collections
+import math
+import numpy
+import time
+
+
+class FrameScheduler(object):
+    """
+    Paces the render loop at a target frame rate.
+
+    Frame deadlines are spaced evenly on the monotonic clock, independently of
+    how long each frame took to render, so the frame rate doesn't drift. If a
+    frame finishes after its deadline, the deadline counts as missed and the
+    schedule skips ahead to the next deadline that's still in the future.
+
+    In adaptive mode, the frame rate is lowered (down to min_fps) when
+    rendering takes up too much of the frame interval, and raised back to
+    target_fps once the load goes down.
+
+    Usage:
+        scheduler = FrameScheduler(200)
+        while True:
+            render_and_output()
+            scheduler.wait_for_next_frame()
+    """
+    # Number of recent frames used for the statistics.
+    STATS_WINDOW = 1000
+    # In adaptive mode, the fraction of the frame interval that rendering is
+    # allowed to take up.
+    ADAPTIVE_LOAD = 0.8
+    # Smoothing factor of the moving average of the render time.
+    SMOOTHING = 0.05
+
+    def __init__(self, target_fps, adaptive=False, min_fps=None):
+        assert 0 < target_fps < math.inf, \
+            "target_fps must be positive and finite: %s" % target_fps
+        self.target_fps = target_fps
+        self.adaptive = adaptive
+        self.min_fps = min_fps if min_fps is not None else target_fps / 4.
+        assert 0 < self.min_fps <= target_fps, \
+            "min_fps must be in (0, target_fps]: %s" % self.min_fps
+        self.fps = float(target_fps)
+        self.frames = 0
+        self.missed_deadlines = 0
+        # Moving average of the time taken from waking up to the next call to
+        # wait_for_next_frame(), in seconds.
+        self.avg_work_time = 0.
+        # Lateness of each wake-up relative to its deadline, in seconds.
+        self.jitter = collections.deque(maxlen=self.STATS_WINDOW)
+        self.frame_start = time.monotonic()
+        self.deadline = self.frame_start
+
+    def wait_for_next_frame(self):
+        """Sleeps until the start of the next frame."""
+        now = time.monotonic()
+        work_time = now - self.frame_start
+        self.frames += 1
+        self.avg_work_time += self.SMOOTHING * (work_time - self.avg_work_time)
+        if self.adaptive:
+            self._adapt_fps()
+
+        interval = 1. / self.fps
+        self.deadline += interval
+        if now > self.deadline:
+            self.missed_deadlines += 1
+            # Don't try to catch up on the missed frames; resume the schedule
+            # at the next deadline.
+            missed_intervals = math.ceil((now - self.deadline) / interval)
+            self.deadline += missed_intervals * interval
+
+        time.sleep(max(0., self.deadline - now))
+        self.frame_start = time.monotonic()
+        self.jitter.append(self.frame_start - self.deadline)
+
+    def get_stats(self):
+        """Returns a dict with the current frame rate, the number of frames and
+        missed deadlines, and the median, 90th and 99th percentile of the
+        jitter (in milliseconds) over recent frames."""
+        stats = {
+            'fps': self.fps,
+            'frames': self.frames,
+            'missed_deadlines': self.missed_deadlines,
+            'avg_work_ms': self.avg_work_time * 1000.,
+        }
+        jitter = numpy.array(self.jitter) * 1000.
+        for percentile in [50, 90, 99]:
+            stats['jitter_p%d_ms' % percentile] = (
+                float(numpy.percentile(jitter, percentile))
+                if len(jitter) else 0.)
+        return stats
+
+    def _adapt_fps(self):
+        if self.avg_work_time > 0:
+            sustainable_fps = self.ADAPTIVE_LOAD / self.avg_work_time
+        else:
+            sustainable_fps = self.target_fps
+        self.fps = float(numpy.clip(sustainable_fps, self.min_fps,
+                                    self.target_fps))
@@ -0,0 +1,217 @@
+import numpy
+
+
+"""
+The wire format used to send frames to the firmware (firmware/teensy.ino).
+
+Every frame starts with a 4-byte header. The LEDs are sent as 3-byte G,R,B
+values, in the order the firmware addresses them (which is the reverse of the
+order they're rendered in; see encode_pixels()).
+
+Full frames (keyframes) are sent as FULL_HEADER followed by the bytes of every
+LED.
+
+Delta frames are sent as DELTA_HEADER followed by a sequence of operations,
+each describing a run of consecutive LEDs relative to the previous frame, until
+all of the LEDs are covered. An operation starts with a byte whose top two bits
+are the kind of operation and whose bottom six bits are the number of LEDs in
+the run minus one (so runs are 1 to 64 LEDs long):
+    OP_SKIP: The LEDs are unchanged. No further bytes.
+    OP_LITERAL: Followed by the bytes of each LED in the run.
+    OP_FILL: Followed by the bytes of one color, which all the LEDs in the run
+        are set to.
+"""
+
+
+FULL_HEADER = b'head'
+DELTA_HEADER = b'hear'
+
+OP_SKIP = 0
+OP_LITERAL = 1
+OP_FILL = 2
+MAX_RUN = 64
+
+# The order in which the color channels are sent.
+CHANNELS = (1, 0, 2)  # G, R, B
+
+
+def encode_pixels(colors, pixels, quantized):
+    """Encodes rendered colors into the LED bytes that are sent.
+
+    Args:
+        colors: A 3-by-n array of colors in [0, 1].
+        pixels: The n-by-3 uint8 array the bytes are written to.
+        quantized: A 3-by-n scratch array.
+    """
+    # Same as int(x * 255) for each component, but clipped to [0, 255].
+    numpy.multiply(colors, 255., out=quantized)
+    numpy.clip(quantized, 0., 255., out=quantized)
+    # The LEDs are sent in reverse order.
+    reversed_pixels = pixels[::-1]
+    for i, channel in enumerate(CHANNELS):
+        numpy.copyto(reversed_pixels[:, i], quantized[channel],
+                     casting='unsafe')
+
+
+def decode_pixels(pixels, colors):
+    """The inverse of encode_pixels(): writes the colors of the n-by-3 uint8
+    array of LED bytes into the 3-by-n array 'colors'. Each color is centered
+    within its level, so that encoding it again yields the same bytes."""
+    reversed_pixels = pixels[::-1]
+    for i, channel in enumerate(CHANNELS):
+        numpy.copyto(colors[channel], reversed_pixels[:, i])
+    colors += 0.5
+    colors /= 255.
+
+
+def _append_op(out, kind, count):
+    out.append((kind << 6) | (count - 1))
+
+
+def _append_runs(out, kind, pixels, start, stop):
+    """Appends operations of the given kind covering the [start, stop) LEDs,
+    split into runs of at most MAX_RUN LEDs."""
+    for run_start in range(start, stop, MAX_RUN):
+        run_stop = min(stop, run_start + MAX_RUN)
+        _append_op(out, kind, run_stop - run_start)
+        if kind == OP_LITERAL:
+            out += pixels[run_start:run_stop].tobytes()
+        elif kind == OP_FILL:
+            out += pixels[run_start].tobytes()
+
+
+def encode_delta(pixels, previous, out):
+    """Appends the delta operations that turn 'previous' into 'pixels' to the
+    bytearray 'out' (without a header).
+
+    Args:
+        pixels: An n-by-3 uint8 array of the LED bytes to send.
+        previous: An n-by-3 uint8 array of the LED bytes of the previous
+            frame.
+        out: A bytearray to append to.
+
+    Returns:
+        False (with 'out' left unchanged) if the delta would likely be larger
+        than a full frame, True otherwise.
+    """
+    n = pixels.shape[0]
+    if n == 0:
+        return True
+    changed = numpy.any(pixels != previous, axis=1)
+    same_as_last = numpy.zeros(n, dtype=bool)
+    same_as_last[1:] = numpy.all(pixels[1:] == pixels[:-1], axis=1)
+    # A run is a stretch of unchanged LEDs, or of changed LEDs that all have
+    # the same color.
+    run_starts = numpy.ones(n, dtype=bool)
+    run_starts[1:] = ((changed[1:] != changed[:-1])
+                      | (changed[1:] & ~same_as_last[1:]))
+    starts = numpy.flatnonzero(run_starts)
+    # Each run takes an operation byte, plus 3 bytes per color for runs of
+    # changed LEDs. If that adds up to a full frame, don't bother encoding.
+    if len(starts) + 3 * numpy.count_nonzero(changed[starts]) >= 3 * n:
+        return False
+    stops = numpy.append(starts[1:], n)
+
+    literal_start = None
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if changed[start] and stop - start == 1:
+            # Single changed LEDs are gathered into literal runs.
+            if literal_start is None:
+                literal_start = start
+            continue
+        if literal_start is not None:
+            _append_runs(out, OP_LITERAL, pixels, literal_start, start)
+            literal_start = None
+        _append_runs(out, OP_FILL if changed[start] else OP_SKIP, pixels,
+                     start, stop)
+    if literal_start is not None:
+        _append_runs(out, OP_LITERAL, pixels, literal_start, n)
+    return True
+
+
+class FrameDecoder(object):
+    """
+    Decodes a stream of frames the same way the firmware does. This is a
+    stand-in for the firmware, for testing the encoding on the host.
+
+    Like the firmware, the decoder may have fewer LEDs than the frames: the
+    extra LEDs are ignored. Corrupt delta frames (with an unknown kind of
+    operation) are dropped, and decoding resumes at the next header.
+    """
+    def __init__(self, num_leds):
+        self.num_leds = num_leds
+        self.pixels = numpy.zeros((num_leds, 3), dtype=numpy.uint8)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Consumes the bytes of one or more frames.
+
+        Returns:
+            A list of n-by-3 uint8 arrays, one for each decoded frame.
+        """
+        self.buffer += data
+        frames = []
+        while True:
+            header_index = min(
+                [i for i in (self.buffer.find(FULL_HEADER),
+                             self.buffer.find(DELTA_HEADER)) if i >= 0],
+                default=-1)
+            if header_index < 0:
+                return frames
+            header = bytes(self.buffer[header_index:header_index + 4])
+            body = memoryview(self.buffer)[header_index + 4:]
+            if header == FULL_HEADER:
+                decoded = self._decode_full(body)
+            else:
+                decoded = self._decode_delta(body)
+            body.release()
+            if decoded is None:
+                # Incomplete frame; wait for more data.
+                return frames
+            consumed, complete = decoded
+            del self.buffer[:header_index + 4 + consumed]
+            if complete:
+                frames.append(self.pixels.copy())
+
+    def _decode_full(self, body):
+        """Returns the (number of bytes consumed, whether a frame was decoded)
+        of a full frame, or None if it's incomplete."""
+        num_bytes = 3 * self.num_leds
+        if len(body) < num_bytes:
+            return None
+        self.pixels[:] = numpy.frombuffer(
+            body[:num_bytes], dtype=numpy.uint8).reshape((-1, 3))
+        return num_bytes, True
+
+    def _decode_delta(self, body):
+        """Like _decode_full(), for a delta frame."""
+        pixels = self.pixels.copy()
+        led = 0
+        i = 0
+        while led < self.num_leds:
+            if i >= len(body):
+                return None
+            kind = body[i] >> 6
+            count = (body[i] & (MAX_RUN - 1)) + 1
+            i += 1
+            # Runs past the last LED only set the LEDs they cover.
+            stop = min(led + count, self.num_leds)
+            if kind == OP_LITERAL:
+                if i + 3 * count > len(body):
+                    return None
+                pixels[led:stop] = numpy.frombuffer(
+                    body[i:i + 3 * (stop - led)],
+                    dtype=numpy.uint8).reshape((-1, 3))
+                i += 3 * count
+            elif kind == OP_FILL:
+                if i + 3 > len(body):
+                    return None
+                pixels[led:stop] = numpy.frombuffer(body[i:i + 3],
+                                                    dtype=numpy.uint8)
+                i += 3
+            elif kind != OP_SKIP:
+                # Corrupt frame; skip to the next header.
+                return i, False
+            led += count
+        self.pixels = pixels
+        return i, True
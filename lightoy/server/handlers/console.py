@@ -1,15 +1,24 @@
 import aiohttp
+import asyncio
 import json
+import math
 import pystache
 
 from lightoy.server import lightoy_server
+import lightoy.compositor
 import lightoy.params
+import lightoy.server.protocol
+import lightoy.transition
 
 """
 Functions to handle HTTP/websocket requests for the web console. 
 """
 
 
+# How often (in seconds) the render profile is sent to console websockets.
+PROFILE_INTERVAL = 1.
+
+
 async def handle_console_request(request):
     session = request.app['session']
     template = lightoy_server.get_template('console')
@@ -60,7 +69,13 @@ async def handle_console_request(request):
 async def handle_change_effect_request(request):
     session = request.app['session']
     data = await request.post()
-    session.set_current_effect_name(data['effect'])
+    # An empty transition means the effect changes immediately.
+    transition_kind = data.get('transition', 'crossfade') or None
+    if transition_kind is not None and \
+            transition_kind not in lightoy.transition.TRANSITION_KINDS:
+        return aiohttp.web.Response(
+            status=400, text="unknown transition: %s" % transition_kind)
+    session.set_current_effect_name(data['effect'], transition_kind)
     return aiohttp.web.Response(status=302,
                                 headers={'Location': '/console'})
 
@@ -84,15 +99,11 @@ async def handle_update_params_request(request):
                                 headers={'Location': '/console'})
 
 
-# Each handler should return its response.
 # TODO: code duplication with the input.py ws message handler
 async def handle_websocket_message(msg, session):
-    handlers = {
-        'sliderUpdate': handle_slider_update,
-    }
     event = msg['ev']
-    if event in handlers:
-        return await handlers[event](msg, session)
+    if event in WEBSOCKET_HANDLERS:
+        return await WEBSOCKET_HANDLERS[event](msg, session)
     else:
         # TODO: logging
         print("Unrecognized event:", event, "in message:", msg)
@@ -116,11 +127,85 @@ async def handle_slider_update(msg, session):
         print("Unrecognized param:", name, "recognized:", param_dict.keys())
 
 
+async def handle_effect_change(msg, session):
+    name = msg['effect']
+    transition_kind = msg.get('transition', 'crossfade')
+    if name not in session.effects:
+        # TODO: logging
+        print("Unrecognized effect:", name)
+    elif transition_kind is not None and \
+            transition_kind not in lightoy.transition.TRANSITION_KINDS:
+        print("Unrecognized transition:", transition_kind)
+    else:
+        session.set_current_effect_name(name, transition_kind)
+
+
+def parse_opacity(value):
+    """Returns the opacity in a layerUpdate message as a float clamped to
+    [0, 1], or None if it isn't a finite number."""
+    try:
+        opacity = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(opacity):
+        return None
+    return min(max(opacity, 0.), 1.)
+
+
+async def handle_layer_update(msg, session):
+    """Adds, updates or (if 'remove' is set) removes the layer of an effect.
+    Once there are any layers, they're rendered instead of the current effect.
+    """
+    name = msg['effect']
+    opacity = parse_opacity(msg.get('opacity', 1.))
+    if name not in session.effects:
+        # TODO: logging
+        print("Unrecognized effect:", name)
+    elif msg.get('remove'):
+        session.compositor.remove_layer(name)
+    elif msg.get('blend', 'add') not in lightoy.compositor.BLEND_MODES:
+        print("Unrecognized blend mode:", msg['blend'])
+    elif opacity is None:
+        print("Invalid opacity:", msg['opacity'])
+    else:
+        session.compositor.set_layer(name, opacity, msg.get('blend', 'add'))
+
+
+# Event => handler. Each handler should return its response.
+WEBSOCKET_HANDLERS = {
+    'sliderUpdate': handle_slider_update,
+    'layerUpdate': handle_layer_update,
+    'effectChange': handle_effect_change,
+}
+
+
+async def send_profiles(ws, session):
+    """Sends the render profile (see lightoy.profiler) to the websocket every
+    PROFILE_INTERVAL seconds, as a 'profile' event."""
+    while not ws.closed:
+        profile = session.profiler.get_summary()
+        profile['ev'] = 'profile'
+        try:
+            await ws.send_json(profile)
+        except ConnectionResetError:
+            return
+        await asyncio.sleep(PROFILE_INTERVAL)
+
+
 async def handle_websocket_request(request):
     session = request.app['session']
-    ws = aiohttp.web.WebSocketResponse()
+    ws = aiohttp.web.WebSocketResponse(
+        protocols=[lightoy.server.protocol.BINARY_PROTOCOL])
     await ws.prepare(request)
+    profile_task = asyncio.ensure_future(send_profiles(ws, session))
+    try:
+        await handle_websocket_messages(ws, session)
+    finally:
+        profile_task.cancel()
+    return ws
+
 
+async def handle_websocket_messages(ws, session):
     async for msg in ws:
         if msg.type == aiohttp.WSMsgType.TEXT:
             if msg.data == 'close':
@@ -129,7 +214,20 @@ async def handle_websocket_request(request):
                 response = await handle_websocket_message(
                     json.loads(msg.data), session)
                 if response is not None:
-                    ws.send_json(response)
+                    await ws.send_json(response)
+        elif msg.type == aiohttp.WSMsgType.BINARY:
+            # Binary batches (see lightoy.server.protocol) only carry slider
+            # updates, which have no response; the batch is just acked.
+            try:
+                batch = lightoy.server.protocol.decode_batch(msg.data)
+            except Exception as e:
+                # TODO: logging
+                print("Invalid binary message:", e)
+                continue
+            for message in batch:
+                await handle_websocket_message(message, session)
+            await ws.send_bytes(
+                lightoy.server.protocol.encode_replies([], len(batch)))
         elif msg.type == aiohttp.WSMsgType.ERROR:
             print('ws connection closed with exception %s' %
                   ws.exception())
@@ -1,14 +1,28 @@
 import aiohttp
+import asyncio
+import itertools
 import json
 import pystache
+import time
 
 from lightoy.server import lightoy_server
+import lightoy.server.protocol
 
 """
 Functions to handle HTTP/websocket requests for the touch input.
 """
 
 
+# Touch moves are coalesced over this many seconds (about a frame): a move
+# that comes less than this long after the last one processed is held back,
+# and only the latest move of each client in that time is processed and
+# echoed back.
+COALESCE_INTERVAL = 0.005
+
+# IDs of the touchpad clients (see lightoy.input.InputProcessor).
+_client_ids = itertools.count(1)
+
+
 async def handle_touchpad_request(request):
     template = lightoy_server.get_template('touchpad')
     text = pystache.render(template, {})
@@ -16,17 +30,10 @@ async def handle_touchpad_request(request):
                                 headers={'content-type': 'text/html'})
 
 
-# Each handler should return its response.
-async def handle_websocket_message(msg, session):
-    handlers = {
-        'touchstart': handle_touch_start,
-        'touchmove': handle_touch_move,
-        'touchend': handle_touch_end,
-        'touchcancel': handle_touch_cancel
-    }
+async def handle_websocket_message(msg, session, client_id):
     event = msg['ev']
-    if event in handlers:
-        return await handlers[event](msg, session)
+    if event in WEBSOCKET_HANDLERS:
+        return await WEBSOCKET_HANDLERS[event](msg, session, client_id)
     else:
         # TODO: logging
         print("Unrecognized event:", event, "in message:", msg)
@@ -37,46 +44,167 @@ def pos(touches):
     return {'pos': touches}
 
 
-async def handle_touch_start(msg, session):
+async def handle_touch_start(msg, session, client_id):
     touches = msg['touches']
-    session.input_processor.on_touch_start(touches, session.get_time())
+    session.input_processor.on_touch_start(touches, session.get_time(),
+                                           client_id)
     print("touch start:", msg)
     return pos(touches)
 
 
-async def handle_touch_move(msg, session):
+async def handle_touch_move(msg, session, client_id):
     touches = msg['touches']
     session.input_processor.on_touch_move(
-        touches, session.get_time())
+        touches, session.get_time(), client_id)
     return pos(touches)
 
 
-async def handle_touch_end(msg, session):
-    session.input_processor.on_touch_end(session.get_time())
+async def handle_touch_end(msg, session, client_id):
+    # The touches are those that remain, if any.
+    touches = msg.get('touches', [])
+    session.input_processor.on_touch_end(session.get_time(), client_id,
+                                         touches)
     print("touch end:", msg)
-    return pos([])
+    return pos(touches)
 
 
-async def handle_touch_cancel(msg, session):
-    session.input_processor.on_touch_end(session.get_time())
+async def handle_touch_cancel(msg, session, client_id):
+    touches = msg.get('touches', [])
+    session.input_processor.on_touch_cancel(session.get_time(), client_id,
+                                            touches)
     print("touch end:", msg)
-    return pos([])
+    return pos(touches)
+
+
+# Event => handler. Each handler should return its response.
+WEBSOCKET_HANDLERS = {
+    'touchstart': handle_touch_start,
+    'touchmove': handle_touch_move,
+    'touchend': handle_touch_end,
+    'touchcancel': handle_touch_cancel
+}
+
+
+class TouchConnection(object):
+    """
+    Handles the messages of one touchpad websocket. Touch moves are coalesced:
+    a move is processed right away, unless one was processed less than
+    COALESCE_INTERVAL ago, in which case it's held back until then, and
+    replaced by any later move, so that a burst of moves is processed (and
+    echoed) about once a frame. Other events first process the held back
+    move, so events stay in order.
+
+    Replies are queued, and sent in order by send_replies(): as one JSON
+    message each, or as one frame of the binary protocol (see
+    lightoy.server.protocol) if the client negotiated it.
+    """
+    def __init__(self, ws, session):
+        self.ws = ws
+        self.session = session
+        self.binary = (ws.ws_protocol ==
+                       lightoy.server.protocol.BINARY_PROTOCOL)
+        self.client_id = next(_client_ids)
+        self.pending_move = None
+        self.flush_task = None
+        # The time.monotonic() of the last move processed.
+        self.last_move_time = None
+        self.replies = []
+        # Held while sending replies, so that they go out in order.
+        self.send_lock = asyncio.Lock()
+
+    async def handle_message(self, msg):
+        if msg['ev'] == 'touchmove':
+            self.pending_move = msg
+            if self.flush_task is not None:
+                return
+            delay = 0. if self.last_move_time is None else \
+                self.last_move_time + COALESCE_INTERVAL - time.monotonic()
+            if delay > 0:
+                self.flush_task = asyncio.ensure_future(
+                    self._flush_later(delay))
+                return
+        await self.flush()
+        if msg['ev'] != 'touchmove':
+            await self._handle(msg)
+
+    async def flush(self):
+        """Processes the held back move, if any."""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.pending_move is not None:
+            msg = self.pending_move
+            self.pending_move = None
+            self.last_move_time = time.monotonic()
+            await self._handle(msg)
+
+    def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        self.session.input_processor.on_client_disconnect(self.client_id)
+
+    async def send_replies(self, num_processed=None):
+        """Sends the queued replies. num_processed is the number of messages
+        to ack, for binary batches."""
+        async with self.send_lock:
+            replies = self.replies
+            self.replies = []
+            if self.ws.closed:
+                return
+            if self.binary:
+                if replies or num_processed is not None:
+                    await self.ws.send_bytes(
+                        lightoy.server.protocol.encode_replies(
+                            replies, num_processed))
+            else:
+                for reply in replies:
+                    await self.ws.send_json(reply)
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        # This task is done waiting, so flush() mustn't cancel it.
+        self.flush_task = None
+        await self.flush()
+        await self.send_replies()
+
+    async def _handle(self, msg):
+        response = await handle_websocket_message(msg, self.session,
+                                                  self.client_id)
+        if response is not None:
+            self.replies.append(response)
 
 
 async def handle_websocket_request(request):
     session = request.app['session']
-    ws = aiohttp.web.WebSocketResponse()
+    ws = aiohttp.web.WebSocketResponse(
+        protocols=[lightoy.server.protocol.BINARY_PROTOCOL])
     await ws.prepare(request)
-
-    async for msg in ws:
-        if msg.type == aiohttp.WSMsgType.TEXT:
-            if msg.data == 'close':
-                await ws.close()
-            else:
-                response = await handle_websocket_message(
-                    json.loads(msg.data), session)
-                if response is not None:
-                    ws.send_json(response)
-        elif msg.type == aiohttp.WSMsgType.ERROR:
-            print('ws connection closed with exception %s' %
-                  ws.exception())
+    connection = TouchConnection(ws, session)
+
+    try:
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                if msg.data == 'close':
+                    await ws.close()
+                else:
+                    await connection.handle_message(json.loads(msg.data))
+                    await connection.send_replies()
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                try:
+                    batch = lightoy.server.protocol.decode_batch(msg.data)
+                except Exception as e:
+                    # TODO: logging
+                    print("Invalid binary message:", e)
+                    continue
+                for message in batch:
+                    await connection.handle_message(message)
+                # The moves of the batch are coalesced, but all of them are
+                # processed (and echoed) before the batch is acked.
+                await connection.flush()
+                await connection.send_replies(len(batch))
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                print('ws connection closed with exception %s' %
+                      ws.exception())
+    finally:
+        connection.close()
+    return ws
@@ -0,0 +1,103 @@
+import aiohttp
+import asyncio
+import math
+
+import lightoy.preview
+
+"""
+Functions to handle websocket requests for live previews of the rendered
+frames (see lightoy.preview).
+"""
+
+
+# The defaults of the query parameters of /preview_ws: the rate at which
+# frames are sent, and the number of LEDs that frames are downsampled to.
+DEFAULT_FPS = 15.
+DEFAULT_MAX_LEDS = 500
+
+# Frames are dropped for subscribers with more than this many bytes that
+# haven't been sent yet, so slow subscribers get the latest frames rather
+# than falling behind.
+MAX_BUFFERED_BYTES = 64 << 10
+
+
+def get_query_value(request, name, default, value_type):
+    try:
+        return value_type(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+def get_layout(locations, groups):
+    """Returns the 'layout' message for the downsampled locations."""
+    return {
+        'ev': 'layout',
+        'locations': lightoy.preview.downsample(locations, groups).tolist(),
+    }
+
+
+async def send_frames(ws, request, preview, fps, max_leds):
+    """
+    Sends the preview's frames to the websocket at up to fps frames a second,
+    as binary messages (see lightoy.preview.encode_frame()), downsampled to
+    max_leds LEDs. A 'layout' message with the downsampled 3-by-n locations
+    is sent before the first frame, and whenever the locations change.
+    """
+    layout_version = None
+    sequence = None
+    num_leds = None
+    groups = None
+    while not ws.closed:
+        await asyncio.sleep(1. / fps)
+        frame_sequence, frame = preview.frame
+        if frame is None or frame_sequence == sequence:
+            continue
+        sequence = frame_sequence
+        transport = request.transport
+        if transport is None or \
+                transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+            continue
+        if frame.shape[1] != num_leds:
+            num_leds = frame.shape[1]
+            groups = lightoy.preview.get_groups(num_leds, max_leds)
+            layout_version = None
+        version, locations = preview.locations
+        if version != layout_version and locations is not None:
+            layout_version = version
+            await ws.send_json(get_layout(locations, groups))
+        await ws.send_bytes(lightoy.preview.encode_frame(
+            sequence, lightoy.preview.downsample(frame, groups)))
+
+
+async def handle_websocket_request(request):
+    """
+    Streams previews of the rendered frames. The query parameters 'fps' and
+    'max_leds' set the rate of the frames (up to the preview's max_fps) and
+    the number of LEDs they're downsampled to.
+    """
+    preview = request.app['session'].preview
+    if preview is None:
+        raise aiohttp.web.HTTPNotFound(text="Previews are disabled.")
+    fps = min(get_query_value(request, 'fps', DEFAULT_FPS, float),
+              preview.max_fps)
+    max_leds = get_query_value(request, 'max_leds', DEFAULT_MAX_LEDS, int)
+    # fps may also be NaN or infinite.
+    if not math.isfinite(fps) or fps <= 0 or max_leds <= 0:
+        raise aiohttp.web.HTTPBadRequest(
+            text="fps and max_leds must be positive.")
+    ws = aiohttp.web.WebSocketResponse()
+    await ws.prepare(request)
+    preview.subscribe()
+    send_task = asyncio.ensure_future(
+        send_frames(ws, request, preview, fps, max_leds))
+    try:
+        # Nothing is expected from subscribers; this just waits for the
+        # websocket to close.
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.ERROR:
+                print('ws connection closed with exception %s' %
+                      ws.exception())
+    finally:
+        send_task.cancel()
+        preview.unsubscribe()
+    return ws
@@ -4,53 +4,131 @@ import aiohttp
 import aiohttp.web
 import asyncio
 import click
+import math
 import numpy
 import os
 import threading
 import time
 
-import lightoy.color
 import lightoy.server.handlers.console
 import lightoy.server.handlers.input
+import lightoy.server.handlers.preview
+from lightoy.correction import GAMMA_MODES
+from lightoy.frame_bus import FrameBus, FrameBusOutput, RedisPublisher
+from lightoy.frame_cache import FrameCache
 from lightoy.location_model import Spiral
-from lightoy.output import DummyOutput, SerialOutput
+from lightoy.preview import FramePreview, PreviewOutput
+from lightoy.output import (ArtNetOutput, DitheredOutput, DummyOutput,
+                            OutputRouter, SerialOutput, ThreadedOutput)
+from lightoy.recording import (FrameRecorder, Recording, RecordingOutput,
+                               RecordingPlayer)
+from lightoy.render_farm import RenderFarm
+from lightoy.scheduler import FrameScheduler
 from lightoy.session import Session
 
-# The maximum rate (in Hz) at which the rendering is performed.
-MAX_REFRESH_RATE = 200
-# The total number of LEDs.
+# The default total number of LEDs.
 NUM_LEDS = 300
 
 
-def render(session, location_model):
+def render(session, location_model, out=None):
     """
     Returns a 3-by-n array representing the final color of each of the n LEDs.
+    If given, the 3-by-n array 'out' is filled in and returned.
     """
+    profiler = session.profiler
+    profiler.start_frame()
     t = session.get_time()
     t_diff = session.get_time_delta(t)
     inputs = session.input_processor.get_state(t)
+    profiler.mark('input')
     x = location_model.get_locations(session)
+    coords = location_model.get_coordinates(session)
+    profiler.mark('locations')
 
-    effect = session.get_current_effect()
-
-    output = effect.do_render(x, t, t_diff, inputs)
-    numpy.clip(output, 0., 1., out=output)
-    output = lightoy.color.gamma_correct(output,
-                                 session.global_params['gamma'].get_value())
-    output *= session.global_params['brightness'].get_value()
+    rendered = session.render_effects(x, t, t_diff, inputs, coords)
+    profiler.mark('effects')
+    # The effects' output can't be modified in place, since it may be part of
+    # their state.
+    output = numpy.clip(rendered, 0., 1., out=out)
+    global_params = session.global_params
+    session.color_correction.set_params(
+        global_params['gamma'].get_value(),
+        global_params['brightness'].get_value(),
+        (global_params['red_balance'].get_value(),
+         global_params['green_balance'].get_value(),
+         global_params['blue_balance'].get_value()))
+    session.color_correction.apply(output, out=output)
+    profiler.mark('correction')
     return output
 
 
-def render_loop(session, location_model, output):
-    while True:
-        rendered = render(session, location_model)
+def render_loop(session, location_model, output, scheduler,
+                stats_interval=0, stop_event=None):
+    """Renders and outputs frames, paced by the scheduler, until stop_event
+    (a threading.Event) is set. If stats_interval is positive, the scheduler's
+    and the output queues' statistics are printed every stats_interval
+    seconds."""
+    last_stats_time = time.monotonic()
+    rendered = numpy.zeros((3, session.num_leds))
+    while stop_event is None or not stop_event.is_set():
+        render(session, location_model, out=rendered)
         output.output(rendered)
-        # Sleep to the next 1/MAX_REFRESH_RATE interval.
-        refresh_interval = 1. / MAX_REFRESH_RATE
-        sleep_time = refresh_interval - (time.time() % refresh_interval)
-        if sleep_time == 0:
-            sleep_time = refresh_interval
-        time.sleep(sleep_time)
+        session.profiler.mark('output')
+        if stats_interval > 0 and \
+                time.monotonic() - last_stats_time >= stats_interval:
+            last_stats_time = time.monotonic()
+            print("frame stats:", scheduler.get_stats())
+            metrics = get_output_metrics(output)
+            if metrics is not None:
+                print("output stats:", metrics)
+        scheduler.wait_for_next_frame()
+
+
+def get_output_metrics(output):
+    """Returns the metrics of the output's queues (see
+    ThreadedOutput.get_metrics()), looking through the outputs that wrap them,
+    or None if there are none."""
+    while output is not None:
+        if hasattr(output, 'get_metrics'):
+            return output.get_metrics()
+        output = getattr(output, 'wrapped', None)
+    return None
+
+
+def parse_serial_segments(ctx, param, values):
+    """Click callback that parses DEVICE:START:STOP strings into a list of
+    (device name, (start, stop)) tuples."""
+    segments = []
+    for value in values:
+        try:
+            device, start, stop = value.rsplit(':', 2)
+            start, stop = int(start), int(stop)
+        except ValueError:
+            raise click.BadParameter(
+                "%r isn't of the form DEVICE:START:STOP." % value)
+        if not device or not 0 <= start < stop:
+            raise click.BadParameter(
+                "%r needs a device, and 0 <= START < STOP." % value)
+        segments.append((device, (start, stop)))
+    return segments
+
+
+def check_serial_segments(segments, num_leds):
+    """Checks that the (device name, (start, stop)) segments are within the
+    LEDs, and warns about overlapping segments."""
+    for device, (start, stop) in segments:
+        if stop > num_leds:
+            raise click.BadParameter(
+                "%s:%d:%d ends past --num_leds (%d)."
+                % (device, start, stop, num_leds),
+                param_hint="'--serial_segment'")
+    segments = sorted(segments, key=lambda segment: segment[1])
+    for (device, (_, stop)), (next_device, (next_start, _)) in zip(
+            segments, segments[1:]):
+        if next_start < stop:
+            # TODO: logging
+            print("Warning: the LEDs of --serial_segment %s and %s overlap."
+                  % (device, next_device))
 
 
 def get_template(template_name):
@@ -74,6 +152,8 @@ async def init_app(event_loop, session):
             lightoy.server.handlers.console.handle_websocket_request)
     app.router.add_get('/touch_ws',
             lightoy.server.handlers.input.handle_websocket_request)
+    app.router.add_get('/preview_ws',
+            lightoy.server.handlers.preview.handle_websocket_request)
     app.router.add_static('/static', 'lightoy/server/static', name='static')
     return app
 
@@ -82,22 +162,189 @@ async def init_app(event_loop, session):
 @click.option("--port", type=int, default=8080, help="Port for the web server")
 @click.option("--serial_device", default="/dev/ttyACM0")
 @click.option("--serial_baud", type=int, default=115200)
+@click.option("--serial_segment", multiple=True,
+              callback=parse_serial_segments,
+              help="DEVICE:START:STOP; outputs LEDs START to STOP (exclusive) "
+                   "to the serial device DEVICE. Can be given multiple times, "
+                   "in which case each device is written to in parallel. "
+                   "Overrides --serial_device.")
+@click.option("--serial_compression", type=bool, default=False,
+              help="If True, frames are sent as run-length encoded deltas "
+                   "when that's smaller. Requires the matching firmware.")
+@click.option("--num_leds", type=int, default=NUM_LEDS,
+              help="The total number of LEDs.")
 @click.option("--no_serial", type=bool, default=False,
               help="If True, no serial communication is performed.")
-def main(port, serial_device, serial_baud, no_serial):
-    if no_serial:
-        output = DummyOutput()
+@click.option("--artnet_host", default=None,
+              help="If given, the LEDs are output via Art-Net to this host "
+                   "(or broadcast address) instead of the serial device.")
+@click.option("--artnet_universe", type=int, default=0,
+              help="The first Art-Net universe used.")
+@click.option("--artnet_sync", type=bool, default=False,
+              help="If True, an ArtSync packet is sent after each frame.")
+@click.option("--gamma_mode", type=click.Choice(GAMMA_MODES),
+              default='value',
+              help="Whether gamma is applied to the value of each color "
+                   "(keeping its hue and saturation) or to each channel.")
+@click.option("--dither", type=bool, default=False,
+              help="If True, frames are temporally dithered before being "
+                   "quantized to 8 bits, for smoother dim colors.")
+@click.option("--output_queue_size", type=click.IntRange(min=1), default=1,
+              help="Max number of rendered frames waiting to be output.")
+@click.option("--fps", type=click.FloatRange(min=0., min_open=True),
+              default=200.,
+              help="The rate (in Hz) at which the rendering is performed.")
+@click.option("--adaptive_fps", type=bool, default=False,
+              help="If True, the frame rate is lowered when rendering can't "
+                   "keep up.")
+@click.option("--min_fps", type=click.FloatRange(min=0., min_open=True),
+              default=None,
+              help="The lowest frame rate used with --adaptive_fps.")
+@click.option("--stats_interval", type=float, default=0.,
+              help="If positive, how often (in seconds) to print frame "
+                   "timing and output queue statistics.")
+@click.option("--render_processes", type=int, default=0,
+              help="If positive, the number of processes that the current "
+                   "effect is rendered in.")
+@click.option("--record_file", default=None,
+              help="If given, the output frames are recorded to this file.")
+@click.option("--record_frames", type=int, default=10000,
+              help="The number of most recent frames kept in --record_file.")
+@click.option("--replay_file", default=None,
+              help="If given, this recording is played back instead of "
+                   "rendering effects.")
+@click.option("--replay_loop", type=bool, default=False,
+              help="If True, --replay_file is played back repeatedly.")
+@click.option("--bake_cache_mb", type=float, default=0.,
+              help="If positive, periodic effects are rendered from caches "
+                   "of baked frames taking up to this many megabytes.")
+@click.option("--bake_spill_dir", default=None,
+              help="If given, evicted caches of baked frames are saved to "
+                   "this directory, and reused when needed again.")
+@click.option("--preview_fps", type=float, default=30.,
+              help="The highest rate at which frames are streamed to live "
+                   "previews. If 0, previews are disabled.")
+@click.option("--frame_bus_file", default=None,
+              help="If given, rendered frames are published to a ring of "
+                   "frames in this shared-memory file (e.g. "
+                   "/dev/shm/lightoy_frames) for other processes to read.")
+@click.option("--frame_bus_every", type=click.IntRange(min=1), default=1,
+              help="Only every Nth frame is published to the frame bus.")
+@click.option("--frame_bus_capacity", type=click.IntRange(min=1), default=4,
+              help="The number of frames kept in --frame_bus_file.")
+@click.option("--frame_bus_redis_channel", default=None,
+              help="If given, the frames of the frame bus are also published "
+                   "to this channel of the local Redis server. Requires "
+                   "--frame_bus_file.")
+def main(port, serial_device, serial_baud, serial_segment, serial_compression,
+         num_leds, no_serial, artnet_host, artnet_universe, artnet_sync,
+         gamma_mode, dither, output_queue_size, fps, adaptive_fps, min_fps,
+         stats_interval, render_processes, record_file, record_frames,
+         replay_file, replay_loop, bake_cache_mb, bake_spill_dir,
+         preview_fps, frame_bus_file, frame_bus_every, frame_bus_capacity,
+         frame_bus_redis_channel):
+    check_serial_segments(serial_segment, num_leds)
+    if not math.isfinite(fps) or \
+            (min_fps is not None and not math.isfinite(min_fps)):
+        raise click.UsageError("--fps and --min_fps must be finite.")
+    if min_fps is not None and min_fps > fps:
+        raise click.UsageError("--min_fps can't be higher than --fps.")
+    if frame_bus_redis_channel is not None and frame_bus_file is None:
+        raise click.UsageError(
+            "--frame_bus_redis_channel requires --frame_bus_file.")
+    if frame_bus_file is not None and replay_file is not None:
+        raise click.UsageError(
+            "Recordings played back with --replay_file aren't published to "
+            "the frame bus.")
+
+    def device_output(output):
+        if dither:
+            return DitheredOutput(output)
+        return output
+
+    # Outputs are written from separate threads so that rendering isn't
+    # blocked on I/O.
+    if artnet_host is not None:
+        output = ThreadedOutput(
+            device_output(ArtNetOutput(artnet_host, num_leds,
+                                       start_universe=artnet_universe,
+                                       sync=artnet_sync)),
+            output_queue_size)
+    elif no_serial:
+        output = ThreadedOutput(DummyOutput(), output_queue_size)
+    elif serial_segment:
+        output = OutputRouter([
+            (device_output(
+                SerialOutput(device, serial_baud, serial_compression)), leds)
+            for device, leds in serial_segment],
+            queue_size=output_queue_size)
+    else:
+        output = ThreadedOutput(
+            device_output(
+                SerialOutput(serial_device, serial_baud, serial_compression)),
+            output_queue_size)
+    # The ThreadedOutput or OutputRouter, closed on shutdown.
+    device_outputs = output
+    session = Session(num_leds)
+    session.color_correction.mode = gamma_mode
+    recorder = None
+    frame_bus = None
+    redis_publisher = None
+    if replay_file is not None:
+        # Recordings are already color corrected and quantized, so they go
+        # straight to the output.
+        player = RecordingPlayer(Recording(replay_file), output,
+                                 loop=replay_loop)
+        render_thread = threading.Thread(target=player.play)
+        stop = player.stop
     else:
-        output = SerialOutput(serial_device, serial_baud)
-    session = Session(NUM_LEDS)
-    # TODO: the choice of location model should be configurable.
-    location_model = Spiral(NUM_LEDS)
-    render_thread = threading.Thread(target=render_loop,
-                                     args=(session, location_model, output))
+        if record_file is not None:
+            recorder = FrameRecorder(record_file, num_leds, record_frames)
+            output = RecordingOutput(output, recorder, session)
+        if frame_bus_file is not None:
+            frame_bus = FrameBus(frame_bus_file, num_leds,
+                                 frame_bus_capacity, frame_bus_every)
+            output = FrameBusOutput(output, frame_bus, session)
+            if frame_bus_redis_channel is not None:
+                redis_publisher = RedisPublisher(frame_bus,
+                                                 frame_bus_redis_channel)
+        if bake_cache_mb > 0:
+            session.frame_cache = FrameCache(
+                num_leds, int(bake_cache_mb * (1 << 20)), bake_spill_dir)
+        if render_processes > 0:
+            session.render_farm = RenderFarm(num_leds, render_processes,
+                                             session.effects)
+        # TODO: the choice of location model should be configurable.
+        location_model = Spiral(num_leds)
+        if preview_fps > 0:
+            session.preview = FramePreview(preview_fps)
+            output = PreviewOutput(output, session.preview, session,
+                                   location_model)
+        scheduler = FrameScheduler(fps, adaptive_fps, min_fps)
+        stop_event = threading.Event()
+        stop = stop_event.set
+        render_thread = threading.Thread(target=render_loop,
+                                         args=(session, location_model,
+                                               output, scheduler,
+                                               stats_interval, stop_event))
     render_thread.start()
     event_loop = asyncio.get_event_loop()
     web_app = event_loop.run_until_complete(init_app(event_loop, session))
-    aiohttp.web.run_app(web_app, port=port)
+    try:
+        aiohttp.web.run_app(web_app, port=port)
+    finally:
+        stop()
+        render_thread.join()
+        # Writes the queued frames.
+        device_outputs.close()
+        if session.render_farm is not None:
+            session.render_farm.close()
+        if recorder is not None:
+            recorder.close()
+        if redis_publisher is not None:
+            redis_publisher.close()
+        if frame_bus is not None:
+            frame_bus.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import struct
+
+
+"""
+The binary websocket protocol, an optional alternative to JSON messages for
+/touch_ws and /console_ws.
+
+Clients ask for it by offering the BINARY_PROTOCOL websocket subprotocol when
+connecting; if the server accepts it, both sides can send binary frames, each
+holding a batch of messages. (Text frames with JSON messages are still
+accepted either way.) Every message starts with a byte for its type, followed
+by:
+    MSG_TOUCH_START, MSG_TOUCH_MOVE, MSG_TOUCH_END, MSG_TOUCH_CANCEL: A byte
+        for the number of touches, and the x, y and ID of each touch as
+        little-endian uint16s, with x and y scaled from [0, 1] to
+        [0, COORD_SCALE].
+    MSG_SLIDER_UPDATE: A byte of flags (FLAG_GLOBAL), a byte for the length of
+        the parameter's name, the UTF-8 encoded name, and the value as a
+        little-endian float32.
+    MSG_POS (from the server): The current touches, as for MSG_TOUCH_*.
+    MSG_ACK (from the server): The number of messages of the client's batch
+        that were processed, as a little-endian uint16.
+
+The server replies to a batch with one frame, holding the replies to the
+messages followed by an ack. Replies to messages whose processing is delayed
+(see lightoy.server.handlers.input) come in a frame of their own.
+"""
+
+
+BINARY_PROTOCOL = 'lightoy-binary-2'
+
+MSG_TOUCH_START = 1
+MSG_TOUCH_MOVE = 2
+MSG_TOUCH_END = 3
+MSG_TOUCH_CANCEL = 4
+MSG_SLIDER_UPDATE = 5
+MSG_POS = 6
+MSG_ACK = 7
+
+FLAG_GLOBAL = 1
+
+COORD_SCALE = 65535
+
+# Message type => the 'ev' of the equivalent JSON message.
+TOUCH_EVENTS = {
+    MSG_TOUCH_START: 'touchstart',
+    MSG_TOUCH_MOVE: 'touchmove',
+    MSG_TOUCH_END: 'touchend',
+    MSG_TOUCH_CANCEL: 'touchcancel',
+}
+
+_TOUCH = struct.Struct('<HHH')
+_FLOAT = struct.Struct('<f')
+_ACK = struct.Struct('<BH')
+
+
+def decode_batch(data):
+    """
+    Decodes a binary frame from a client.
+
+    Returns:
+        A list of the messages, as the equivalent JSON message dicts.
+    """
+    messages = []
+    i = 0
+    try:
+        while i < len(data):
+            msg_type = data[i]
+            i += 1
+            if msg_type in TOUCH_EVENTS:
+                count = data[i]
+                i += 1
+                touches = []
+                for _ in range(count):
+                    x, y, touch_id = _TOUCH.unpack_from(data, i)
+                    i += _TOUCH.size
+                    touches.append({'x': x / COORD_SCALE,
+                                    'y': y / COORD_SCALE, 'id': touch_id})
+                messages.append({'ev': TOUCH_EVENTS[msg_type],
+                                 'touches': touches})
+            elif msg_type == MSG_SLIDER_UPDATE:
+                flags, name_length = data[i], data[i + 1]
+                i += 2
+                name = bytes(data[i:i + name_length]).decode('utf-8')
+                i += name_length
+                value, = _FLOAT.unpack_from(data, i)
+                i += _FLOAT.size
+                messages.append({'ev': 'sliderUpdate', 'name': name,
+                                 'value': value,
+                                 'global': bool(flags & FLAG_GLOBAL)})
+            else:
+                raise Exception("unknown message type: %d" % msg_type)
+    except (IndexError, struct.error):
+        raise Exception("truncated binary message")
+    return messages
+
+
+def encode_touches(out, msg_type, touches):
+    """Appends a touch message (e.g. MSG_POS) to the bytearray 'out'.
+    touches is a list of dicts with 'x', 'y' and optionally 'id' fields, of
+    which the first 255 are sent."""
+    touches = touches[:255]
+    out.append(msg_type)
+    out.append(len(touches))
+    for touch in touches:
+        out += _TOUCH.pack(_to_coord(touch['x']), _to_coord(touch['y']),
+                           touch.get('id', 0) & 0xffff)
+
+
+def encode_slider_update(out, name, value, is_global):
+    """Appends a MSG_SLIDER_UPDATE message to the bytearray 'out'."""
+    name = name.encode('utf-8')
+    out.append(MSG_SLIDER_UPDATE)
+    out.append(FLAG_GLOBAL if is_global else 0)
+    out.append(len(name))
+    out += name
+    out += _FLOAT.pack(value)
+
+
+def encode_replies(replies, num_processed=None):
+    """
+    Encodes the server's replies to a batch into one binary frame.
+
+    Args:
+        replies: The replies, as the equivalent JSON message dicts. Only
+            touch positions ({'pos': touches}) have a binary form.
+        num_processed: If given, the number of messages of the batch that
+            were processed, which is acked.
+    """
+    out = bytearray()
+    for reply in replies:
+        if 'pos' in reply:
+            encode_touches(out, MSG_POS, reply['pos'])
+    if num_processed is not None:
+        out += _ACK.pack(MSG_ACK, min(num_processed, 0xffff))
+    return bytes(out)
+
+
+def _to_coord(value):
+    return int(round(min(1., max(0., value)) * COORD_SCALE))
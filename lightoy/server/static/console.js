@@ -1,7 +1,14 @@
+// The binary protocol (see lightoy/server/protocol.py), which is used for
+// slider updates if the server accepts it.
+var BINARY_PROTOCOL = "lightoy-binary-2";
+var MSG_SLIDER_UPDATE = 5;
+var FLAG_GLOBAL = 1;
+
 function createWebSocket() {
   // TODO: code duplication with touch ws thing
   var loc = window.location;
-  var ws = new WebSocket('ws://' + loc.host + '/console_ws');
+  var ws = new WebSocket('ws://' + loc.host + '/console_ws', [BINARY_PROTOCOL]);
+  ws.binaryType = "arraybuffer";
   ws.onopen = function() {
     console.log("connection started");
     document.body.style.backgroundColor = "#ddf";
@@ -15,8 +22,11 @@ function createWebSocket() {
     }
   }
   ws.onmessage = function(event) {
-    var msg = JSON.parse(event.data);
-    updateConsole(msg);
+    // Binary messages are just acks.
+    if (typeof event.data === "string") {
+      var msg = JSON.parse(event.data);
+      updateConsole(msg);
+    }
   }
   return ws;
 }
@@ -24,7 +34,39 @@ function createWebSocket() {
 var ws = createWebSocket();
 
 function updateConsole(msg) {
-  console.log("updating console but not really", msg);
+  if (msg.ev == "profile") {
+    updateProfile(msg);
+  } else {
+    console.log("updating console but not really", msg);
+  }
+}
+
+// Shows the render profile sent by the server (see lightoy/profiler.py).
+function updateProfile(profile) {
+  document.getElementById("profile-fps").textContent =
+      profile.fps.toFixed(1) + " fps, " + profile.frames + " frames";
+  var tbody = document.getElementById("profile").tBodies[0];
+  tbody.innerHTML = "";
+  var keys = ["mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"];
+  profile.stages.forEach(function(stage) {
+    var row = tbody.insertRow();
+    row.insertCell().textContent = stage.name;
+    keys.forEach(function(key) {
+      row.insertCell().textContent = stage[key].toFixed(3);
+    });
+    var histogramCell = row.insertCell();
+    var maxCount = Math.max.apply(null, stage.histogram) || 1;
+    stage.histogram.forEach(function(count, i) {
+      var bar = document.createElement("span");
+      bar.className = "histogram-bar";
+      bar.style.height = Math.round(20 * count / maxCount) + "px";
+      var upper = profile.histogram_edges_ms[i];
+      bar.title = count + " frames " +
+          (upper === undefined ? "over " + profile.histogram_edges_ms[i - 1]
+                               : "up to " + upper) + " ms";
+      histogramCell.appendChild(bar);
+    });
+  });
 }
 
 function activateSlider(el) {
@@ -71,6 +113,17 @@ function activateSlider(el) {
 
   function onUpdate(name, value) {
     console.log(name, value);
+    if (ws.protocol == BINARY_PROTOCOL) {
+      var nameBytes = new TextEncoder().encode(name);
+      var view = new DataView(new ArrayBuffer(7 + nameBytes.length));
+      view.setUint8(0, MSG_SLIDER_UPDATE);
+      view.setUint8(1, isGlobal ? FLAG_GLOBAL : 0);
+      view.setUint8(2, nameBytes.length);
+      new Uint8Array(view.buffer).set(nameBytes, 3);
+      view.setFloat32(3 + nameBytes.length, value, true);
+      ws.send(view.buffer);
+      return;
+    }
     ws.send(JSON.stringify({
       ev: "sliderUpdate",
       name: name,
@@ -91,3 +144,66 @@ function activateAllSliders() {
 }
 
 activateAllSliders();
+
+// Live preview of the rendered frames (see lightoy/preview.py), drawn at the
+// LED locations, looking at the side of the spiral from slightly above.
+var PREVIEW_FPS = 15;
+var PREVIEW_MAX_LEDS = 500;
+var PREVIEW_LED_SIZE = 4;
+
+function createPreview() {
+  var canvas = document.getElementById("preview");
+  var context = canvas.getContext("2d");
+  // The canvas x,y of each LED, back to front.
+  var points = [];
+  var loc = window.location;
+  var previewWs = new WebSocket('ws://' + loc.host + '/preview_ws?fps=' +
+                                PREVIEW_FPS + '&max_leds=' + PREVIEW_MAX_LEDS);
+  previewWs.binaryType = "arraybuffer";
+  previewWs.onmessage = function(event) {
+    if (typeof event.data === "string") {
+      var msg = JSON.parse(event.data);
+      if (msg.ev == "layout") {
+        points = getPreviewPoints(msg.locations, canvas);
+      }
+    } else {
+      drawPreview(context, canvas, points, new Uint8Array(event.data, 4));
+    }
+  }
+}
+
+function getPreviewPoints(locations, canvas) {
+  var margin = PREVIEW_LED_SIZE;
+  var scale = (Math.min(canvas.width, canvas.height) - 2 * margin) / 2.6;
+  var points = locations[0].map(function(x, i) {
+    var y = locations[1][i];
+    var z = locations[2][i];
+    return {
+      index: i,
+      depth: y,
+      x: canvas.width / 2 + x * scale,
+      y: canvas.height / 2 - (z - 0.3 * y) * scale
+    };
+  });
+  // Points further back are drawn first.
+  points.sort(function(a, b) { return a.depth - b.depth; });
+  return points;
+}
+
+function drawPreview(context, canvas, points, pixels) {
+  context.fillStyle = "#000";
+  context.fillRect(0, 0, canvas.width, canvas.height);
+  var half = PREVIEW_LED_SIZE / 2;
+  points.forEach(function(point) {
+    var i = point.index * 3;
+    if (i + 2 >= pixels.length) {
+      return;
+    }
+    context.fillStyle = "rgb(" + pixels[i] + "," + pixels[i + 1] + "," +
+        pixels[i + 2] + ")";
+    context.fillRect(point.x - half, point.y - half, PREVIEW_LED_SIZE,
+                     PREVIEW_LED_SIZE);
+  });
+}
+
+createPreview();
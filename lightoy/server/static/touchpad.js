@@ -1,7 +1,21 @@
+// The binary protocol (see lightoy/server/protocol.py), which is used if the
+// server accepts it.
+var BINARY_PROTOCOL = "lightoy-binary-2";
+var MSG_TYPES = {
+  touchstart: 1,
+  touchmove: 2,
+  touchend: 3,
+  touchcancel: 4
+};
+var MSG_POS = 6;
+var MSG_ACK = 7;
+var COORD_SCALE = 65535;
+
 function createWebSocket() {
   var loc = window.location;
   document.body.style.backgroundColor = "#e66";
-  var ws = new WebSocket('ws://' + loc.host + '/touch_ws');
+  var ws = new WebSocket('ws://' + loc.host + '/touch_ws', [BINARY_PROTOCOL]);
+  ws.binaryType = "arraybuffer";
   ws.onopen = function() {
     console.log("connection started");
     document.body.style.backgroundColor = "#aaa";
@@ -14,14 +28,97 @@ function createWebSocket() {
     }
   }
   ws.onmessage = function(event) {
-    var msg = JSON.parse(event.data);
-    refresh(msg.pos);
+    if (typeof event.data === "string") {
+      var msg = JSON.parse(event.data);
+      refresh(msg.pos);
+    } else {
+      handleBinaryMessages(new DataView(event.data));
+    }
   }
   return ws;
 }
 
 var ws = createWebSocket();
 
+function handleBinaryMessages(view) {
+  var i = 0;
+  while (i < view.byteLength) {
+    var type = view.getUint8(i++);
+    if (type == MSG_POS) {
+      var count = view.getUint8(i++);
+      var pos = [];
+      for (var j = 0; j < count; j++, i += 6) {
+        pos.push({
+          x: view.getUint16(i, true) / COORD_SCALE,
+          y: view.getUint16(i + 2, true) / COORD_SCALE
+        });
+      }
+      refresh(pos);
+    } else if (type == MSG_ACK) {
+      i += 2;
+    } else {
+      console.warn("unknown message type:", type);
+      return;
+    }
+  }
+}
+
+// Messages waiting to be sent with the next animation frame. Only the latest
+// touchmove is kept.
+var pendingMessages = [];
+var sendScheduled = false;
+
+function send(out) {
+  var last = pendingMessages[pendingMessages.length - 1];
+  if (out.ev == "touchmove" && last && last.ev == "touchmove") {
+    pendingMessages[pendingMessages.length - 1] = out;
+  } else {
+    pendingMessages.push(out);
+  }
+  if (!sendScheduled) {
+    sendScheduled = true;
+    window.requestAnimationFrame(sendPendingMessages);
+  }
+}
+
+function sendPendingMessages() {
+  sendScheduled = false;
+  var messages = pendingMessages;
+  pendingMessages = [];
+  if (ws.readyState != WebSocket.OPEN) {
+    return;
+  }
+  if (ws.protocol != BINARY_PROTOCOL) {
+    messages.forEach(function(out) {
+      ws.send(JSON.stringify(out));
+    });
+    return;
+  }
+  // All the messages go in one binary frame.
+  var size = 0;
+  messages.forEach(function(out) {
+    size += 2 + 6 * Math.min(out.touches.length, 255);
+  });
+  var view = new DataView(new ArrayBuffer(size));
+  var i = 0;
+  messages.forEach(function(out) {
+    var touches = out.touches.slice(0, 255);
+    view.setUint8(i++, MSG_TYPES[out.ev]);
+    view.setUint8(i++, touches.length);
+    touches.forEach(function(touch) {
+      view.setUint16(i, toCoord(touch.x), true);
+      view.setUint16(i + 2, toCoord(touch.y), true);
+      view.setUint16(i + 4, touch.id & 0xffff, true);
+      i += 6;
+    });
+  });
+  ws.send(view.buffer);
+}
+
+function toCoord(value) {
+  return Math.round(Math.min(1, Math.max(0, value)) * COORD_SCALE);
+}
+
 function refresh(pos) {
     var crossClassName = "cross";
     var crosses = document.getElementsByClassName(crossClassName);
@@ -44,7 +141,9 @@ function refresh(pos) {
 function getRelativeTouchCoordinates(touch) {
     return {
 	    'x': touch.pageX / document.body.clientWidth,
-	    'y': touch.pageY / document.body.clientHeight
+	    'y': touch.pageY / document.body.clientHeight,
+	    // Identifies the touch for as long as it lasts.
+	    'id': touch.identifier
     }
 }
 
@@ -55,8 +154,7 @@ document.body.addEventListener('touchstart', function(ev) {
 	'touches': Array.prototype.map.call(ev.touches,
 	    getRelativeTouchCoordinates)
     };
-    ws.send(JSON.stringify(out));
-    ws.send(JSON.stringify(out));
+    send(out);
 });
 
 document.body.addEventListener('touchmove', function(ev) {
@@ -66,7 +164,7 @@ document.body.addEventListener('touchmove', function(ev) {
 	'touches': Array.prototype.map.call(ev.touches,
 	    getRelativeTouchCoordinates)
     };
-    ws.send(JSON.stringify(out));
+    send(out);
 });
 
 document.body.addEventListener('touchend', function(ev) {
@@ -76,7 +174,7 @@ document.body.addEventListener('touchend', function(ev) {
 	'touches': Array.prototype.map.call(ev.touches,
 	    getRelativeTouchCoordinates)
     };
-    ws.send(JSON.stringify(out));
+    send(out);
 });
 
 document.body.addEventListener('touchcancel', function(ev) {
@@ -87,7 +185,7 @@ document.body.addEventListener('touchcancel', function(ev) {
 	    getRelativeTouchCoordinates)
     };
     console.log(out);
-    ws.send(JSON.stringify(out));
+    send(out);
 });
 
 
@@ -1,8 +1,13 @@
+import threading
 import time
 
+import lightoy.compositor
+import lightoy.correction
 import lightoy.effects
 import lightoy.input
 import lightoy.params
+import lightoy.profiler
+import lightoy.transition
 
 
 class Session(object):
@@ -13,7 +18,7 @@ class Session(object):
     This includes:
         * The current parameters.
         * Effect instances, which may have per-effect state.
-        * Which effect is current.
+        * Which effect is current, or the stack of effect layers to render.
         * The current input state.
         * Timing-related information.
     """
@@ -21,8 +26,30 @@ class Session(object):
         self.num_leds = num_leds
         self.effects = lightoy.effects.create_effects(num_leds)
         self.cur_effect_name = sorted(self.effects.keys())[0]
+        # If the compositor has any layers, they're rendered instead of the
+        # current effect.
+        self.compositor = lightoy.compositor.Compositor(num_leds)
+        # The Transition from the previous effect, while it's in progress.
+        # It's replaced from the web server's thread, and cleared from the
+        # render thread once it's done, both while holding transition_lock.
+        self.transition = None
+        self.transition_lock = threading.Lock()
+        # If set, a RenderFarm that renders the current effect in multiple
+        # processes.
+        self.render_farm = None
+        # If set, a FrameCache that the current effect is rendered from, if
+        # it's periodic.
+        self.frame_cache = None
         self.global_params = self._create_global_params()
+        # Applies the gamma, brightness and white balance parameters to
+        # rendered frames.
+        self.color_correction = lightoy.correction.ColorCorrection()
         self.input_processor = lightoy.input.InputProcessor()
+        # Timings of the stages of recent frames.
+        self.profiler = lightoy.profiler.RenderProfiler()
+        # If set, a FramePreview that rendered frames are published to, for
+        # live previews.
+        self.preview = None
         self.start_time = time.time()
         self.last_t = None
 
@@ -43,11 +70,32 @@ class Session(object):
         self.last_t = t
         return t_diff
 
-    def set_current_effect_name(self, effect_name):
+    def set_current_effect_name(self, effect_name,
+                                transition_kind='crossfade'):
+        """Changes the current effect. The change is animated with the given
+        kind of transition (see lightoy.transition), over the time set by the
+        'transition_time' global parameter. If transition_kind is None, the
+        change is immediate."""
         assert effect_name in self.effects.keys(), \
             "unknown effect: %s" % effect_name
         print("setting effect to: %s" % effect_name)
-        self.cur_effect_name = effect_name
+        duration = self.global_params['transition_time'].get_value()
+        t = self.get_time()
+        with self.transition_lock:
+            if transition_kind is not None and duration > 0 and \
+                    effect_name != self.cur_effect_name:
+                # A transition in progress that has rendered a frame is
+                # faded out from that frame.
+                previous = self.transition
+                if previous is not None and (previous.is_done(t) or
+                                             previous.last_outgoing_t is None):
+                    previous = None
+                self.transition = lightoy.transition.Transition(
+                    transition_kind, self.cur_effect_name, effect_name, t,
+                    duration, self.num_leds, previous=previous)
+            else:
+                self.transition = None
+            self.cur_effect_name = effect_name
 
     def get_current_effect(self):
         return self.effects[self.cur_effect_name]
@@ -55,6 +103,60 @@ class Session(object):
     def get_current_effect_name(self):
         return self.cur_effect_name
 
+    def render_effects(self, x, t, t_diff, inputs, coords):
+        """Renders either the layers of the compositor, or the current effect
+        (possibly transitioning from the previous one) if there are none. The
+        arguments are those of Effect.do_render()."""
+        if self.compositor.layers:
+            self._fetch_farm_states()
+            return self.compositor.render(self.effects, x, t, t_diff, inputs,
+                                          coords)
+        transition = self.transition
+        if transition is not None:
+            if not transition.is_done(t):
+                self._fetch_farm_states()
+                return transition.render(self.effects, x, t, t_diff, inputs,
+                                         coords)
+            with self.transition_lock:
+                # A new transition may have been started meanwhile.
+                if self.transition is transition:
+                    self.transition = None
+        # Periodic effects don't depend on their state, so it needn't be
+        # fetched from the render farm for the frame cache.
+        if self.frame_cache is not None:
+            rendered = self.frame_cache.render(
+                self.cur_effect_name, self.get_current_effect(), x, t, t_diff,
+                inputs, coords)
+            if rendered is not None:
+                return rendered
+        if self.render_farm is not None:
+            try:
+                return self.render_farm.render(self.cur_effect_name,
+                                               self.get_current_effect(),
+                                               t, t_diff, inputs, coords)
+            except Exception as e:
+                self._stop_render_farm(e)
+        return self.get_current_effect().do_render(x, t, t_diff, inputs,
+                                                   coords)
+
+    def _fetch_farm_states(self):
+        """Copies the state of the effects from the render farm, if any, so
+        that they can be rendered in this process."""
+        if self.render_farm is None:
+            return
+        try:
+            self.render_farm.fetch_states(self.effects)
+        except Exception as e:
+            self._stop_render_farm(e)
+
+    def _stop_render_farm(self, error):
+        """Falls back to rendering in this process after the render farm
+        failed. The effects continue from the last state fetched from it."""
+        # TODO: logging
+        print("Render farm failed, rendering locally from now on:", error)
+        self.render_farm.terminate()
+        self.render_farm = None
+
     @classmethod
     def _create_global_params(cls):
         # TODO: have consistent story of what global parameters are for.
@@ -67,5 +169,11 @@ class Session(object):
             'gamma': lightoy.params.Scalar(0., 100., 3.),
             # scales the brightness of the LEDs
             'brightness': lightoy.params.Scalar(0., 1., 0.3),
+            # white balance: scales each of the color channels
+            'red_balance': lightoy.params.Scalar(0., 1., 1.),
+            'green_balance': lightoy.params.Scalar(0., 1., 1.),
+            'blue_balance': lightoy.params.Scalar(0., 1., 1.),
+            # how long (in seconds) transitions between effects take
+            'transition_time': lightoy.params.Scalar(0., 10., 1.),
         }
 
@@ -0,0 +1,109 @@
+import numpy
+
+
+"""Transitions between two effects."""
+
+
+# The kinds of transitions:
+#   'crossfade': fades all the LEDs from one effect to the other.
+#   'wipe': moves a soft edge along one of the x,y,z axes, with the new effect
+#       on one side of the edge and the old effect on the other.
+TRANSITION_KINDS = ['crossfade', 'wipe']
+
+
+class Transition(object):
+    """
+    Renders the transition from an outgoing effect to an incoming one.
+
+    To bound the cost of rendering two effects at once, the outgoing effect is
+    only rendered outgoing_fps times per second (the last frame is reused in
+    between), or just once if outgoing_fps is 0, freezing it.
+
+    A transition that interrupts another one (given as 'previous') starts from
+    the last frame of the interrupted transition, which is frozen, so that
+    the LEDs don't jump.
+    """
+    # Default rate (in Hz) at which the outgoing effect is rendered.
+    OUTGOING_FPS = 20.
+    # Width of the soft edge of a wipe, in location units.
+    WIPE_EDGE_WIDTH = 0.3
+
+    def __init__(self, kind, from_effect_name, to_effect_name, start_t,
+                 duration, num_leds, outgoing_fps=OUTGOING_FPS, axis=2,
+                 previous=None):
+        assert kind in TRANSITION_KINDS, "unknown transition: %s" % kind
+        self.kind = kind
+        self.from_effect_name = from_effect_name
+        self.to_effect_name = to_effect_name
+        self.start_t = start_t
+        self.duration = duration
+        self.outgoing_fps = outgoing_fps
+        # The axis (0, 1 or 2 for x, y or z) that wipes move along.
+        self.axis = axis
+        self.last_outgoing_t = None
+        # The interrupted transition, until its last frame is copied.
+        self.previous = previous
+        self.outgoing = numpy.zeros((3, num_leds))
+        self.blended = numpy.zeros((3, num_leds))
+        # How much of the incoming effect is shown, for each LED.
+        self.weight = numpy.zeros(num_leds)
+
+    def get_progress(self, t):
+        """Returns how far along the transition is, from 0 to 1."""
+        if self.duration <= 0:
+            return 1.
+        return min(1., max(0., (t - self.start_t) / self.duration))
+
+    def is_done(self, t):
+        return self.get_progress(t) >= 1.
+
+    def render(self, effects, x, t, t_diff, inputs, coords):
+        """Renders a frame of the transition.
+
+        Args:
+            effects: An (effect name => Effect) dict.
+            The rest of the arguments are passed on to Effect.do_render().
+
+        Returns:
+            A 3-by-n array of the blended colors. The array is reused by the
+            next call.
+        """
+        if self.previous is not None:
+            numpy.copyto(self.outgoing, self.previous.blended)
+            self.previous = None
+            self.last_outgoing_t = t
+            self.outgoing_fps = 0
+        elif self.last_outgoing_t is None:
+            self._render_outgoing(effects, x, t, t_diff, inputs, coords)
+        elif self.outgoing_fps > 0 and \
+                t - self.last_outgoing_t >= 1. / self.outgoing_fps:
+            self._render_outgoing(effects, x, t, t - self.last_outgoing_t,
+                                  inputs, coords)
+        incoming = effects[self.to_effect_name].do_render(
+            x, t, t_diff, inputs, coords)
+
+        progress = self.get_progress(t)
+        if self.kind == 'wipe':
+            # The edge moves from just below the lowest location (-1) to just
+            # above the highest (1).
+            edge_width = self.WIPE_EDGE_WIDTH
+            edge = -1. - edge_width / 2. + progress * (2. + edge_width)
+            numpy.subtract(edge, x[self.axis], out=self.weight)
+            self.weight /= edge_width
+            self.weight += 0.5
+            numpy.clip(self.weight, 0., 1., out=self.weight)
+            weight = self.weight
+        else:
+            weight = progress
+
+        # outgoing + weight * (incoming - outgoing)
+        numpy.subtract(incoming, self.outgoing, out=self.blended)
+        self.blended *= weight
+        self.blended += self.outgoing
+        return self.blended
+
+    def _render_outgoing(self, effects, x, t, t_diff, inputs, coords):
+        numpy.copyto(self.outgoing,
+                     effects[self.from_effect_name].do_render(
+                         x, t, t_diff, inputs, coords))
+        self.last_outgoing_t = t
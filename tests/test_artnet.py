@@ -0,0 +1,73 @@
+import socket
+import struct
+
+import numpy
+
+from lightoy.output import ArtNetOutput
+
+
+def unpack_dmx_header(packet):
+    """Returns the (opcode, protocol version, sequence, physical port,
+    universe, data length) of an ArtDmx packet."""
+    opcode, = struct.unpack_from('<H', packet, 8)
+    version, = struct.unpack_from('>H', packet, 10)
+    universe, = struct.unpack_from('<H', packet, 14)
+    length, = struct.unpack_from('>H', packet, 16)
+    return opcode, version, packet[12], packet[13], universe, length
+
+
+def test_loopback():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5.)
+    # 401 LEDs: two full universes, and one of 61 LEDs whose 183 channels
+    # are padded to an even length.
+    num_leds = 401
+    output = ArtNetOutput('127.0.0.1', num_leds, port=sock.getsockname()[1],
+                          start_universe=3, channel_order='GRB', sync=True)
+    levels = numpy.arange(3 * num_leds).reshape((3, -1)) % 256
+    try:
+        for frame in (1, 2):
+            output.output(levels / 255.)
+            packets = [sock.recv(1 << 16) for _ in range(4)]
+            pixels = bytearray()
+            for i, packet in enumerate(packets[:3]):
+                assert packet[:8] == b'Art-Net\x00'
+                assert unpack_dmx_header(packet) == (
+                    0x5000, 14, frame, 0, 3 + i, [510, 510, 184][i])
+                assert len(packet) == 18 + [510, 510, 184][i]
+                pixels += packet[18:18 + 3 * min(170, num_leds - 170 * i)]
+            # The padding channel is 0.
+            assert packets[2][-1] == 0
+            # The channels are in GRB order.
+            numpy.testing.assert_array_equal(
+                numpy.frombuffer(bytes(pixels),
+                                 dtype=numpy.uint8).reshape((-1, 3)),
+                levels[[1, 0, 2]].T)
+            # ArtSync follows the frame.
+            assert packets[3] == (b'Art-Net\x00' + struct.pack('<H', 0x5200)
+                                  + struct.pack('>H', 14) + bytes(2))
+    finally:
+        output.socket.close()
+        sock.close()
+
+
+def test_no_sync():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.2)
+    output = ArtNetOutput('127.0.0.1', 10, port=sock.getsockname()[1])
+    try:
+        output.output(numpy.ones((3, 10)))
+        packet = sock.recv(1 << 16)
+        assert unpack_dmx_header(packet) == (0x5000, 14, 1, 0, 0, 30)
+        assert packet[18:] == b'\xff' * 30
+        # Only one universe, and no ArtSync.
+        try:
+            sock.recv(1 << 16)
+            assert False, "unexpected packet"
+        except socket.timeout:
+            pass
+    finally:
+        output.socket.close()
+        sock.close()
@@ -0,0 +1,58 @@
+import numpy
+
+from lightoy.effects.cylinder import Cylinder
+from lightoy.effects.effect import Effect
+from lightoy.geometry import get_coordinates
+from lightoy.input import InputState
+
+INPUTS = InputState(focus_x=0., focus_y=0., fade=0., touches=(), clients=())
+
+
+class OldStyle(Effect):
+    """An effect whose hooks don't take coords."""
+    def init_state(self):
+        return {'frames': 0}
+
+    @classmethod
+    def update_state(cls, x, t, t_diff, inputs, param, state):
+        state['frames'] += 1
+
+    @classmethod
+    def render(cls, x, t, t_diff, inputs, param, state):
+        return numpy.full((3, x.shape[1]), t)
+
+
+class NewStyle(Effect):
+    @classmethod
+    def render(cls, x, t, t_diff, inputs, param, state, coords=None):
+        return numpy.tile(coords.cylindrical[0], (3, 1))
+
+
+def test_hooks_without_coords():
+    x = numpy.random.RandomState(0).uniform(-1., 1., (3, 5))
+    effect = OldStyle(5)
+    numpy.testing.assert_array_equal(
+        effect.do_render(x, 2., 0.1, INPUTS, get_coordinates(x)), 2.)
+    effect.do_render(x, 3., 0.1, INPUTS)
+    assert effect.state['frames'] == 2
+
+
+def test_hooks_with_coords():
+    x = numpy.random.RandomState(0).uniform(-1., 1., (3, 5))
+    coords = get_coordinates(x)
+    expected = numpy.tile(coords.cylindrical[0], (3, 1))
+    numpy.testing.assert_allclose(
+        NewStyle(5).do_render(x, 0., 0., INPUTS, coords), expected)
+    # Computed from x if not given.
+    numpy.testing.assert_allclose(
+        NewStyle(5).do_render(x, 0., 0., INPUTS), expected)
+
+
+def test_render_without_coords():
+    x = numpy.random.RandomState(0).uniform(-1., 1., (3, 5))
+    effect = Cylinder(5)
+    expected = effect.render(x, 1.5, 0., INPUTS, effect.params, effect.state,
+                             get_coordinates(x)).copy()
+    numpy.testing.assert_allclose(
+        effect.render(x, 1.5, 0., INPUTS, effect.params, effect.state),
+        expected)
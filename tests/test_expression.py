@@ -0,0 +1,123 @@
+import re
+
+import numpy
+import pytest
+
+from lightoy.effects.expression import compile_formulas
+from lightoy.geometry import get_coordinates
+
+# The formulas' functions, for evaluating them directly with NumPy.
+NUMPY_FUNCTIONS = {
+    'sin': numpy.sin, 'cos': numpy.cos, 'tan': numpy.tan,
+    'tanh': numpy.tanh, 'exp': numpy.exp, 'log': numpy.log,
+    'sqrt': numpy.sqrt, 'abs': numpy.absolute, 'arctan2': numpy.arctan2,
+    'minimum': numpy.minimum, 'maximum': numpy.maximum, 'mod': numpy.mod,
+    'clip': numpy.clip,
+}
+
+
+def make_coords(num_leds=50):
+    rng = numpy.random.RandomState(0)
+    return get_coordinates(rng.uniform(-1., 1., (3, num_leds)))
+
+
+def evaluate(formulas, definitions, coords, scalars):
+    """Evaluates the formulas with plain NumPy."""
+    namespace = dict(NUMPY_FUNCTIONS)
+    namespace.update(scalars)
+    namespace.update({
+        'x': coords.xyz[0], 'y': coords.xyz[1], 'z': coords.xyz[2],
+        'r': coords.cylindrical[0], 'theta': coords.cylindrical[1],
+        'h': coords.cylindrical[2], 'rho': coords.spherical[0],
+        'phi': coords.spherical[2], 'arc_length': coords.arc_length,
+    })
+    for name, formula in definitions:
+        namespace[name] = eval(formula, namespace)
+    return numpy.array([numpy.broadcast_to(eval(formula, namespace),
+                                           coords.xyz[0].shape)
+                        for formula in formulas])
+
+
+def run(formulas, definitions=(), scalars=None, coords=None):
+    """Runs the compiled kernel with garbage in its output and temporaries,
+    and checks it against evaluate()."""
+    scalars = scalars or {'t': 1.25, 'speed': -0.5}
+    coords = coords or make_coords()
+    kernel, source, num_temps = compile_formulas(formulas, definitions,
+                                                 scalars.keys())
+    num_leds = coords.xyz.shape[1]
+    out = numpy.full((len(formulas), num_leds), numpy.nan)
+    temps = numpy.full((num_temps, num_leds), numpy.nan)
+    expected = evaluate(formulas, definitions, coords, scalars)
+    # Twice, so that values left in the temporaries don't matter.
+    for _ in range(2):
+        kernel(coords, scalars, out, temps)
+        numpy.testing.assert_allclose(out, expected, rtol=1e-12,
+                                      atol=1e-12)
+    return source, num_temps
+
+
+@pytest.mark.parametrize('formulas,definitions', [
+    (['x', 'y * 2', 'z - t'], ()),
+    (['sin(x * 3 + t) * 0.5 + 0.5', 'mod(theta / 6.28 + t * speed, 1)',
+      'clip(rho * 2 - 1, 0, 1)'], ()),
+    (['-x ** 2 + abs(y)', 'arctan2(y, x) + phi', 'exp(-r) * tanh(h)'], ()),
+    (['minimum(x, y) * maximum(z, 0.25)', 'sqrt(r + 1) / (log(rho + 2))',
+      'cos(arc_length * 3.14) + tan(0.1 * x)'], ()),
+    (['wave', 'wave * falloff', '1 - falloff'],
+     [('falloff', 'exp(-r * 2)'), ('wave', 'sin(h * 5 - t) * falloff')]),
+    # Constants and per-frame values only.
+    (['1 + 2 * 3', 't * speed', 'sin(t) + 1'], ()),
+])
+def test_matches_numpy(formulas, definitions):
+    run(formulas, definitions)
+
+
+def test_common_subexpressions_computed_once():
+    source, _ = run(['sin(x * 3) + 1', 'sin(x * 3) * t * 2',
+                     'sin(x * 3) - t * 2'])
+    assert source.count('numpy.sin(') == 1
+    assert source.count('numpy.multiply(coords.xyz[0], 3.0') == 1
+    # t * 2 doesn't depend on the LEDs: it's computed once, as a float.
+    assert len(re.findall(r"= \(scalars\['t'\] \* 2.0\)", source)) == 1
+
+
+def test_definitions_computed_once():
+    source, _ = run(['d + 1', 'd * 2', 'd'],
+                    [('d', 'sqrt(x * x + y * y)')])
+    assert source.count('numpy.sqrt(') == 1
+    # The same output in two rows is computed once, and copied.
+    source, _ = run(['sin(x)', 'sin(x)', 'sin(x) * 2'])
+    assert source.count('numpy.sin(') == 1
+
+
+def test_temporaries_reused():
+    formulas = ['((x + 1) * (y + 2) - z * 3) / (r + 4) + (h + 5) * (rho + 6)',
+                'x', 't * 2 + 1']
+    source, num_temps = run(formulas)
+    # Many intermediate arrays, but only a few temporaries, some of which
+    # are written to while they're also inputs.
+    assert source.count('out=temps[') >= 8
+    assert num_temps <= 3
+    in_place = [args for args, temp in re.findall(
+                    r'numpy\.\w+\((.*), out=(temps\[\d+\])\)', source)
+                if temp in args.split(', ')]
+    assert in_place
+
+
+def test_output_rows_read_by_later_nodes():
+    # The first output is written to its row directly, and then read by the
+    # second and third.
+    source, _ = run(['sin(x) + y', '(sin(x) + y) * 2', '(sin(x) + y) - z'])
+    assert 'out=out[0]' in source
+
+
+def test_errors():
+    with pytest.raises(Exception):
+        compile_formulas(['unknown * 2'])
+    with pytest.raises(Exception):
+        compile_formulas(['x +'])
+    with pytest.raises(Exception):
+        compile_formulas(['x[0]'])
+    with pytest.raises(Exception):
+        compile_formulas(['x'], [('x', 'y')])
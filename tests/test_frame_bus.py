@@ -0,0 +1,60 @@
+import numpy
+
+from lightoy.frame_bus import (FrameBus, FrameBusReader, decode_message,
+                               encode_message)
+
+
+def make_frame(num_leds, i):
+    return numpy.linspace(0, 1, 3 * num_leds).reshape((3, -1)) * i / 10.
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'frames')
+    bus = FrameBus(filename, 10, capacity=3, every=2)
+    reader = FrameBusReader(filename)
+    assert (reader.num_leds, reader.capacity) == (10, 3)
+    assert reader.get_sequence() == 0
+    assert reader.read_frame(1) is None
+    for i in range(1, 9):
+        bus.publish(make_frame(10, i), i * 0.5)
+    # Every other frame is published, and the last 3 of them are kept.
+    assert reader.get_sequence() == 4
+    assert reader.wait_for_frame(3, timeout=0) == 4
+    assert reader.wait_for_frame(4, timeout=0) is None
+    assert reader.read_frame(1) is None
+    for sequence in (2, 3, 4):
+        t, frame = reader.read_frame(sequence)
+        assert t == sequence
+        numpy.testing.assert_allclose(frame, make_frame(10, 2 * sequence),
+                                      rtol=1e-6)
+    assert reader.read_frame(5) is None
+    reader.close()
+    bus.close()
+
+
+def test_read_frame_overwritten_while_copied(tmp_path):
+    filename = str(tmp_path / 'frames')
+    bus = FrameBus(filename, 10, capacity=2)
+    bus.publish(make_frame(10, 1), 0.)
+
+    class OverwritingReader(FrameBusReader):
+        def get_frame(self, sequence):
+            # The ring wraps around after the frame is found, but before it's
+            # copied.
+            frame = super().get_frame(sequence)
+            for i in range(self.capacity):
+                bus.publish(make_frame(10, 2 + i), 1. + i)
+            return frame
+
+    reader = OverwritingReader(filename)
+    assert reader.read_frame(1) is None
+    assert reader.get_sequence() == 3
+    reader.close()
+    bus.close()
+
+
+def test_message_round_trip():
+    colors = make_frame(7, 3)
+    sequence, t, decoded = decode_message(encode_message(12, 3.5, colors))
+    assert (sequence, t) == (12, 3.5)
+    numpy.testing.assert_allclose(decoded, colors, rtol=1e-6)
@@ -0,0 +1,176 @@
+import math
+import os
+
+import numpy
+import pytest
+
+from lightoy.effects.cylinder import Cylinder
+from lightoy.effects.effect import Effect, get_common_period
+from lightoy.frame_cache import FrameCache
+from lightoy.geometry import get_coordinates
+from lightoy.input import InputState
+import lightoy.params
+
+NUM_LEDS = 8
+INPUTS = InputState(focus_x=0., focus_y=0., fade=0., touches=(), clients=())
+
+
+class Ramp(Effect):
+    """A periodic effect whose colors are the time, counting its renders."""
+    def __init__(self, n_leds):
+        super(Ramp, self).__init__(n_leds)
+        self.num_renders = 0
+
+    def init_params(self):
+        return {'period': lightoy.params.Scalar(0., 10., 1.)}
+
+    @classmethod
+    def get_period(cls, param):
+        return param['period'].get_value()
+
+    def do_render(self, x, t, t_diff, inputs, coords=None):
+        self.num_renders += 1
+        return numpy.full((3, x.shape[1]), t)
+
+
+def make_coords(num_leds=NUM_LEDS):
+    rng = numpy.random.RandomState(0)
+    return get_coordinates(rng.uniform(-1., 1., (3, num_leds)))
+
+
+def render(cache, effect, t, coords, name='ramp'):
+    return cache.render(name, effect, coords.xyz, t, 0., INPUTS, coords)
+
+
+def cache_bytes(num_frames, num_leds=NUM_LEDS):
+    return num_frames * 3 * num_leds * 4
+
+
+def test_get_common_period():
+    assert get_common_period([2., 3.]) == pytest.approx(2. * math.pi)
+    assert get_common_period([-2., 3.]) == pytest.approx(2. * math.pi)
+    assert get_common_period([0.5, 1. / 3.]) == pytest.approx(12. * math.pi)
+    assert get_common_period([3., 3.4, 3.8, 2.]) == \
+        pytest.approx(10. * math.pi)
+    # Zero frequencies are ignored.
+    assert get_common_period([2., 0., 3.]) == pytest.approx(2. * math.pi)
+    assert get_common_period([0., 0.]) == 0.
+    assert get_common_period([]) == 0.
+    # Incommensurate frequencies.
+    assert get_common_period([1., math.sqrt(2.)]) is None
+    assert get_common_period([math.pi]) is None
+
+
+def test_frame_index():
+    coords = make_coords()
+    effect = Ramp(NUM_LEDS)
+    cache = FrameCache(NUM_LEDS, bake_fps=10., bake_per_frame=0)
+    # Frame i is baked at t = i / 10, and shown for the closest times.
+    for t, frame_t in [(0., 0.), (0.34, 0.3), (0.36, 0.4), (3.42, 0.4),
+                       (2.96, 0.), (-0.25, 0.8)]:
+        numpy.testing.assert_allclose(render(cache, effect, t, coords),
+                                      frame_t, rtol=1e-6, atol=1e-7)
+    # Each frame was only rendered once: frames 0, 3, 4 and 8.
+    assert effect.num_renders == 4
+
+
+def test_bake_ahead():
+    coords = make_coords()
+    effect = Ramp(NUM_LEDS)
+    cache = FrameCache(NUM_LEDS, bake_fps=10., bake_per_frame=2)
+    render(cache, effect, 0.5, coords)
+    assert effect.num_renders == 3
+    baked, = cache.baked_effects.values()
+    assert list(numpy.flatnonzero(baked.baked)) == [5, 6, 7]
+    # Two more frames each time, until all 10 are baked.
+    for _ in range(4):
+        render(cache, effect, 0.5, coords)
+    assert baked.is_complete()
+    assert effect.num_renders == 10
+
+
+def test_parameter_changes_key():
+    coords = make_coords()
+    effect = Ramp(NUM_LEDS)
+    cache = FrameCache(NUM_LEDS, bake_fps=10., bake_per_frame=0)
+    render(cache, effect, 0.3, coords)
+    effect.params['period'].set_value(2.)
+    numpy.testing.assert_allclose(render(cache, effect, 1.5, coords), 1.5,
+                                  rtol=1e-6)
+    assert len(cache.baked_effects) == 2
+    assert cache.num_bytes == cache_bytes(10) + cache_bytes(20)
+    # Changing it back reuses the first cache.
+    effect.params['period'].set_value(1.)
+    render(cache, effect, 0.3, coords)
+    assert effect.num_renders == 2
+    assert len(cache.baked_effects) == 2
+
+
+def test_lru_eviction():
+    coords = make_coords()
+    effect = Ramp(NUM_LEDS)
+    # Room for two caches of 10 frames.
+    cache = FrameCache(NUM_LEDS, max_bytes=2 * cache_bytes(10), bake_fps=10.,
+                       bake_per_frame=0)
+    for name in ('a', 'b'):
+        render(cache, effect, 0., coords, name)
+    # Using 'a' makes 'b' the least recently used.
+    render(cache, effect, 0., coords, 'a')
+    render(cache, effect, 0., coords, 'c')
+    assert [key[0] for key in cache.baked_effects] == ['a', 'c']
+    assert cache.num_bytes == 2 * cache_bytes(10)
+    # A cache that doesn't fit at all isn't used.
+    effect.params['period'].set_value(3.)
+    assert render(cache, effect, 0., coords, 'd') is None
+    assert cache.num_bytes == 2 * cache_bytes(10)
+
+
+def test_spill_and_reload(tmp_path):
+    spill_dir = str(tmp_path / 'spill')
+    coords = make_coords()
+    effect = Ramp(NUM_LEDS)
+    cache = FrameCache(NUM_LEDS, max_bytes=cache_bytes(10),
+                       spill_dir=spill_dir, bake_fps=10., bake_per_frame=10)
+    # Complete, then evicted by another cache.
+    render(cache, effect, 0., coords, 'a')
+    render(cache, effect, 0., coords, 'b')
+    assert [key[0] for key in cache.baked_effects] == ['b']
+    assert len(os.listdir(spill_dir)) == 1
+
+    # Another cache (e.g. in a later session) loads it instead of baking.
+    effect.num_renders = 0
+    cache = FrameCache(NUM_LEDS, max_bytes=cache_bytes(10),
+                       spill_dir=spill_dir, bake_fps=10., bake_per_frame=10)
+    numpy.testing.assert_allclose(render(cache, effect, 0.7, coords, 'a'),
+                                  0.7, rtol=1e-6)
+    assert effect.num_renders == 0
+    baked, = cache.baked_effects.values()
+    assert baked.is_complete()
+
+    # Spilled frames of the wrong shape are ignored.
+    key, = cache.baked_effects.keys()
+    numpy.save(cache._get_spill_filename(key),
+               numpy.zeros((10, 3, NUM_LEDS + 1), dtype=numpy.float32))
+    cache = FrameCache(NUM_LEDS, max_bytes=cache_bytes(10),
+                       spill_dir=spill_dir, bake_fps=10., bake_per_frame=0)
+    numpy.testing.assert_allclose(render(cache, effect, 0.7, coords, 'a'),
+                                  0.7, rtol=1e-6)
+    assert effect.num_renders == 1
+
+
+def test_baked_cylinder_matches_render():
+    coords = make_coords(20)
+    baked_effect = Cylinder(20)
+    effect = Cylinder(20)
+    period = Cylinder.get_period(effect.params)
+    assert period == pytest.approx(10. * math.pi)
+    cache = FrameCache(20, bake_fps=10., bake_per_frame=0)
+    num_frames = int(round(period * 10.))
+    for index in (0, 1, 157, num_frames - 1):
+        t = index * period / num_frames
+        expected = effect.do_render(coords.xyz, t, 0., INPUTS, coords)
+        for shown_t in (t, t + period, t + 0.01):
+            numpy.testing.assert_allclose(
+                cache.render('cylinder', baked_effect, coords.xyz, shown_t,
+                             0., INPUTS, coords),
+                expected, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,43 @@
+import numpy
+import pytest
+
+from lightoy.output import Output, ThreadedOutput
+
+
+class ListOutput(Output):
+    def __init__(self, fail_after=None):
+        self.frames = []
+        self.fail_after = fail_after
+
+    def output(self, colors):
+        if self.fail_after is not None and \
+                len(self.frames) >= self.fail_after:
+            raise IOError("device unplugged")
+        self.frames.append(colors.copy())
+
+
+def test_threaded_output_flushes_on_close():
+    wrapped = ListOutput()
+    output = ThreadedOutput(wrapped, queue_size=10)
+    for i in range(5):
+        output.output(numpy.full((3, 4), i / 10.))
+    output.close()
+    assert [frame[0, 0] for frame in wrapped.frames] == \
+        [0., 0.1, 0.2, 0.3, 0.4]
+    assert output.get_metrics()['frames_written'] == 5
+
+
+def test_threaded_output_failure_is_raised():
+    output = ThreadedOutput(ListOutput(fail_after=1), queue_size=10)
+    output.output(numpy.zeros((3, 4)))
+    output.output(numpy.zeros((3, 4)))
+    output.writer_thread.join(5.)
+    assert not output.writer_thread.is_alive()
+    with pytest.raises(IOError):
+        output.output(numpy.zeros((3, 4)))
+    output.close()
+
+
+def test_threaded_output_queue_size():
+    with pytest.raises(Exception):
+        ThreadedOutput(ListOutput(), queue_size=0)
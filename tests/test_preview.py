@@ -0,0 +1,41 @@
+import numpy
+
+from lightoy.preview import downsample, encode_frame, get_groups
+
+
+def test_get_groups():
+    numpy.testing.assert_array_equal(get_groups(10, 5), [0, 2, 4, 6, 8])
+    numpy.testing.assert_array_equal(get_groups(10, 4), [0, 2, 5, 7])
+    # No more groups than LEDs, and at least one.
+    numpy.testing.assert_array_equal(get_groups(3, 500), [0, 1, 2])
+    numpy.testing.assert_array_equal(get_groups(0, 500), [0])
+    for num_leds in (1, 7, 300, 1001):
+        groups = get_groups(num_leds, 100)
+        assert len(groups) == min(num_leds, 100)
+        assert groups[0] == 0
+        assert numpy.all(numpy.diff(groups) > 0)
+        assert groups[-1] < num_leds
+
+
+def test_downsample():
+    values = numpy.arange(20.).reshape((2, 10))
+    numpy.testing.assert_allclose(downsample(values, get_groups(10, 4)), [
+        [0.5, 3., 5.5, 8.],
+        [10.5, 13., 15.5, 18.],
+    ])
+    numpy.testing.assert_array_equal(
+        downsample(values, get_groups(10, 10)), values)
+
+
+def test_encode_frame():
+    colors = numpy.array([
+        [0., 1., 0.5, -1.],
+        [0.2, 0., 2., 0.],
+        [1., 0.1, 0., 0.],
+    ])
+    data = encode_frame(2 ** 32 + 5, colors)
+    assert data[:4] == b'\x05\x00\x00\x00'
+    assert list(data[4:]) == [0, 51, 255,
+                              255, 0, 26,
+                              128, 255, 0,
+                              0, 0, 0]
@@ -0,0 +1,105 @@
+import threading
+
+import numpy
+
+from lightoy.output import Output
+from lightoy.recording import (EFFECT_NAME_SIZE, FrameRecorder, Recording,
+                               RecordingPlayer)
+from lightoy.serial_protocol import encode_pixels
+
+NUM_LEDS = 6
+
+
+class PixelsOutput(Output):
+    """Keeps copies of the LED bytes passed to it."""
+    def __init__(self):
+        self.pixels = []
+
+    def output_pixels(self, pixels):
+        self.pixels.append(numpy.array(pixels))
+
+
+def make_colors(i):
+    return (numpy.arange(3 * NUM_LEDS).reshape((3, -1)) * (i + 1) % 17) / 16.
+
+
+def encode(colors):
+    pixels = numpy.zeros((NUM_LEDS, 3), dtype=numpy.uint8)
+    encode_pixels(colors, pixels, numpy.zeros(colors.shape))
+    return pixels
+
+
+def record(filename, num_frames, capacity, effect_name='wavy'):
+    recorder = FrameRecorder(filename, NUM_LEDS, capacity, params_size=64)
+    for i in range(num_frames):
+        recorder.record(make_colors(i), i * 0.01, effect_name,
+                        {'global': {'brightness': i / 10.}})
+    recorder.close()
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'recording')
+    record(filename, 3, capacity=5)
+    recording = Recording(filename)
+    assert len(recording) == 3
+    for i, frame in enumerate(recording):
+        assert frame.t == i * 0.01
+        assert frame.effect_name == 'wavy'
+        assert frame.params == {'global': {'brightness': i / 10.}}
+        numpy.testing.assert_array_equal(frame.pixels,
+                                         encode(make_colors(i)))
+    # The frames' pixels are views of the recording.
+    del frame
+    recording.close()
+
+
+def test_ring_wraps_around(tmp_path):
+    filename = str(tmp_path / 'recording')
+    record(filename, 12, capacity=5)
+    recording = Recording(filename)
+    # The last 5 frames, oldest first.
+    assert len(recording) == 5
+    assert [frame.t for frame in recording] == \
+        [i * 0.01 for i in range(7, 12)]
+    for i, frame in zip(range(7, 12), recording):
+        numpy.testing.assert_array_equal(frame.pixels,
+                                         encode(make_colors(i)))
+    del frame
+    recording.close()
+
+
+def test_long_effect_name(tmp_path):
+    filename = str(tmp_path / 'recording')
+    # 3-byte characters, which don't fit exactly in EFFECT_NAME_SIZE bytes.
+    name = u'☃' * EFFECT_NAME_SIZE
+    record(filename, 1, capacity=1, effect_name=name)
+    recording = Recording(filename)
+    assert recording.get_frame(0).effect_name == \
+        name[:EFFECT_NAME_SIZE // 3]
+    recording.close()
+
+
+def test_player(tmp_path):
+    filename = str(tmp_path / 'recording')
+    record(filename, 8, capacity=5)
+    recording = Recording(filename)
+    output = PixelsOutput()
+    RecordingPlayer(recording, output, speed=100.).play()
+    assert len(output.pixels) == 5
+    for i, pixels in zip(range(3, 8), output.pixels):
+        numpy.testing.assert_array_equal(pixels, encode(make_colors(i)))
+
+    # Looping, until stopped.
+    output = PixelsOutput()
+    player = RecordingPlayer(recording, output, speed=100., loop=True)
+    thread = threading.Thread(target=player.play)
+    thread.start()
+    while len(output.pixels) < 12:
+        thread.join(0.01)
+    player.stop()
+    thread.join(5.)
+    assert not thread.is_alive()
+    for i, pixels in enumerate(output.pixels):
+        numpy.testing.assert_array_equal(pixels,
+                                         encode(make_colors(3 + i % 5)))
+    recording.close()
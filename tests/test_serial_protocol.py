@@ -0,0 +1,112 @@
+import numpy
+
+from lightoy.serial_protocol import (DELTA_HEADER, FULL_HEADER, MAX_RUN,
+                                     OP_FILL, OP_SKIP, FrameDecoder,
+                                     encode_delta)
+
+
+def encode_frames(frames):
+    """Encodes frames as SerialOutput does with compression: a keyframe, then
+    deltas where they're smaller."""
+    data = bytearray(FULL_HEADER + frames[0].tobytes())
+    for previous, pixels in zip(frames, frames[1:]):
+        delta = bytearray(DELTA_HEADER)
+        if encode_delta(pixels, previous, delta):
+            data += delta
+        else:
+            data += FULL_HEADER + pixels.tobytes()
+    return bytes(data)
+
+
+def decode(data, num_leds, chunk_size=None):
+    decoder = FrameDecoder(num_leds)
+    if chunk_size is None:
+        return decoder.feed(data)
+    frames = []
+    for i in range(0, len(data), chunk_size):
+        frames += decoder.feed(data[i:i + chunk_size])
+    return frames
+
+
+def edge_frames(num_leds):
+    """Frames whose changes are at the edges of the LEDs and of the runs."""
+    frames = [numpy.zeros((num_leds, 3), dtype=numpy.uint8)]
+
+    def change(leds, color):
+        pixels = frames[-1].copy()
+        pixels[leds] = color
+        frames.append(pixels)
+
+    # The first and last LEDs.
+    change([0], (1, 2, 3))
+    change([num_leds - 1], (4, 5, 6))
+    change([0, num_leds - 1], (7, 8, 9))
+    # Fills of exactly MAX_RUN LEDs, one more, and ending at the last LED.
+    change(slice(0, MAX_RUN), (10, 11, 12))
+    change(slice(MAX_RUN, 2 * MAX_RUN + 1), (13, 14, 15))
+    change(slice(num_leds - MAX_RUN - 1, num_leds), (16, 17, 18))
+    # Literal runs crossing run boundaries.
+    pixels = frames[-1].copy()
+    pixels[MAX_RUN - 3:2 * MAX_RUN + 3] = numpy.arange(
+        3 * (MAX_RUN + 6)).reshape((-1, 3)) % 256
+    frames.append(pixels)
+    # Unchanged frame: a delta of skips only.
+    frames.append(frames[-1].copy())
+    return frames
+
+
+def test_delta_round_trip_at_edges():
+    frames = edge_frames(300)
+    data = encode_frames(frames)
+    # Deltas are actually used.
+    assert data.count(DELTA_HEADER) >= len(frames) - 2
+    decoded = decode(data, 300)
+    assert len(decoded) == len(frames)
+    for got, want in zip(decoded, frames):
+        numpy.testing.assert_array_equal(got, want)
+
+
+def test_delta_round_trip_random():
+    rng = numpy.random.RandomState(0)
+    frames = [rng.randint(0, 256, (200, 3)).astype(numpy.uint8)]
+    for _ in range(50):
+        pixels = frames[-1].copy()
+        start = rng.randint(0, 200)
+        stop = rng.randint(start, 201)
+        if rng.rand() < 0.5:
+            pixels[start:stop] = rng.randint(0, 256, 3)
+        else:
+            pixels[start:stop] = rng.randint(0, 256, (stop - start, 3))
+        frames.append(pixels)
+    decoded = decode(encode_frames(frames), 200, chunk_size=7)
+    assert len(decoded) == len(frames)
+    for got, want in zip(decoded, frames):
+        numpy.testing.assert_array_equal(got, want)
+
+
+def test_fewer_leds_than_sent():
+    # As with the default 300 LEDs sent to a 250 LED board: runs crossing
+    # the last LED are clamped, and the rest of the frame is ignored.
+    frames = edge_frames(300)
+    decoded = decode(encode_frames(frames), 250)
+    assert len(decoded) == len(frames)
+    for got, want in zip(decoded, frames):
+        numpy.testing.assert_array_equal(got, want[:250])
+
+
+def test_fill_run_crossing_last_led():
+    data = (FULL_HEADER + bytes(3 * 10) + DELTA_HEADER +
+            bytes([(OP_SKIP << 6) | 7, (OP_FILL << 6) | 3, 1, 2, 3]))
+    decoded = decode(data, 10)
+    assert len(decoded) == 2
+    numpy.testing.assert_array_equal(decoded[1][:8], 0)
+    numpy.testing.assert_array_equal(decoded[1][8:], [[1, 2, 3]] * 2)
+
+
+def test_resync_after_corrupt_delta():
+    pixels = numpy.full((10, 3), 5, dtype=numpy.uint8)
+    data = (DELTA_HEADER + bytes([0xc0]) + b'garbage' +
+            FULL_HEADER + pixels.tobytes())
+    decoded = decode(data, 10)
+    assert len(decoded) == 1
+    numpy.testing.assert_array_equal(decoded[0], pixels)